@@ -39,6 +39,23 @@ class MeanCovarianceExtractor(object):
         self.sum_frames += np.sum(sample, axis=0, keepdims=True)
         self.sum_product_frames += np.dot(np.transpose(sample), sample)
 
+    def remove_sample(self, sample):
+        """Remove a previously added sample from the statistics (exact up to floating point rounding)."""
+        self.sum_length -= len(sample)
+
+        self.sum_frames -= np.sum(sample, axis=0, keepdims=True)
+        self.sum_product_frames -= np.dot(np.transpose(sample), sample)
+
+    def merge(self, other):
+        """
+        Add the statistics collected by another extractor (e.g. in a different process). Merging the extractors of
+        single samples in order gives exactly the same result as adding the samples to one extractor.
+        """
+        self.sum_length += other.sum_length
+
+        self.sum_frames += other.sum_frames
+        self.sum_product_frames += other.sum_product_frames
+
     def get_params(self):
         mean = self.sum_frames / self.sum_length
         mean_product = np.dot(np.transpose(mean), mean)
@@ -98,6 +115,19 @@ class MeanCovarianceExtractor(object):
 
         return stats, labels_len
 
+    @staticmethod
+    def from_stats(file_path, datatype=np.float64):
+        """Create an extractor which continues with the statistics saved by save_stats."""
+        stats, sum_length = MeanCovarianceExtractor.load_stats(file_path, datatype)
+        sum_frames, sum_product_frames = np.split(np.array(stats, dtype=np.float64), (1,), axis=0)
+
+        extractor = MeanCovarianceExtractor()
+        extractor.sum_length = sum_length
+        extractor.sum_frames = sum_frames
+        extractor.sum_product_frames = sum_product_frames
+
+        return extractor
+
     @staticmethod
     def load(file_path, datatype=np.float64):
         if datatype is np.str:
@@ -43,6 +43,28 @@ class MeanStdDevExtractor(object):
             self.sum_frames += np.sum(sample, axis=0)
             self.sum_squared_frames += np.sum(sample**2, axis=0)
 
+    def remove_sample(self, sample):
+        """Remove a previously added sample from the statistics (exact up to floating point rounding)."""
+        self.sum_length -= len(sample)
+        self.sum_frames -= np.sum(sample, axis=0)
+        self.sum_squared_frames -= np.sum(sample**2, axis=0)
+
+    def merge(self, other):
+        """
+        Add the statistics collected by another extractor (e.g. in a different process). Merging the extractors of
+        single samples in order gives exactly the same result as adding the samples to one extractor.
+        """
+        if other.sum_frames is None:
+            return
+
+        self.sum_length += other.sum_length
+        if self.sum_frames is None:
+            self.sum_frames = np.copy(other.sum_frames)
+            self.sum_squared_frames = np.copy(other.sum_squared_frames)
+        else:
+            self.sum_frames += other.sum_frames
+            self.sum_squared_frames += other.sum_squared_frames
+
     def get_params(self):
 
         mean = self.sum_frames / self.sum_length
@@ -100,6 +122,18 @@ class MeanStdDevExtractor(object):
 
         return stats, labels_len
 
+    @staticmethod
+    def from_stats(file_path, datatype=np.float64):
+        """Create an extractor which continues with the statistics saved by save_stats."""
+        stats, sum_length = MeanStdDevExtractor.load_stats(file_path, datatype)
+
+        extractor = MeanStdDevExtractor()
+        extractor.sum_length = sum_length
+        extractor.sum_frames = np.array(stats[0], dtype=np.float64)
+        extractor.sum_squared_frames = np.array(stats[1], dtype=np.float64)
+
+        return extractor
+
     @staticmethod
     def load(file_path, datatype=np.float64):
         if datatype is np.str:
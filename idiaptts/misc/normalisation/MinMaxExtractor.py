@@ -39,6 +39,18 @@ class MinMaxExtractor(object):
             self.combined_min = np.minimum(self.combined_min, sample.min(axis=0))
             self.combined_max = np.maximum(self.combined_max, sample.max(axis=0))
 
+    def merge(self, other):
+        """Add the minimum and maximum collected by another extractor (e.g. in a different process)."""
+        if other.combined_min is None:
+            return
+
+        if self.combined_min is None:
+            self.combined_min = np.copy(other.combined_min)
+            self.combined_max = np.copy(other.combined_max)
+        else:
+            self.combined_min = np.minimum(self.combined_min, other.combined_min)
+            self.combined_max = np.maximum(self.combined_max, other.combined_max)
+
     def get_params(self):
         return self.combined_min, self.combined_max
 
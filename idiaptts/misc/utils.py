@@ -32,51 +32,82 @@ def file_len(fname):
     return i + 1
 
 
-def interpolate_lin(data):
+def interpolate_lin(data, axis=None):
     """
     Create continuous f0/lf0 and vuv from uncontinuous f0/lf0.
-    Code from merlin/src/frontend/acoustic_normalisation.
+    Vectorised version of the loop in merlin/src/frontend/acoustic_normalisation with identical results.
     https://github.com/CSTR-Edinburgh/merlin
 
-    :return:  interpolated_f0, vuv_vector
+    Unvoiced frames (<= 0) between two voiced frames are interpolated linearly, a leading gap is filled with the
+    first voiced value and a trailing gap with the last voiced value. As in the original code, a gap which reaches
+    the second to last frame counts as trailing gap, i.e. a voiced last frame after it is overwritten too.
+
+    :param data:      Contour(s) of f0/lf0 values.
+    :param axis:      If None, data is flattened and treated as a single contour, results have shape T x 1.
+                      Otherwise each 1D slice along the given axis is interpolated independently (e.g. a batch of
+                      B x T contours with axis=1) and results have the same shape as data.
+    :return:          interpolated_f0, vuv_vector
     """
 
-    data = np.reshape(np.copy(data), (data.size, 1))
-
-    vuv_vector = np.zeros((data.size, 1))
-    vuv_vector[data > 0.0] = 1.0
-    vuv_vector[data <= 0.0] = 0.0
-
-    ip_data = data
-
-    frame_number = data.size
-    last_value = 0.0
-    for i in range(frame_number):
-        if data[i] <= 0.0:
-            j = i + 1
-            # Jump over succeeding zero values.
-            for j in range(i + 1, frame_number):
-                if data[j] > 0.0:
-                    break
-            # Check if end of data is reached.
-            if j < frame_number - 1:
-                # If not and a valid last data point exists, interpolate linear between the two non-zero values.
-                if last_value > 0.0:
-                    step = (data[j] - data[i - 1]) / float(j - i)
-                    for k in range(i, j):
-                        ip_data[k] = data[i - 1] + step * (k - i + 1)
-                else:
-                    # If no valid last data point exists (zeros in the beginning) fill it with first valid value
-                    for k in range(i, j):
-                        ip_data[k] = data[j]
-            else:
-                # If end of data is reached (zeros in the end) fill it with last valid value.
-                for k in range(i, frame_number):
-                    ip_data[k] = last_value
-        else:
-            # Data is valid, so use it as interpolated data and save it as last valid value.
-            ip_data[i] = data[i]
-            last_value = data[i]
+    data = np.asarray(data)
+    if axis is None:
+        contours = np.reshape(data, (1, data.size))
+    else:
+        contours = np.moveaxis(data, axis, -1)
+        contours = np.reshape(contours, (-1, contours.shape[-1]))
+
+    ip_data, vuv_vector = _interpolate_lin_contours(contours)
+
+    if axis is None:
+        return ip_data.reshape((data.size, 1)), vuv_vector.reshape((data.size, 1))
+    else:
+        shape = np.moveaxis(data, axis, -1).shape
+        return np.moveaxis(ip_data.reshape(shape), -1, axis), np.moveaxis(vuv_vector.reshape(shape), -1, axis)
+
+
+def _interpolate_lin_contours(data):
+    """Implementation of interpolate_lin for contours in the rows of a 2D array."""
+    num_contours, frame_number = data.shape
+    ip_data = np.array(data, copy=True)
+    vuv_vector = (data > 0.0).astype(np.float64)
+
+    if frame_number == 0:
+        return ip_data, vuv_vector
+
+    is_gap = data <= 0.0
+    if frame_number > 1:
+        # A gap ending in the second to last frame is filled up to the end, including a voiced last frame.
+        is_gap[:, -1] |= is_gap[:, -2]
+    if not is_gap.any():
+        return ip_data, vuv_vector
+
+    # Index of the last voiced frame before and the first voiced frame after each frame.
+    frame_indices = np.arange(frame_number)
+    prev_index = np.maximum.accumulate(np.where(is_gap, -1, frame_indices), axis=1)
+    next_index = np.minimum.accumulate(np.where(is_gap, frame_number, frame_indices)[:, ::-1], axis=1)[:, ::-1]
+
+    rows, frames = np.nonzero(is_gap)
+    prev_index = prev_index[rows, frames]
+    next_index = next_index[rows, frames]
+    has_prev = prev_index >= 0
+    has_next = next_index < frame_number
+    prev_value = data[rows, np.maximum(prev_index, 0)]
+    next_value = data[rows, np.minimum(next_index, frame_number - 1)]
+
+    # Trailing gaps are filled with the last voiced value (zero if there is none).
+    values = np.where(has_prev, prev_value, np.zeros_like(prev_value))
+    # Leading gaps are filled with the first voiced value.
+    leading = has_next & ~has_prev
+    values[leading] = next_value[leading]
+    # Other gaps are interpolated linearly, reaching the next voiced value one frame before it as in merlin.
+    middle = has_next & has_prev
+    if middle.any():
+        dtype = values.dtype
+        step = (next_value[middle] - prev_value[middle])\
+            / (next_index[middle] - prev_index[middle] - 1).astype(dtype)
+        values[middle] = prev_value[middle] + step * (frames[middle] - prev_index[middle]).astype(dtype)
+
+    ip_data[rows, frames] = values
 
     return ip_data, vuv_vector
 
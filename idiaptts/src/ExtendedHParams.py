@@ -111,6 +111,10 @@ class ExtendedHParams(HParams):
             networks_dir="nn",
             checkpoints_dir="checkpoints",  # Subdirectory within the networks_dir to save checkpoints.
             epochs_per_checkpoint=1,  # Number of epochs between checkpoints, 0 for no checkpoints at all.
+            checkpoints_keep_last=0,  # Number of most recent checkpoints to keep, older ones are removed.
+            checkpoints_keep_best=0,  # Number of checkpoints with the lowest loss kept in addition to the last ones.
+            # All checkpoints are kept when both are 0. The -best checkpoint is never removed.
+            checkpoint_async=True,  # Write checkpoints during training on a background thread.
             save_final_model=True,  # Determines if the model is saved after training.
             use_best_as_final_model=True,  # Substitutes the saved final model with the best of the current run.
             gen_figure_ext=".pdf",
@@ -128,8 +132,10 @@ class ExtendedHParams(HParams):
             seed=None,  # Used to initialize torch, numpy, and random.
             # If None, the id_list is not shuffled before taking test and validation set from it.
             # fp16_run=False,  # TODO: Not implemented.
-            # distributed_run=False,  # TODO: Find out how distributed run works.
-            # dist_url="file://distributed.dpt",
+            distributed_backend=None,  # Set to "gloo" (CPU and GPU) or "nccl" (GPU) to train with
+            # DistributedDataParallel in one process per device or group of CPU cores. Start the processes with
+            # torchrun or ModelHandlerPyTorch.spawn_distributed. Each process uses one GPU, num_gpus is ignored.
+            distributed_init_method="env://",  # Read rank, world size, and master address from the environment.
             # cudnn_enabled=True,
             # cudnn_benchmark=False,
             use_gpu=False,
@@ -145,10 +151,23 @@ class ExtendedHParams(HParams):
             batch_size_benchmark=48,
             batch_size_synth=48,
             batch_size_gen_figure=48,
+            batch_max_frames_train=None,  # If set, training batches are formed by this budget of (padded) input frames
+            # instead of batch_size_train, grouping samples of similar length with a LengthBucketBatchSampler.
+            batch_max_frames_val=None,  # Same for the validation set instead of batch_size_val.
+            batch_num_buckets=10,  # Number of length buckets used when batch_max_frames_* is set.
+            dataset_length_index_file=None,  # Optional file to store the lengths of all samples used for bucketing.
             dataset_num_workers_gpu=4,  # Number of workers used in dataset when running on GPU(s).
             dataset_num_workers_cpu=0,  # Number of workers used in dataset when running on CPU(s).
             dataset_pin_memory=True,
             dataset_load_async=True,
+            dataset_cache_size_mb=0,  # Memory budget of an LRU cache of preprocessed samples per dataset, 0 disables it.
+            dataset_cache_shared=False,  # If True, the sample cache is kept in shared memory (/dev/shm) and used by
+            # all dataset workers instead of one LRU cache per worker. The oldest entries are evicted first.
+            dataset_compiled_dir=None,  # If set, the preprocessed and length matched training and validation samples
+            # are compiled once into this directory and training loads them from there, see CompiledDataset. The
+            # samples are compiled again when the normalisation parameters or the LabelGen settings change.
+            dataset_collate_num_buffers=0,  # Number of batch buffers reused in a ring by the default collate function.
+            # Only used with zero dataset workers, batches are then only valid until that many batches were loaded.
             teacher_forcing_in_test=False,  # If True, the targets are also given to the model when running the test
             # (needed for WaveNet).
             preload_next_batch_to_gpu=False,  # If True loads the next batch to GPU while processing the current one.
@@ -189,12 +208,21 @@ class ExtendedHParams(HParams):
             # If False the loss is averaged over each frame in the whole batch (default).
             backward_retain_graph=False,  # Determines if the gradient computation should do aggressive memory freeing.
             # Only needed when gradient computational graph is reused.
+            accumulation_steps=1,  # Number of batches whose gradients are accumulated before each optimiser step.
+            # The loss is normalised over all frames (or samples with loss_per_sample) of these batches, so the
+            # update equals one of a batch that many times larger. Schedulers and EMA step once per update.
             optimiser_type="Adam",  # "Adam", "SGD"  TODO: more
             optimiser_args=dict(),  # Set optimiser arguments. Preferred way to set learning rate: optimiser_args["lr"]=
             use_saved_learning_rate=True,  # Use the learning rate saved with a model after loading it.
             replace_inf_grads_by_zero=False,  # Automatically substitute +/- inf gradients with zero during training.
+            nan_check_interval=1,  # Number of batches after which the loss is checked for NaN, each check waits for
+            # the device. Training stops at a NaN loss. For intervals > 1 the model, optimiser, and EMA are then rolled
+            # back to the state of the last check and the returned loss is NaN. This state is copied at every check
+            # into CPU buffers (pinned when use_gpu), which costs host memory of the size of all three states and a
+            # device to host copy of them every nan_check_interval batches.
             # dynamic_loss_scaling=True,
             ema_decay=None,  # Any value enables EMA. EMA models are saved with a _ema in the end.
+            ema_update_interval=1,  # Update the EMA model only every k optimiser steps with the decay ema_decay ** k.
 
             scheduler_type="default",  # "None", "Plateau", "Exponential","Noam",  TODO: "Step", "Cyclic_cosine"
             scheduler_args=dict(),
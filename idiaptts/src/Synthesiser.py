@@ -224,12 +224,20 @@ class Synthesiser(object):
         assert hasattr(hparams, "frame_rate_output_Hz") and hparams.frame_rate_output_Hz is not None, \
             "hparams.frame_rate_output_Hz has to be set and match the trained WaveNet."
         in_to_out_multiplier = hparams.frame_rate_output_Hz / input_fs_Hz
+
+        model_handler = ModelHandlerPyTorch()
+        model_handler.model, *_ = model_handler.load_model(hparams.synth_vocoder_path,
+                                                           hparams,
+                                                           verbose=False)
+
+        if getattr(model_handler.model, "cond_upsampling", "loader") == "loader":
+            sampling_fn = partial(sample_linearly, in_to_out_multiplier=in_to_out_multiplier, dtype=np.float32)
+        else:
+            sampling_fn = None  # The model upsamples the frame rate features itself.
         # # dir_world_features = os.path.join(self.OutputGen.dir_labels, self.dir_extracted_acoustic_features)
         input_gen = WorldFeatLabelGen(None,
                                       add_deltas=False,
-                                      sampling_fn=partial(sample_linearly,
-                                                          in_to_out_multiplier=in_to_out_multiplier,
-                                                          dtype=np.float32))
+                                      sampling_fn=sampling_fn)
         # Load normalisation parameters for wavenet input.
         try:
             norm_params_path = os.path.splitext(hparams.synth_vocoder_path)[0] + "_norm_params.npy"
@@ -239,11 +247,6 @@ class Synthesiser(object):
                           "Please save them there with numpy.save().".format(norm_params_path))
             raise
 
-        model_handler = ModelHandlerPyTorch()
-        model_handler.model, *_ = model_handler.load_model(hparams.synth_vocoder_path,
-                                                           hparams,
-                                                           verbose=False)
-
         for id_name, output in synth_output.items():
             logging.info("Synthesise {} with {} vocoder.".format(id_name, hparams.synth_vocoder_path))
 
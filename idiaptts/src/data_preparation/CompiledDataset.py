@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Training-ready copy of a PyTorchLabelGensDataset. The preprocessed, length matched input/target pairs (including
+   embedding indices) are computed once and stored in two PackedFeatureStores, training streams from their memory maps.
+"""
+
+# System imports.
+import hashlib
+import json
+import logging
+import os
+
+# Third-party imports.
+import numpy as np
+from torch.utils.data import Dataset
+
+# Local source tree imports.
+from idiaptts.src.data_preparation.PackedFeatureStore import PackedFeatureStore
+from idiaptts.misc.utils import makedirs_safe
+
+
+class CompiledDataset(Dataset):
+    """
+    A compiled dataset in dir_compiled consists of the stores inputs.bin/.idx and targets.bin/.idx and a
+    compiled.json file containing the fingerprint of the source dataset and the feature shapes of the samples.
+    The json file is written last, so an interrupted compilation is never used.
+
+    The fingerprint covers the id list, the dataset settings, and all public attributes of the LabelGens of the
+    source dataset, which includes their normalisation parameters and the hparams they were created with. The
+    dataset is compiled again when the fingerprint changes. Functions (e.g. hparams.f_get_emb_index) are only
+    identified by their name, delete dir_compiled when their behaviour changes.
+
+    For random_select the full samples are compiled and the window is selected when a sample is loaded.
+    Samples are read-only views of the memory maps.
+    """
+    file_name_meta = "compiled.json"
+    name_inputs = "inputs"
+    name_targets = "targets"
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, dataset, dir_compiled, allow_compile=True):
+        """
+        Open the compiled version of dataset in dir_compiled, compile it first if it does not exist or is outdated.
+
+        :param dataset:           The source PyTorchLabelGensDataset.
+        :param dir_compiled:      Directory of the compiled dataset.
+        :param allow_compile:     If False, only open an existing up-to-date compilation, e.g. in all but the first
+                                  process of a distributed training after the first one compiled the dataset.
+        :raises ValueError:       If allow_compile is False and no up-to-date compilation exists.
+        """
+        self.dataset = dataset
+        self.dir_compiled = dir_compiled
+        self.id_list = list(dataset.id_list)
+        self.fingerprint = self.get_fingerprint(dataset)
+
+        meta = self._load_meta()
+        if meta is None or meta["fingerprint"] != self.fingerprint:
+            if not allow_compile:
+                raise ValueError("No up-to-date compiled dataset found in {}.".format(dir_compiled))
+            self.logger.info("Compile dataset of {} samples to {}.".format(len(self.id_list), dir_compiled))
+            meta = self.compile()
+        else:
+            self.logger.info("Use compiled dataset in {}.".format(dir_compiled))
+
+        self.shape_in = tuple(meta["shape_inputs"])
+        self.shape_out = tuple(meta["shape_targets"])
+        self.store_in = PackedFeatureStore(os.path.join(dir_compiled, self.name_inputs))
+        self.store_out = PackedFeatureStore(os.path.join(dir_compiled, self.name_targets))
+        self._lengths = None
+
+    @staticmethod
+    def get_fingerprint(dataset):
+        """Return a hex digest of everything of the source dataset that affects the compiled samples."""
+        hasher = hashlib.sha1()
+        CompiledDataset._update_hash(hasher, [dataset.id_list,
+                                              dataset.fun_getitem.__name__,
+                                              dataset.random_select,
+                                              dataset.len_in_out_multiplier,
+                                              dataset.f_get_emb_index])
+        for label_gen in (dataset.LabelGenIn, dataset.LabelGenOut):
+            CompiledDataset._update_hash(hasher, type(label_gen).__name__)
+            CompiledDataset._update_hash(hasher, {key: value for key, value in vars(label_gen).items()
+                                                  if not key.startswith("_")})
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _update_hash(hasher, value):
+        if isinstance(value, np.ndarray):
+            hasher.update("{}{}".format(value.dtype, value.shape).encode())
+            hasher.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, dict):
+            for key in sorted(value.keys(), key=str):
+                CompiledDataset._update_hash(hasher, key)
+                CompiledDataset._update_hash(hasher, value[key])
+        elif isinstance(value, (list, tuple)):
+            hasher.update("{}{}".format(type(value).__name__, len(value)).encode())
+            for item in value:
+                CompiledDataset._update_hash(hasher, item)
+        elif value is None or isinstance(value, (bool, int, float, str, np.generic)):
+            hasher.update(repr(value).encode())
+        elif callable(value):
+            hasher.update(getattr(value, "__qualname__", type(value).__name__).encode())
+        else:
+            hasher.update(type(value).__name__.encode())  # Other objects (e.g. file handles) are ignored.
+
+    def _load_meta(self):
+        try:
+            with open(os.path.join(self.dir_compiled, self.file_name_meta), "r") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not PackedFeatureStore.exists(os.path.join(self.dir_compiled, self.name_inputs))\
+                or not PackedFeatureStore.exists(os.path.join(self.dir_compiled, self.name_targets)):
+            return None
+        return meta
+
+    def compile(self):
+        """
+        Write all samples of the source dataset to the stores and return the meta information.
+
+        :raises ValueError:       If the source dataset is empty, the feature shapes are taken from its samples.
+        """
+        if len(self.id_list) == 0:
+            raise ValueError("Cannot compile an empty dataset to {}.".format(self.dir_compiled))
+        makedirs_safe(self.dir_compiled)
+        path_meta = os.path.join(self.dir_compiled, self.file_name_meta)
+        if os.path.isfile(path_meta):
+            os.remove(path_meta)  # Invalidate the old compilation before overwriting the stores.
+
+        if self.dataset.random_select:
+            fun_getitem = self.dataset.getitem_no_length_check  # The window is selected when loading.
+        else:
+            fun_getitem = self.dataset.fun_getitem
+
+        store_in, store_out = None, None
+        try:
+            for id_name in self.id_list:
+                labels_in, labels_out = fun_getitem(id_name, load_target=True)
+                labels_in, labels_out = np.asarray(labels_in), np.asarray(labels_out)
+                if store_in is None:
+                    # Keep the data types of the samples, e.g. of integer targets.
+                    shape_in, shape_out = labels_in.shape[1:], labels_out.shape[1:]
+                    store_in = PackedFeatureStore(os.path.join(self.dir_compiled, self.name_inputs), mode="w",
+                                                  dtype=labels_in.dtype)
+                    store_out = PackedFeatureStore(os.path.join(self.dir_compiled, self.name_targets), mode="w",
+                                                   dtype=labels_out.dtype)
+                store_in.add_sample(id_name, labels_in.reshape(len(labels_in), -1))
+                store_out.add_sample(id_name, labels_out.reshape(len(labels_out), -1))
+        finally:
+            if store_in is not None:
+                store_in.close()
+                store_out.close()
+
+        meta = {"fingerprint": self.fingerprint,
+                "shape_inputs": list(shape_in),
+                "shape_targets": list(shape_out)}
+        with open(path_meta + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path_meta + ".tmp", path_meta)
+
+        return meta
+
+    def __len__(self):
+        return len(self.id_list)
+
+    def __getitem__(self, item):
+        id_name = self.id_list[item]
+        labels_in = self.store_in[id_name]
+        labels_out = self.store_out[id_name]
+        labels_in = labels_in.reshape((len(labels_in),) + self.shape_in)
+        labels_out = labels_out.reshape((len(labels_out),) + self.shape_out)
+
+        if self.dataset.random_select:
+            start_frame_in, end_frame_in, start_frame_out, end_frame_out =\
+                self.dataset._select_window(len(labels_in), len(labels_out))
+            labels_in = labels_in[start_frame_in:max(start_frame_in, end_frame_in)]
+            labels_out = labels_out[start_frame_out:max(start_frame_out, end_frame_out)]
+
+        return labels_in, labels_out
+
+    def get_lengths(self, file_path=None):
+        """
+        Return the number of input frames of each sample from the index of the compiled inputs, see
+        PyTorchLabelGensDataset.get_lengths. The file_path argument is ignored, the index is always available.
+        """
+        if self._lengths is None:
+            self._lengths = np.array([self.store_in.get_length(id_name) for id_name in self.id_list], dtype=np.int64)
+            if self.dataset.random_select:
+                self._lengths = np.minimum(self._lengths, self.dataset.max_frames_input)
+        return self._lengths
+
+    def get_dims(self):
+        """Returns the feature dimensions of the input and output labels."""
+        return self.shape_in, self.shape_out
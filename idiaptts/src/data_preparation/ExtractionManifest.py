@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Manifest of an incremental feature extraction, which records for each id the state of its source file and the
+   created output files, so that a rerun only processes new or changed ids.
+"""
+
+# System imports.
+import json
+import logging
+import os
+
+# Third-party imports.
+
+# Local source tree imports.
+from idiaptts.misc.utils import makedirs_safe
+
+
+class ExtractionManifest(object):
+    """
+    The manifest is a JSON file containing the extraction parameters and an entry per id with the modification time
+    and size of the source file, the output files (relative to the output directory), and any additional information
+    required to load the outputs again (e.g. feature dimensions). It also records the ids which are contained in the
+    saved normalisation statistics, None marks the statistics as invalid (e.g. during an interrupted run).
+
+    When the extraction parameters change, all entries are discarded.
+    """
+    ext = "manifest.json"
+    version = 1
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, file_path, params):
+        """
+        Load the manifest at file_path if it exists.
+
+        :param file_path:     Path to the JSON file.
+        :param params:        Dictionary of extraction parameters (JSON serialisable), entries created with other
+                              parameters are considered outdated.
+        """
+        self.file_path = file_path
+        self.params = params
+        self.entries = dict()
+        self.stats_ids = None
+
+        if os.path.isfile(file_path):
+            with open(file_path, "r") as f:
+                content = json.load(f)
+            if content.get("version") != self.version or content.get("params") != params:
+                self.logger.info("Extraction parameters in {} changed, all ids are processed again.".format(file_path))
+            else:
+                self.entries = content["entries"]
+                self.stats_ids = content.get("stats_ids")
+
+    @staticmethod
+    def get_source_info(file_path):
+        """Return the modification time and size of a file, which identify its version."""
+        stat = os.stat(file_path)
+        return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    def __contains__(self, id_name):
+        return id_name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_entry(self, id_name):
+        return self.entries.get(id_name)
+
+    def is_up_to_date(self, id_name, source_path, dir_out):
+        """Return True if the id was extracted from the current version of source_path and all outputs exist."""
+        entry = self.entries.get(id_name)
+        if entry is None or not os.path.isfile(source_path):
+            return False
+        if entry["source"] != self.get_source_info(source_path):
+            return False
+        return all(os.path.isfile(os.path.join(dir_out, output)) for output in entry["outputs"])
+
+    def set_entry(self, id_name, source_path, outputs, **info):
+        """
+        Record the extraction of an id.
+
+        :param id_name:       Id of the sample.
+        :param source_path:   Path to the file the sample was extracted from.
+        :param outputs:       List of output files relative to the output directory.
+        :param info:          Additional JSON serialisable information stored in the entry.
+        """
+        entry = {"source": self.get_source_info(source_path), "outputs": list(outputs)}
+        entry.update(info)
+        self.entries[id_name] = entry
+
+    def remove_entry(self, id_name):
+        self.entries.pop(id_name, None)
+
+    def save(self):
+        """Write the manifest atomically, so that an interrupted write never corrupts an existing manifest."""
+        makedirs_safe(os.path.dirname(os.path.abspath(self.file_path)))
+        file_path_tmp = self.file_path + ".tmp"
+        with open(file_path_tmp, "w") as f:
+            json.dump({"version": self.version,
+                       "params": self.params,
+                       "stats_ids": self.stats_ids,
+                       "entries": self.entries}, f)
+        os.replace(file_path_tmp, self.file_path)
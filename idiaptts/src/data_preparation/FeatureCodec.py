@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Opt-in lossy storage of float32 feature files as float16 or per-dimension quantised int16, optionally compressed
+   with zlib. An encoded feature file <path> is stored as <path>.fc next to where the raw file would be. Loaders
+   use FeatureCodec.load_frames, which reads the raw file if it exists and otherwise decodes the encoded one to
+   float32, so encoded corpora are used transparently.
+
+   Use this module as a script to encode the raw files of a directory, see WorldFeatLabelGen.encode_data to encode
+   WORLD features with their normalisation parameters and a report of the reconstruction error.
+"""
+
+# System imports.
+import argparse
+import glob
+import logging
+import os
+import struct
+import zlib
+
+# Third-party imports.
+import numpy as np
+
+# Local source tree imports.
+
+
+class FeatureCodec(object):
+    """
+    Encoded files start with a header (magic, version, dtype, compression, dimension, number of frames). int16 files
+    additionally store a float32 scale and offset per dimension, a feature is decoded as q * scale + offset. The
+    (optionally compressed) frames follow. Compressed files are always decoded completely.
+    """
+    ext = "fc"
+    magic = b"IDFC"
+    version = 1
+    header_format = "<4sBBBxII"
+
+    dtypes = ("float16", "int16")
+    compressions = (None, "zlib")
+    int16_max = 32767
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, dtype="float16", compression=None, compression_level=1, norm_params=None, num_std_dev=16.0):
+        """
+        :param dtype:                 Storage type, float16 or int16.
+        :param compression:           None or zlib.
+        :param compression_level:     Level of zlib, 1 is fastest.
+        :param norm_params:           Optional tuple of (mean, std_dev) per dimension used to quantise int16 features
+                                      to the range of mean +- num_std_dev * std_dev, values outside are clipped. Without
+                                      them the range of each dimension in the sample is used.
+        :param num_std_dev:           Number of standard deviations covered by int16 features.
+        """
+        if dtype not in self.dtypes:
+            raise ValueError("Unknown dtype {}, use one of {}.".format(dtype, self.dtypes))
+        if compression not in self.compressions:
+            raise ValueError("Unknown compression {}, use one of {}.".format(compression, self.compressions))
+
+        self.dtype = dtype
+        self.compression = compression
+        self.compression_level = compression_level
+        self.norm_params = norm_params
+        self.num_std_dev = num_std_dev
+
+    def _get_quantisation(self, feature):
+        """Return the float32 scale and offset of each dimension used to quantise the feature to int16."""
+        if self.norm_params is not None:
+            mean, std_dev = (np.asarray(param, dtype=np.float64).reshape(-1) for param in self.norm_params)
+            offset = mean
+            scale = std_dev * self.num_std_dev / self.int16_max
+        else:
+            feature_min = feature.min(axis=0) if len(feature) > 0 else np.zeros(feature.shape[1])
+            feature_max = feature.max(axis=0) if len(feature) > 0 else np.zeros(feature.shape[1])
+            offset = (feature_min.astype(np.float64) + feature_max) / 2.0
+            scale = (feature_max.astype(np.float64) - feature_min) / (2 * self.int16_max)
+        scale[scale <= 0.0] = 1.0  # Constant dimensions.
+
+        return np.float32(scale), np.float32(offset)
+
+    def encode(self, feature):
+        """Return the bytes of the encoded feature of shape num_frames x dim."""
+        feature = np.asarray(feature, dtype=np.float32)
+        if feature.ndim == 1:
+            feature = feature[:, None]
+
+        if self.dtype == "float16":
+            with np.errstate(over="ignore"):
+                data = feature.astype(np.float16)
+            if not np.all(np.isfinite(data) | ~np.isfinite(feature)):
+                raise ValueError("Feature exceeds the range of float16, use int16 instead.")
+            quantisation = b""
+        else:
+            scale, offset = self._get_quantisation(feature)
+            data = np.rint((feature - offset) / scale)
+            num_clipped = np.count_nonzero(np.abs(data) > self.int16_max)
+            if num_clipped > 0:
+                self.logger.warning("Clipped {} values outside of {} standard deviations."
+                                    .format(num_clipped, self.num_std_dev))
+            data = np.clip(data, -self.int16_max, self.int16_max).astype(np.int16)
+            quantisation = scale.tobytes() + offset.tobytes()
+
+        data = data.tobytes()
+        if self.compression == "zlib":
+            data = zlib.compress(data, self.compression_level)
+
+        header = struct.pack(self.header_format, self.magic, self.version, self.dtypes.index(self.dtype),
+                             self.compressions.index(self.compression), feature.shape[1], len(feature))
+        return header + quantisation + data
+
+    def save(self, feature, file_path):
+        """Save the encoded feature to file_path.fc and return that path."""
+        path_encoded = "{}.{}".format(file_path, self.ext)
+        with open(path_encoded + ".tmp", "wb") as f:
+            f.write(self.encode(feature))
+        os.replace(path_encoded + ".tmp", path_encoded)
+        return path_encoded
+
+    @staticmethod
+    def _read_header(f):
+        header = f.read(struct.calcsize(FeatureCodec.header_format))
+        magic, version, dtype, compression, dim, num_frames = struct.unpack(FeatureCodec.header_format, header)
+        if magic != FeatureCodec.magic or version != FeatureCodec.version:
+            raise ValueError("{} is not an encoded feature file of version {}.".format(f.name, FeatureCodec.version))
+
+        dtype = FeatureCodec.dtypes[dtype]
+        scale, offset = None, None
+        if dtype == "int16":
+            scale = np.fromfile(f, dtype=np.float32, count=dim)
+            offset = np.fromfile(f, dtype=np.float32, count=dim)
+        return dtype, FeatureCodec.compressions[compression], dim, num_frames, scale, offset
+
+    @staticmethod
+    def decode_file(path_encoded, start_frame=0, num_frames=None):
+        """Return the float32 frames [start_frame, start_frame + num_frames) of an encoded file."""
+        with open(path_encoded, "rb") as f:
+            dtype, compression, dim, total_frames, scale, offset = FeatureCodec._read_header(f)
+            end_frame = total_frames if num_frames is None else min(total_frames, start_frame + num_frames)
+            start_frame = min(start_frame, end_frame)
+
+            if compression is None:
+                f.seek(start_frame * dim * np.dtype(dtype).itemsize, os.SEEK_CUR)
+                data = np.fromfile(f, dtype=dtype, count=(end_frame - start_frame) * dim)
+            else:
+                data = np.frombuffer(zlib.decompress(f.read()), dtype=dtype)[start_frame * dim:end_frame * dim]
+
+        data = data.reshape(-1, dim)
+        if dtype == "int16":
+            feature = np.multiply(data, scale, dtype=np.float32)
+            feature += offset
+            return feature
+        return data.astype(np.float32)
+
+    @staticmethod
+    def exists(file_path):
+        """Return True if the raw or the encoded file of file_path exists."""
+        return os.path.isfile(file_path) or os.path.isfile("{}.{}".format(file_path, FeatureCodec.ext))
+
+    @staticmethod
+    def load_frames(file_path, dim, start_frame=0, num_frames=None):
+        """
+        Return the float32 frames [start_frame, start_frame + num_frames) of the raw file at file_path as a flat
+        array. If the raw file does not exist, the encoded file is decoded instead.
+
+        :raises FileNotFoundError:    If neither the raw nor the encoded file exists.
+        """
+        path_encoded = "{}.{}".format(file_path, FeatureCodec.ext)
+        if not os.path.isfile(file_path) and os.path.isfile(path_encoded):
+            return FeatureCodec.decode_file(path_encoded, start_frame, num_frames).reshape(-1)
+
+        with open(file_path, "rb") as f:
+            if start_frame > 0:
+                f.seek(start_frame * dim * np.dtype(np.float32).itemsize)
+            return np.fromfile(f, dtype=np.float32, count=-1 if num_frames is None else num_frames * dim)
+
+    @staticmethod
+    def get_num_frames(file_path, dim):
+        """Return the number of frames of the raw or encoded file without loading it."""
+        path_encoded = "{}.{}".format(file_path, FeatureCodec.ext)
+        if not os.path.isfile(file_path) and os.path.isfile(path_encoded):
+            with open(path_encoded, "rb") as f:
+                return FeatureCodec._read_header(f)[3]
+        return os.path.getsize(file_path) // (np.dtype(np.float32).itemsize * dim)
+
+    def encode_file(self, file_path, dim, remove_raw=False):
+        """
+        Encode the raw float32 file at file_path with dimension dim.
+
+        :return:    Tuple of the raw and the decoded feature.
+        """
+        feature = np.fromfile(file_path, dtype=np.float32).reshape(-1, dim)
+        path_encoded = self.save(feature, file_path)
+        if remove_raw:
+            os.remove(file_path)
+        return feature, self.decode_file(path_encoded)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-d", "--dir_in", help="Directory containing the raw float32 feature files.", type=str,
+                        dest="dir_in", required=True)
+    parser.add_argument("-e", "--ext", help="Extension of the feature files.", type=str, dest="ext", required=True)
+    parser.add_argument("--dim", help="Dimension of the features.", type=int, dest="dim", required=True)
+    parser.add_argument("--dtype", help="Storage type.", choices=FeatureCodec.dtypes, default="float16",
+                        dest="dtype")
+    parser.add_argument("--compress", help="Compress the encoded files with zlib.", action="store_true",
+                        dest="compress")
+    parser.add_argument("--norm_params", help="MeanStdDevExtractor file used to quantise int16 features.", type=str,
+                        dest="norm_params", default=None)
+    parser.add_argument("--remove_raw", help="Remove the raw files after encoding.", action="store_true",
+                        dest="remove_raw")
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    norm_params = None
+    if args.norm_params is not None:
+        from idiaptts.misc.normalisation.MeanStdDevExtractor import MeanStdDevExtractor
+        norm_params = MeanStdDevExtractor.load(args.norm_params)
+    codec = FeatureCodec(args.dtype, "zlib" if args.compress else None, norm_params=norm_params)
+
+    max_error = np.zeros(args.dim)
+    for file_path in sorted(glob.glob(os.path.join(args.dir_in, "*" + args.ext))):
+        feature, decoded = codec.encode_file(file_path, args.dim, args.remove_raw)
+        if len(feature) > 0:
+            max_error = np.maximum(max_error, np.abs(feature - decoded).max(axis=0))
+    logging.info("Maximum absolute reconstruction error per dimension: {}".format(max_error))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@
 # Written by Bastian Schnell <bastian.schnell@idiap.ch>
 #
 
+# System imports.
+import logging
+import multiprocessing
+
 
 class LabelGen(object):
     """
@@ -12,22 +16,84 @@ class LabelGen(object):
 
     The following methods have to be implemented by subclasses:
     """
+    logger = logging.getLogger(__name__)
 
     def gen_data(self, dir_in, dir_out=None, file_id_list=None, id_list=None, return_dict=False):
+        """
+        Generate the labels of all ids and return their normalisation parameters. Subclasses which support it take a
+        num_workers argument, they process the ids with map_id_list and merge the per sample statistics in order
+        (see merge of the normalisation extractors), so that the results are identical to a serial run.
+        """
         raise NotImplementedError("Class %s doesn't implement gen_data(dir_in, dir_out, file_id_list, id_list, return_dict)" % self.__class__.__name__)
 
+    @staticmethod
+    def map_id_list(fun, id_list, num_workers=1, chunksize=None, initializer=None, initargs=()):
+        """
+        Generator applying fun to every id in id_list, which yields the results in the order of id_list.
+        With num_workers > 1 shards of ids are processed by a pool of processes, so fun and its results need to be
+        picklable. The pool is closed when the generator is exhausted or closed.
+
+        :param fun:           Function taking an id_name.
+        :param id_list:       List of ids to process.
+        :param num_workers:   Number of processes, None or 1 processes the ids in the calling process.
+        :param chunksize:     Number of ids sent to a worker at once, if None it is chosen from the list length.
+        :param initializer:   Function called with initargs once in each process, e.g. to receive large state once
+                              instead of with every shard. It is also called when the ids are processed in the
+                              calling process.
+        :param initargs:      Tuple of arguments for the initializer.
+        """
+        if num_workers is None or num_workers <= 1 or len(id_list) <= 1:
+            if initializer is not None:
+                initializer(*initargs)
+            for id_name in id_list:
+                yield fun(id_name)
+        else:
+            if chunksize is None:
+                chunksize = max(1, min(16, len(id_list) // (4 * num_workers)))
+            with multiprocessing.Pool(min(num_workers, len(id_list)), initializer, initargs) as pool:
+                for result in pool.imap(fun, id_list, chunksize=chunksize):
+                    yield result
+
     # def get_dir_labels(self): # Unused 23.5.18
     #     raise NotImplementedError("Class %s doesn't implement get_dir_labels()" % (self.__class__.__name__))
 
     def __getitem__(self, id_name):
         raise NotImplementedError("Class %s doesn't implement __getitem__(id_name)" % self.__class__.__name__)
 
+    def get_length(self, id_name):
+        """
+        Return the number of frames of the preprocessed sample with the given id_name.
+        Subclasses should override this when the length can be determined without loading the sample.
+        """
+        return len(self[id_name])
+
     def preprocess_sample(self, sample, norm_params=None):
         raise NotImplementedError("Class %s doesn't implement preprocess_sample(sample, norm_params)" % self.__class__.__name__)
 
     def postprocess_sample(self, sample, norm_params=None):
         raise NotImplementedError("Class %s doesn't implement postprocess_sample(sample, norm_params)" % self.__class__.__name__)
 
+    def _get_norm_transform(self, norm_params, create_transform):
+        """
+        Return create_transform(*params) for the given norm_params or self.norm_params if norm_params is None,
+        None if neither exist. The transform of the last used parameter arrays is kept, so it is only computed again
+        when other arrays are used (e.g. after self.norm_params was reassigned).
+        Parameters must not be modified in-place after they were used.
+        """
+        if norm_params is None:
+            norm_params = self.norm_params
+            if norm_params is None:
+                self.logger.error("Please give norm_params argument or call get_normaliations_params() before.")
+                return None
+
+        cached_params = getattr(self, "_norm_transform_params", None)
+        if cached_params is None or len(cached_params) != len(norm_params) \
+                or any(cached is not param for cached, param in zip(cached_params, norm_params)):
+            self._norm_transform = create_transform(*norm_params)
+            self._norm_transform_params = tuple(norm_params)
+
+        return self._norm_transform
+
     @staticmethod
     def trim_end_sample(sample, length, reverse=False):
         """
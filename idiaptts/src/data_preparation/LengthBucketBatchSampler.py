@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Batch sampler which groups samples of similar length into buckets and forms batches with a budget of padded
+   frames instead of a fixed number of samples.
+"""
+
+# System imports.
+import logging
+
+# Third-party imports.
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+# Local source tree imports.
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Sorts the samples by length and splits them into num_buckets buckets with an equal number of samples. Batches are
+    formed within each bucket so that batch_size * max_length_in_batch <= max_frames. When shuffling, samples are
+    shuffled within each bucket before forming the batches and the order of all batches is shuffled across buckets.
+    Torch is used as random number generator, so that hparams.seed makes the batches reproducible.
+
+    The batches of an epoch are planned at the first iteration after the previous plan was used, so len() is
+    valid during and after the iteration of an epoch.
+
+    For distributed training each of the num_replicas processes creates the same plan and iterates over every
+    num_replicas-th batch starting at its rank. The plan is padded with its first batches so that all processes
+    iterate over the same number of batches, unless pad_replicas is False (e.g. for validation). In that case a
+    process can get no batches at all. Call set_epoch before each epoch so that the plan only depends on seed and
+    epoch, like with a DistributedSampler.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, lengths, max_frames, num_buckets=10, shuffle=True, common_divisor=1, max_batch_size=None,
+                 drop_last=False, num_replicas=1, rank=0, seed=0, pad_replicas=True):
+        """
+        Create a batch sampler for samples with the given lengths.
+
+        :param lengths:           Length of each sample in the dataset, e.g. from PyTorchLabelGensDataset.get_lengths().
+        :param max_frames:        Maximum number of frames in a batch including padding. A batch contains at least
+                                  common_divisor samples even if that exceeds the budget.
+        :param num_buckets:       Number of buckets the sorted samples are split into.
+        :param shuffle:           Shuffle the samples within each bucket and the batches across buckets.
+        :param common_divisor:    Batch sizes are a multiple of it (usually number of GPUs).
+        :param max_batch_size:    Optional upper limit of samples in a batch.
+        :param drop_last:         Drop the last (smaller) batch of each bucket. Otherwise, samples of the last batch
+                                  which do not fill a multiple of common_divisor form a batch of their own, which is
+                                  padded to common_divisor samples by repeating them.
+        :param num_replicas:      Number of processes of distributed training.
+        :param rank:              Rank of this process in distributed training.
+        :param seed:              Seed of the random number generator used when num_replicas > 1, it has to be the
+                                  same in all processes. The generator is reseeded with seed + epoch by set_epoch.
+        :param pad_replicas:      Pad the plan so that all processes get the same number of batches. Without padding
+                                  every sample is used exactly once, but processes can get different numbers of
+                                  batches.
+        """
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.max_frames = max_frames
+        self.num_buckets = max(1, min(num_buckets, len(self.lengths)))
+        self.shuffle = shuffle
+        self.common_divisor = common_divisor
+        self.max_batch_size = max_batch_size
+        self.drop_last = drop_last
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.pad_replicas = pad_replicas
+        self.seed = seed
+        self.generator = torch.Generator().manual_seed(seed) if num_replicas > 1 else None
+
+        if max_batch_size is not None and max_batch_size < common_divisor:
+            raise ValueError("max_batch_size ({}) has to be at least common_divisor ({})."
+                             .format(max_batch_size, common_divisor))
+
+        sorted_indices = np.argsort(self.lengths, kind="stable")
+        self.buckets = [bucket for bucket in np.array_split(sorted_indices, self.num_buckets) if len(bucket) > 0]
+
+        self._batches = self._plan_batches()
+        self._plan_used = False
+
+    def _plan_batches(self):
+        batches = list()
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = bucket[torch.randperm(len(bucket), generator=self.generator).numpy()]
+            batches.extend(self._split_bucket(bucket))
+
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=self.generator).tolist()]
+
+        if self.num_replicas > 1 and len(batches) > 0:
+            num_batches = len(batches) + (-len(batches) % self.num_replicas if self.pad_replicas else 0)
+            batches = [batches[index % len(batches)] for index in range(self.rank, num_batches, self.num_replicas)]
+
+        return batches
+
+    def _split_bucket(self, bucket):
+        batches = list()
+        current_batch = list()
+        current_max_length = 0
+        for index in bucket.tolist():
+            max_length = max(current_max_length, self.lengths[index])
+            exceeds_budget = (len(current_batch) + 1) * max_length > self.max_frames
+            exceeds_size = self.max_batch_size is not None and len(current_batch) + 1 > self.max_batch_size
+            if (exceeds_budget or exceeds_size) and len(current_batch) >= self.common_divisor:
+                # Emit a batch with a multiple of common_divisor samples and carry over the rest.
+                num_samples = len(current_batch) - len(current_batch) % self.common_divisor
+                batches.append(current_batch[:num_samples])
+                current_batch = current_batch[num_samples:]
+                max_length = max([self.lengths[i] for i in current_batch] + [self.lengths[index]])
+
+            current_batch.append(index)
+            current_max_length = max_length
+
+        if len(current_batch) > 0 and not self.drop_last:
+            num_samples = len(current_batch) - len(current_batch) % self.common_divisor
+            if num_samples > 0:
+                batches.append(current_batch[:num_samples])
+            remainder = current_batch[num_samples:]
+            if len(remainder) > 0:
+                # Pad the remainder to common_divisor samples by repeating its samples, so that no sample is lost.
+                batches.append([remainder[i % len(remainder)] for i in range(self.common_divisor)])
+
+        return batches
+
+    def set_epoch(self, epoch):
+        """
+        Plan the batches of the given epoch with the generator seeded by seed + epoch, so that all processes and
+        resumed runs use the same plan. Without replicas the global torch generator is used and this does nothing.
+        """
+        if self.generator is None:
+            return
+
+        self.generator.manual_seed(self.seed + epoch)
+        self._batches = self._plan_batches()
+        self._plan_used = False
+
+    def __iter__(self):
+        if self._plan_used:
+            self._batches = self._plan_batches()
+        self._plan_used = True
+
+        return iter(self._batches)
+
+    def __len__(self):
+        return len(self._batches)
+
+    def get_padding_efficiency(self):
+        """Return the ratio of real frames to padded frames in the current plan."""
+        num_frames = 0
+        num_padded_frames = 0
+        for batch in self._batches:
+            batch_lengths = self.lengths[batch]
+            num_frames += batch_lengths.sum()
+            num_padded_frames += len(batch) * batch_lengths.max()
+
+        return num_frames / max(1, num_padded_frames)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Affine normalisation transform precomputed from normalisation parameters.
+"""
+
+# System imports.
+import logging
+
+# Third-party imports.
+import numpy as np
+
+# Local source tree imports.
+
+
+class NormTransform(object):
+    """
+    Normalisation (sample - shift) / divisor precomputed as the float32 multiply-add sample * scale + offset.
+    The inverse transform uses the shift and divisor in their original precision.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, shift, divisor):
+        """
+        :param shift:             Value subtracted from each feature, e.g. the mean or the minimum.
+        :param divisor:           Value each shifted feature is divided by, e.g. the standard deviation or the range.
+        """
+        self.shift = np.asarray(shift)
+        self.divisor = np.asarray(divisor)
+        self.scale = np.float32(1.0 / self.divisor)
+        self.offset = np.float32(-self.shift / self.divisor)
+
+    @classmethod
+    def from_mean_std_dev(cls, mean, std_dev):
+        """Create the transform to zero mean and unit variance."""
+        return cls(mean, std_dev)
+
+    @classmethod
+    def from_min_max(cls, samples_min, samples_max):
+        """
+        Create the transform to min=0 and max=1. Features with min == max get a range of one, features with
+        min > max (which is logged) get a max of min + 1. The given arrays are not modified.
+        """
+        samples_min, samples_max = cls.get_checked_min_max(samples_min, samples_max)
+        return cls(samples_min, samples_max - samples_min)
+
+    @classmethod
+    def get_checked_min_max(cls, samples_min, samples_max):
+        """Return copies of min and max where max is always greater than min."""
+        samples_min = np.array(samples_min, dtype=np.float64)
+        samples_max = np.array(samples_max, dtype=np.float64)
+
+        # Prevent division by zero.
+        samples_max[samples_min == samples_max] += 1
+        for index in np.flatnonzero(samples_min > samples_max):
+            cls.logger.warning("Min greater then max for feature " + str(index) + ": ("
+                               + str(samples_min.flat[index]) + " > " + str(samples_max.flat[index])
+                               + "), changing max to " + str(samples_min.flat[index] + 1))
+        samples_max = np.where(samples_min > samples_max, samples_min + 1, samples_max)
+
+        return samples_min, samples_max
+
+    def apply(self, sample, out=None):
+        """
+        Return the normalised float32 sample. If out is given the result is written into it, out can be the sample
+        itself when it is a float32 array which is not needed anymore.
+        """
+        out = np.multiply(sample, self.scale, out=out, dtype=np.float32)
+        out += self.offset
+        return out
+
+    def invert(self, sample):
+        """Return the denormalised sample."""
+        return sample * self.divisor + self.shift
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Store the features of a whole corpus in one contiguous binary shard with an offset/length index.
+   Samples are returned as zero-copy slices of a read-only memory map, so loading a sample costs a single
+   dictionary lookup instead of opening and reading one file per feature stream.
+"""
+
+# System imports.
+import logging
+import os
+
+# Third-party imports.
+import numpy as np
+
+# Local source tree imports.
+from idiaptts.misc.utils import makedirs_safe
+
+
+class PackedFeatureStore(object):
+    """
+    A packed corpus consists of two files: <name>.bin containing all samples as one contiguous C-ordered array of
+    shape total_frames x dim, and <name>.idx, a text file with a "dim dtype" header followed by one
+    "id_name first_frame num_frames" line per sample.
+
+    Use it as a writer with mode="w" (ideally as context manager), or as a database with mode="r".
+    """
+    ext_data = "bin"
+    ext_index = "idx"
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, file_path, mode="r", dtype=np.float32):
+        """
+        Open a packed store.
+
+        :param file_path:     Path to the store without extension.
+        :param mode:          "r" to read from an existing store, "w" to create a new one (overwrites).
+        :param dtype:         Data type of the samples, only used in write mode. In read mode it is taken from the index.
+        """
+        if mode not in ("r", "w"):
+            raise ValueError("Unknown mode {}, use 'r' or 'w'.".format(mode))
+
+        self.file_path = file_path
+        self.mode = mode
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self.index = dict()  # Maps id_name to (first_frame, num_frames).
+        self.total_frames = 0
+
+        self._data = None  # Memory map, opened lazily so that the object can be pickled to DataLoader workers.
+        self._file = None  # File handle in write mode.
+        self._id_order = list()
+
+        if mode == "r":
+            self._load_index()
+        else:
+            makedirs_safe(os.path.dirname(os.path.abspath(file_path)))
+            self._file = open(self.path_data, "wb")
+
+    @property
+    def path_data(self):
+        return "{}.{}".format(self.file_path, self.ext_data)
+
+    @property
+    def path_index(self):
+        return "{}.{}".format(self.file_path, self.ext_index)
+
+    @staticmethod
+    def exists(file_path):
+        """Return True if a complete store (data and index) exists at file_path."""
+        return os.path.isfile("{}.{}".format(file_path, PackedFeatureStore.ext_data))\
+            and os.path.isfile("{}.{}".format(file_path, PackedFeatureStore.ext_index))
+
+    def _load_index(self):
+        with open(self.path_index, "r") as f:
+            dim, dtype = f.readline().split()
+            self.dim = int(dim)
+            self.dtype = np.dtype(dtype)
+            for line in f:
+                id_name, first_frame, num_frames = line.split()
+                first_frame, num_frames = int(first_frame), int(num_frames)
+                self.index[id_name] = (first_frame, num_frames)
+                self._id_order.append(id_name)
+                self.total_frames = max(self.total_frames, first_frame + num_frames)
+
+    def _get_data(self):
+        if self._data is None:
+            if self.total_frames == 0:
+                self._data = np.empty((0, self.dim), dtype=self.dtype)
+            else:
+                self._data = np.memmap(self.path_data, dtype=self.dtype, mode="r",
+                                       shape=(self.total_frames, self.dim))
+        return self._data
+
+    def add_sample(self, id_name, sample):
+        """Append a sample of shape T x dim to the store."""
+        if self.mode != "w":
+            raise ValueError("Samples can only be added in write mode.")
+        if id_name in self.index:
+            raise KeyError("Sample {} is already in the store {}.".format(id_name, self.file_path))
+
+        sample = np.ascontiguousarray(sample, dtype=self.dtype)
+        if sample.ndim == 1:
+            sample = sample[:, None]
+        if self.dim is None:
+            self.dim = sample.shape[1]
+        elif sample.shape[1] != self.dim:
+            raise ValueError("Sample {} has dimension {} but store {} expects {}."
+                             .format(id_name, sample.shape[1], self.file_path, self.dim))
+
+        sample.tofile(self._file)
+        self.index[id_name] = (self.total_frames, len(sample))
+        self._id_order.append(id_name)
+        self.total_frames += len(sample)
+
+    def close(self):
+        """Finish writing. The index is written last so that an incomplete store is never picked up by readers."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+            path_index_tmp = self.path_index + ".tmp"
+            with open(path_index_tmp, "w") as f:
+                f.write("{} {}\n".format(self.dim if self.dim is not None else 0, self.dtype.name))
+                for id_name in self._id_order:
+                    first_frame, num_frames = self.index[id_name]
+                    f.write("{} {} {}\n".format(id_name, first_frame, num_frames))
+            os.replace(path_index_tmp, self.path_index)
+            self.logger.info("Wrote {} samples with {} frames to {}."
+                             .format(len(self.index), self.total_frames, self.path_data))
+        self.mode = "r"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # Memory maps and file handles are not pickled, workers reopen the memory map on first access.
+        state = self.__dict__.copy()
+        state["_data"] = None
+        state["_file"] = None
+        return state
+
+    def __contains__(self, id_name):
+        return id_name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_ids(self):
+        return list(self._id_order)
+
+    def get_length(self, id_name):
+        """Return the number of frames of a sample without touching its data."""
+        return self.index[id_name][1]
+
+    def __getitem__(self, id_name):
+        """Return a read-only zero-copy view of shape T x dim of the sample."""
+        first_frame, num_frames = self.index[id_name]
+        return self._get_data()[first_frame:first_frame + num_frames]
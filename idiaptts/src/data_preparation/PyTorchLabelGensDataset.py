@@ -10,18 +10,26 @@
 """
 
 # System imports.
+import logging
+import os
 import numpy as np
 
 # Third-party imports.
 import torch
 from torch.utils.data import Dataset
 
+# Local source tree imports.
+from idiaptts.src.data_preparation.SampleCache import SampleCache
+from idiaptts.src.data_preparation.SharedSampleCache import SharedSampleCache
+
 
 class PyTorchLabelGensDataset(Dataset):
     """Dataset that generate the samples from two LabelGen objects."""
+    logger = logging.getLogger(__name__)
 
     def __init__(self, id_list, label_gen_in, label_gen_out, hparams,
-                 match_lengths=False, len_in_out_multiplier=1, random_select=False, max_frames_input=-1):
+                 match_lengths=False, len_in_out_multiplier=1, random_select=False, max_frames_input=-1,
+                 cache_size_mb=None, cache_shared=None):
         """
         Initialise a dataset that generate the samples from two LabelGen objects.
 
@@ -33,6 +41,13 @@ class PyTorchLabelGensDataset(Dataset):
         :param random_select:           Randomly selects a sequential part of the labels. This avoids memory issues.
                                         If True, max_frames_input has to be > 0 and length_check is implicit.
         :param max_frames_input:        Number of frames selected from input labels, has to be a positive integer.
+        :param cache_size_mb:           Memory budget in MB of an LRU cache of preprocessed (and length matched)
+                                        samples. If None, hparams.dataset_cache_size_mb is used, 0 disables the cache.
+                                        For random_select the full samples are cached and the selection is done on
+                                        the cached samples.
+        :param cache_shared:            If True, the cache is a SharedSampleCache in shared memory used by all
+                                        DataLoader workers, otherwise each worker holds its own SampleCache. If None,
+                                        hparams.dataset_cache_shared is used.
         """
         self.id_list = id_list
 
@@ -45,7 +60,21 @@ class PyTorchLabelGensDataset(Dataset):
         else:
             self.f_get_emb_index = None
 
+        # Cache preprocessed samples.
+        if cache_size_mb is None and hparams is not None and hasattr(hparams, "dataset_cache_size_mb"):
+            cache_size_mb = hparams.dataset_cache_size_mb
+        if cache_shared is None:
+            cache_shared = getattr(hparams, "dataset_cache_shared", False) if hparams is not None else False
+        if cache_size_mb is not None and cache_size_mb > 0:
+            if cache_shared:
+                self.sample_cache = SharedSampleCache(cache_size_mb * 1024 ** 2)
+            else:
+                self.sample_cache = SampleCache(cache_size_mb * 1024 ** 2)
+        else:
+            self.sample_cache = None
+
         # Select the appropriate getitem method.
+        self.random_select = random_select
         if random_select:
             assert(max_frames_input >= 1)  # When random_select is used a maximum number of input frames is required.
             self.fun_getitem = self.getitem_random_select
@@ -58,11 +87,75 @@ class PyTorchLabelGensDataset(Dataset):
         assert(type(max_frames_input) is int)  # Maximum number of frames must be an integer.
         self.max_frames_input = max_frames_input
 
+        self._lengths = None  # Cached length index, see get_lengths().
+        self._length_index_in = dict()  # Maps id_name to the full length of the input/output labels.
+        self._length_index_out = dict()
+
+        # Random windows are read directly from disk when both LabelGens support ranged reads. Embedding functions
+        # and the sample cache work on full samples, so they require loading full samples.
+        self.use_ranged_reads = random_select and self.sample_cache is None and self.f_get_emb_index is None\
+            and callable(getattr(label_gen_in, "getitem_range", None))\
+            and callable(getattr(label_gen_out, "getitem_range", None))
+
     def __len__(self):
         return len(self.id_list)
 
     def __getitem__(self, item):
-        return self.fun_getitem(self.id_list[item], load_target=True)
+        if self.random_select:
+            # Caching is done on the full samples inside the method.
+            return self.fun_getitem(self.id_list[item], load_target=True)
+        return self._getitem_cached(self.fun_getitem, self.id_list[item], load_target=True)
+
+    def _getitem_cached(self, fun_getitem, id_name, load_target):
+        """Return fun_getitem(id_name, load_target) from the sample cache, load it on a miss."""
+        if self.sample_cache is None:
+            return fun_getitem(id_name, load_target)
+
+        key = (id_name, load_target)
+        item = self.sample_cache.get(key)
+        if item is None:
+            item = fun_getitem(id_name, load_target)
+            self.sample_cache.put(key, item)
+        return item
+
+    def get_lengths(self, file_path=None):
+        """
+        Return the number of input frames of each sample in self.id_list, used to plan batches without loading the
+        samples. Lengths are requested from LabelGenIn.get_length(), which does not load the sample if the LabelGen
+        supports it. For random_select the lengths are limited to self.max_frames_input. The index is cached.
+
+        :param file_path:     Optional text file with "id_name length" lines. Known lengths are read from it and
+                              missing ones are added to it.
+        :return:              Numpy array of lengths in the order of self.id_list.
+        """
+        if self._lengths is None:
+            lengths = self._length_index_in
+            if file_path is not None and os.path.isfile(file_path):
+                with open(file_path, "r") as f:
+                    for line in f:
+                        id_name, length = line.split()
+                        lengths[id_name] = int(length)
+
+            missing_ids = [id_name for id_name in self.id_list if id_name not in lengths]
+            if len(missing_ids) > 0:
+                self.logger.info("Compute lengths of {} samples.".format(len(missing_ids)))
+                for id_name in missing_ids:
+                    self._get_length(self.LabelGenIn, lengths, id_name)
+
+                if file_path is not None:
+                    with open(file_path, "w") as f:
+                        for id_name, length in lengths.items():
+                            f.write("{} {}\n".format(id_name, length))
+
+            self._lengths = np.array([lengths[id_name] for id_name in self.id_list], dtype=np.int64)
+            if self.random_select:
+                self._lengths = np.minimum(self._lengths, self.max_frames_input)
+
+        return self._lengths
+
+    def get_cache_stats(self):
+        """Returns a string describing the state of the sample cache of this process."""
+        return str(self.sample_cache) if self.sample_cache is not None else "Sample cache disabled."
 
     def getitem_by_name(self, id_name, load_target):
         return self.getitem_no_length_check(id_name, load_target)
@@ -110,22 +203,29 @@ class PyTorchLabelGensDataset(Dataset):
         The selection is done in the input space. self.max_frames_input frames are used.
         The start frame in the output labels is determined by selected_input_frame * self.len_in_out_multiplier.
         It is ensured that num_out_frames is dividable by self.len_in_out_multiplier.
+        If self.use_ranged_reads is True, the window is selected from the cached lengths and only the selected
+        frames are loaded with the getitem_range methods of the LabelGens.
         """
 
-        labels_in, labels_out = self.getitem_no_length_check(id_name, load_target)
+        if self.use_ranged_reads:
+            # Select the window from the cached lengths and only load the selected frames.
+            len_in = self._get_length(self.LabelGenIn, self._length_index_in, id_name)
+            len_out = self._get_length(self.LabelGenOut, self._length_index_out, id_name) if load_target else None
+            start_frame_in, end_frame_in, start_frame_out, end_frame_out = self._select_window(len_in, len_out)
 
-        # Randomly select a subset of the data. Use torch as random number generator to make results reproducible.
-        start_frame_in = torch.IntTensor(1).random_(0, max(1, len(labels_in) - self.max_frames_input))
-        # Check if data is shorter than max_frames_input.
-        end_frame_in = min(start_frame_in + self.max_frames_input, len(labels_in))
+            labels_out = None
+            if load_target:
+                labels_out = self.LabelGenOut.getitem_range(id_name, start_frame_out,
+                                                            max(0, end_frame_out - start_frame_out))
+            labels_in = self.LabelGenIn.getitem_range(id_name, start_frame_in, max(0, end_frame_in - start_frame_in))
+
+            return labels_in, labels_out
+
+        labels_in, labels_out = self._getitem_cached(self.getitem_no_length_check, id_name, load_target)
+        start_frame_in, end_frame_in, start_frame_out, end_frame_out =\
+            self._select_window(len(labels_in), len(labels_out) if load_target else None)
 
         if load_target:
-            # Select the according frames in the output data.
-            start_frame_out = start_frame_in * self.len_in_out_multiplier
-            # Check if out data is shorter than required.
-            end_frame_out = min(end_frame_in * self.len_in_out_multiplier, len(labels_out))
-            end_frame_in = end_frame_out // self.len_in_out_multiplier
-            end_frame_out = end_frame_in * self.len_in_out_multiplier
             # Trim output data.
             labels_out = self.LabelGenOut.trim_end_sample(labels_out, len(labels_out) - end_frame_out)
             labels_out = self.LabelGenOut.trim_end_sample(labels_out, start_frame_out, reverse=True)
@@ -136,6 +236,39 @@ class PyTorchLabelGensDataset(Dataset):
 
         return labels_in, labels_out
 
+    def _select_window(self, len_in, len_out=None):
+        """
+        Randomly select a window of at most self.max_frames_input input frames and the corresponding output frames.
+        If len_out is None, only the input window is selected.
+
+        :return:    start_frame_in, end_frame_in, start_frame_out, end_frame_out
+        """
+        # Randomly select a subset of the data. Use torch as random number generator to make results reproducible.
+        start_frame_in = int(torch.IntTensor(1).random_(0, max(1, len_in - self.max_frames_input)))
+        # Check if data is shorter than max_frames_input.
+        end_frame_in = min(start_frame_in + self.max_frames_input, len_in)
+
+        start_frame_out, end_frame_out = None, None
+        if len_out is not None:
+            # Select the according frames in the output data.
+            start_frame_out = start_frame_in * self.len_in_out_multiplier
+            # Check if out data is shorter than required.
+            end_frame_out = min(end_frame_in * self.len_in_out_multiplier, len_out)
+            end_frame_in = end_frame_out // self.len_in_out_multiplier
+            end_frame_out = end_frame_in * self.len_in_out_multiplier
+
+        return start_frame_in, end_frame_in, start_frame_out, end_frame_out
+
+    @staticmethod
+    def _get_length(label_gen, length_index, id_name):
+        """Return the full length of a sample from the length index, request it from the LabelGen if missing."""
+        length = length_index.get(id_name)
+        if length is None:
+            fn_get_length = getattr(label_gen, "get_length", None)
+            length = fn_get_length(id_name) if callable(fn_get_length) else len(label_gen[id_name])
+            length_index[id_name] = length
+        return length
+
     def getitem_no_length_check(self, id_name, load_target):
         """Load labels without any length checks, adds embedding indices if given in hparams in constructor."""
 
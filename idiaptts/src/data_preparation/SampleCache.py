@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Least-recently-used cache of (tuples of) numpy arrays with a memory budget in bytes.
+"""
+
+# System imports.
+import logging
+from collections import OrderedDict
+
+# Third-party imports.
+import numpy as np
+
+# Local source tree imports.
+
+
+class SampleCache(object):
+    """
+    LRU cache for preprocessed samples. The size of an entry is the sum of the nbytes of all numpy arrays in it.
+    Entries which are larger than the whole budget are not cached. Note that the cached arrays are returned
+    without copy, so they must not be modified in-place by the caller.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, max_bytes):
+        """
+        Create an empty cache.
+
+        :param max_bytes:     Memory budget in bytes.
+        """
+        self.max_bytes = int(max_bytes)
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # Maps key to (value, num_bytes), least recently used first.
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_num_bytes(value):
+        """Return the number of bytes of all numpy arrays in a (nested tuple/list of) array(s)."""
+        if value is None:
+            return 0
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (tuple, list)):
+            return sum(SampleCache.get_num_bytes(v) for v in value)
+        return 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Return the cached value and mark it as most recently used, or None if the key is not cached."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        """Cache the value, evicting least recently used entries until it fits into the budget."""
+        num_bytes = self.get_num_bytes(value)
+        if num_bytes > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key)[1]
+
+        while self.current_bytes + num_bytes > self.max_bytes and len(self._entries) > 0:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_bytes
+            self.evictions += 1
+
+        self._entries[key] = (value, num_bytes)
+        self.current_bytes += num_bytes
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def get_hit_rate(self):
+        num_requests = self.hits + self.misses
+        return self.hits / num_requests if num_requests > 0 else 0.0
+
+    def __str__(self):
+        return "SampleCache with {} entries using {:.1f}/{:.1f} MB, {} hits, {} misses ({:.1%} hit rate), {} evictions"\
+            .format(len(self), self.current_bytes / 1024 ** 2, self.max_bytes / 1024 ** 2, self.hits, self.misses,
+                    self.get_hit_rate(), self.evictions)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Cache of (tuples of) numpy arrays in shared memory, shared by the main process and all DataLoader workers.
+"""
+
+# System imports.
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import weakref
+
+# Third-party imports.
+import numpy as np
+
+# Local source tree imports.
+
+
+def _remove_cache_dir(dir_cache, pid):
+    """Remove the cache directory, but only in the process which created it."""
+    if os.getpid() == pid:
+        shutil.rmtree(dir_cache, ignore_errors=True)
+
+
+class SharedSampleCache(object):
+    """
+    Drop-in replacement of SampleCache for datasets used with DataLoader workers. All entries are stored in a single
+    arena file of max_bytes in /dev/shm (a memory backed file system), which each process maps once, so all processes
+    share the same physical pages and each process holds only one open file for the whole cache. A small json file
+    per key holds the location, dtype, and shape of its arrays.
+
+    The arena is used as ring buffer: once it is full, the oldest entries are evicted (first in, first out). An entry
+    is valid as long as its logical start is not below the shared tail of the ring. Because evicted memory is reused,
+    get returns copies and checks that the entry was not evicted while it was copied. Hit and miss counters are per
+    process. The directory is removed when the cache of the creating process is garbage collected.
+    """
+    ext_meta = "json"
+    file_arena = "arena"
+    alignment = 16
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, max_bytes, dir_root=None):
+        """
+        Create an empty cache. Create it in the main process before the DataLoader workers are started.
+
+        :param max_bytes:     Memory budget in bytes shared by all processes.
+        :param dir_root:      Directory in which the cache directory is created, defaults to /dev/shm if it exists.
+        """
+        if dir_root is None and os.path.isdir("/dev/shm"):
+            dir_root = "/dev/shm"
+        self.max_bytes = int(max_bytes)
+        assert self.max_bytes > 0, "The budget of the cache must be positive."
+        self.dir_cache = tempfile.mkdtemp(prefix="idiaptts_cache_", dir=dir_root)
+        with open(os.path.join(self.dir_cache, self.file_arena), "wb") as f:
+            f.truncate(self.max_bytes)  # Sparse file, pages are only allocated when they are written.
+
+        # Shared state inherited by the workers. Everything between tail and head is valid, both are logical
+        # positions which grow monotonically, the physical position is the logical one modulo max_bytes.
+        self._lock = multiprocessing.Lock()
+        self._head = multiprocessing.Value("q", 0, lock=False)
+        self._tail = multiprocessing.Value("q", 0, lock=False)
+        self._arena = None  # Memory map of the arena in this process, opened on first use.
+
+        self.hits = 0
+        self.misses = 0
+
+        self._finalizer = weakref.finalize(self, _remove_cache_dir, self.dir_cache, os.getpid())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_arena"] = None
+        state["_finalizer"] = None  # Only the creating process removes the directory.
+        return state
+
+    @property
+    def current_bytes(self):
+        with self._lock:
+            return self._head.value - self._tail.value
+
+    def _get_arena(self):
+        if self._arena is None:
+            self._arena = np.memmap(os.path.join(self.dir_cache, self.file_arena), dtype=np.uint8, mode="r+",
+                                    shape=(self.max_bytes,))
+        return self._arena
+
+    def _get_path(self, key):
+        return "{}.{}".format(os.path.join(self.dir_cache, hashlib.sha1(repr(key).encode()).hexdigest()),
+                              self.ext_meta)
+
+    @staticmethod
+    def _read_meta(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_meta(path, meta):
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def _is_valid(self, meta, ready=True):
+        return meta is not None and (meta["ready"] or not ready) and meta["start"] >= self._tail.value
+
+    def __len__(self):
+        return sum(1 for file_name in os.listdir(self.dir_cache) if file_name.endswith("." + self.ext_meta)
+                   and self._is_valid(self._read_meta(os.path.join(self.dir_cache, file_name))))
+
+    def __contains__(self, key):
+        return self._is_valid(self._read_meta(self._get_path(key)))
+
+    def get(self, key):
+        """Return a copy of the cached value, or None if the key is not cached."""
+        meta = self._read_meta(self._get_path(key))
+        if self._is_valid(meta):
+            arena = self._get_arena()
+            position = meta["start"] % self.max_bytes
+            values = list()
+            for array_meta in meta["arrays"]:
+                if array_meta is None:
+                    values.append(None)
+                else:
+                    offset, dtype, shape = array_meta
+                    num_bytes = int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+                    values.append(arena[position + offset:position + offset + num_bytes].view(dtype)
+                                  .reshape(shape).copy())
+
+            if self._is_valid(meta):  # Not evicted while copying.
+                self.hits += 1
+                return tuple(values) if meta["is_tuple"] else values[0]
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """Cache the value, evicting the oldest entries. Values are arrays or tuples of arrays and None."""
+        is_tuple = isinstance(value, (tuple, list))
+        values = [None if array is None else np.ascontiguousarray(array) for array in (value if is_tuple else (value,))]
+
+        arrays_meta = list()
+        num_bytes = 0
+        for array in values:
+            if array is None:
+                arrays_meta.append(None)
+            else:
+                arrays_meta.append((num_bytes, array.dtype.str, array.shape))
+                num_bytes += -(-array.nbytes // self.alignment) * self.alignment
+        if num_bytes > self.max_bytes:
+            return
+
+        path = self._get_path(key)
+        with self._lock:
+            # Check and reserve together, so that the same key is only written once.
+            if self._is_valid(self._read_meta(path), ready=False):
+                return
+
+            start = self._head.value
+            if start % self.max_bytes + num_bytes > self.max_bytes:
+                start += self.max_bytes - start % self.max_bytes  # Entries do not wrap around the end of the arena.
+            self._head.value = start + num_bytes
+            self._tail.value = max(self._tail.value, self._head.value - self.max_bytes)  # Evict oldest entries.
+            meta = {"start": start, "is_tuple": is_tuple, "arrays": arrays_meta, "ready": False}
+            self._write_meta(path, meta)
+
+        arena = self._get_arena()
+        position = start % self.max_bytes
+        for array, array_meta in zip(values, arrays_meta):
+            if array is not None:
+                offset = position + array_meta[0]
+                arena[offset:offset + array.nbytes] = array.reshape(-1).view(np.uint8)
+
+        meta["ready"] = True
+        self._write_meta(path, meta)
+
+    def clear(self):
+        """Remove all entries. Must not be called while DataLoader workers are running."""
+        with self._lock:
+            for file_name in os.listdir(self.dir_cache):
+                if file_name != self.file_arena:
+                    os.remove(os.path.join(self.dir_cache, file_name))
+            self._head.value = 0
+            self._tail.value = 0
+
+    def get_hit_rate(self):
+        num_requests = self.hits + self.misses
+        return self.hits / num_requests if num_requests > 0 else 0.0
+
+    def __str__(self):
+        return "SharedSampleCache in {} with {} entries using {:.1f}/{:.1f} MB, {} hits, {} misses ({:.1%} hit rate)"\
+            .format(self.dir_cache, len(self), self.current_bytes / 1024 ** 2, self.max_bytes / 1024 ** 2, self.hits,
+                    self.misses, self.get_hit_rate())
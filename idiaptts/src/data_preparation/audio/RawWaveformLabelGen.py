@@ -44,7 +44,20 @@ class RawWaveformLabelGen(Dataset):
 
     logger = logging.getLogger(__name__)
 
-    def __init__(self, norm_params=None, frame_rate_output_Hz=None, frame_size_ms=5, mu=None, silence_threshold_quantized=None):
+    # Soundfile subtypes which can be read directly, mapped to their integer type and bit depth.
+    _pcm_subtypes = {"PCM_16": ("int16", 16), "PCM_32": ("int32", 32)}
+
+    def __init__(self, norm_params=None, frame_rate_output_Hz=None, frame_size_ms=5, mu=None, silence_threshold_quantized=None,
+                 index_targets=False):
+        """
+        :param norm_params:                   Factor applied to the post-processed waveform.
+        :param frame_rate_output_Hz:          Change the frame rate of the audio. Keep original if None.
+        :param frame_size_ms:                 Frame size of the conditioning features.
+        :param mu:                            If given, mu-law quantisation with mu + 1 classes is performed.
+        :param silence_threshold_quantized:   Beginning and end of quantised audio below the threshold are trimmed.
+        :param index_targets:                 If True and mu is given, samples are returned as T x 1 class indices
+                                              (uint8 for mu <= 255) instead of T x (mu + 1) float32 one-hot vectors.
+        """
 
         # Attributes.
         #self.id_list = id_list
@@ -52,6 +65,7 @@ class RawWaveformLabelGen(Dataset):
         self.frame_size_ms = frame_size_ms
         self.mu = mu
         self.silence_threshold_quantized = silence_threshold_quantized
+        self.index_targets = index_targets
 
         self.norm_params = norm_params
 
@@ -67,6 +81,26 @@ class RawWaveformLabelGen(Dataset):
 
         return sample
 
+    def getitem_range(self, file_path, start_frame, num_frames):
+        """
+        Return the preprocessed frames [start_frame, start_frame + num_frames) of the audio file. Only that range is
+        read when the file does not need resampling. When silence is trimmed the full file is required.
+        """
+        if self.silence_threshold_quantized is not None:
+            return self[file_path][start_frame:start_frame + num_frames]
+
+        sample = self.load_sample(file_path, self.frame_rate_output_Hz, start_frame=start_frame, num_frames=num_frames)
+        return self.preprocess_sample(sample)
+
+    def get_length(self, file_path):
+        """Return the number of frames of the preprocessed sample, read from the file header where possible."""
+        if self.silence_threshold_quantized is None:
+            info = self._get_ranged_read_info(file_path, self.frame_rate_output_Hz)
+            if info is not None:
+                return info.frames
+
+        return len(self[file_path])
+
     # def get_dims(self):
     #     labels_in, labels_out = self.__getitem__(0)
     #     return list(map(int, labels_in.shape[1:])), self.mu + 1
@@ -100,6 +134,10 @@ class RawWaveformLabelGen(Dataset):
                 start, end = RawWaveformLabelGen.start_and_end_indices(sample, self.silence_threshold_quantized)
                 sample = sample[start:end]
 
+            if self.index_targets:
+                # Keep the class indices, one-hot vectors are created on the compute device if necessary.
+                return sample.astype(self.get_index_dtype(self.mu))[:, None]
+
             sample_dist = np.zeros((len(sample), self.mu + 1), dtype=np.float32)
             sample_dist[np.arange(len(sample)), sample] = 1.0
 
@@ -109,6 +147,15 @@ class RawWaveformLabelGen(Dataset):
 
         return sample
 
+    @staticmethod
+    def get_index_dtype(mu):
+        """Return the smallest integer type which holds the mu + 1 class indices of mu-law quantisation."""
+        if mu <= np.iinfo(np.uint8).max:
+            return np.uint8
+        if mu <= np.iinfo(np.int16).max:
+            return np.int16
+        return np.int64
+
     @staticmethod
     def start_and_end_indices(quantized, silence_threshold=20):
         for start in range(quantized.size):
@@ -134,7 +181,10 @@ class RawWaveformLabelGen(Dataset):
 
         # Convert one hot vector to index tensor.
         if self.mu is not None:
-            sample = sample.argmax(axis=1)
+            if sample.ndim > 1 and sample.shape[1] > 1:
+                sample = sample.argmax(axis=1)
+            else:
+                sample = sample.reshape(-1)  # Sample contains class indices already.
             sample = self.mu_law_companding_reversed(sample, self.mu)
 
         if norm_params is not None:
@@ -145,12 +195,46 @@ class RawWaveformLabelGen(Dataset):
         return sample
 
     @staticmethod
-    def load_sample(file_path, frame_rate_output_Hz=None):
+    def _get_ranged_read_info(file_path, frame_rate_output_Hz=None):
+        """
+        Return the soundfile info if frames of the file can be read directly without resampling (mono 16 or 32 bit
+        PCM at the requested frame rate), otherwise None.
+        """
+        try:
+            info = soundfile.info(file_path)
+        except RuntimeError:  # Format not supported by soundfile.
+            return None
+
+        if info.channels != 1 or info.subtype not in RawWaveformLabelGen._pcm_subtypes:
+            return None
+        if frame_rate_output_Hz is not None and frame_rate_output_Hz != info.samplerate:
+            return None
+
+        return info
+
+    @staticmethod
+    def load_sample(file_path, frame_rate_output_Hz=None, start_frame=0, num_frames=None):
         """
         :param file_path:              Full path to the audio file.
         :param frame_rate_output_Hz:   Change the frame rate of the audio. Keep original if None.
+        :param start_frame:            First frame (in output frame rate) to return.
+        :param num_frames:             Maximum number of frames to return, None returns all after start_frame.
+                                       If no resampling is required only that range is read from the file.
         :return:                       Normalised raw waveform [-1, 1].
         """
+        if start_frame > 0 or num_frames is not None:
+            info = RawWaveformLabelGen._get_ranged_read_info(file_path, frame_rate_output_Hz)
+            if info is not None:
+                dtype, bit_depth = RawWaveformLabelGen._pcm_subtypes[info.subtype]
+                raw, _ = soundfile.read(file_path, start=start_frame,
+                                        stop=None if num_frames is None else start_frame + num_frames, dtype=dtype)
+                raw = raw.astype(np.float64)
+                raw /= math.pow(2, bit_depth) / 2  # Same normalisation as below.
+                return raw
+
+            end_frame = None if num_frames is None else start_frame + num_frames
+            return RawWaveformLabelGen.load_sample(file_path, frame_rate_output_Hz)[start_frame:end_frame]
+
         audio_seg = AudioSegment.from_file(file_path)
         bit_depth = audio_seg.sample_width * 8
         array_type = get_array_type(bit_depth)
@@ -165,7 +249,7 @@ class RawWaveformLabelGen(Dataset):
 
     @staticmethod
     def mu_law_companding(raw, mu=255):
-        raw = (((np.sign(raw) * np.log(1 + mu * np.abs(raw)) / np.log(1 + mu)) + 1.0) * (mu / 2.0)).astype(np.long)
+        raw = (((np.sign(raw) * np.log(1 + mu * np.abs(raw)) / np.log(1 + mu)) + 1.0) * (mu / 2.0)).astype(np.int64)
         return raw
 
     @staticmethod
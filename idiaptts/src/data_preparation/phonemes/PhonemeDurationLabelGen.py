@@ -16,6 +16,7 @@ import logging
 import os
 import sys
 from collections import OrderedDict
+from functools import partial
 import numpy as np
 
 # Third-party imports.
@@ -24,6 +25,7 @@ import numpy as np
 from idiaptts.misc.normalisation.MeanStdDevExtractor import MeanStdDevExtractor
 from idiaptts.misc.normalisation.MinMaxExtractor import MinMaxExtractor
 from idiaptts.src.data_preparation.LabelGen import LabelGen
+from idiaptts.src.data_preparation.NormTransform import NormTransform
 from idiaptts.misc.utils import makedirs_safe, interpolate_lin, compute_deltas
 
 
@@ -72,15 +74,11 @@ class PhonemeDurationLabelGen(LabelGen):
         :return:                  Pre-processed sample.
         """
 
-        if norm_params is not None:
-            mean, std_dev = norm_params
-        elif self.norm_params is not None:
-            mean, std_dev = self.norm_params
-        else:
-            self.logger.error("Please give norm_params argument or call get_normaliations_params() before.")
+        norm_transform = self._get_norm_transform(norm_params, NormTransform.from_mean_std_dev)
+        if norm_transform is None:
             return None
 
-        return np.float32((sample - mean) / std_dev)
+        return norm_transform.apply(sample)
 
     def postprocess_sample(self, sample, norm_params=None):
         """
@@ -90,17 +88,11 @@ class PhonemeDurationLabelGen(LabelGen):
         :param norm_params:       Use this normalisation parameters instead of self.norm_params.
         :return:                  Post-processed sample.
         """
-        if norm_params is not None:
-            mean, std_dev = norm_params
-        elif self.norm_params is not None:
-            mean, std_dev = self.norm_params
-        else:
-            self.logger.error("Please give norm_params argument or call get_normaliations_params() before.")
+        norm_transform = self._get_norm_transform(norm_params, NormTransform.from_mean_std_dev)
+        if norm_transform is None:
             return None
 
-        sample = np.copy((sample * std_dev) + mean)
-
-        return sample
+        return norm_transform.invert(sample)
 
     @staticmethod
     def load_sample(id_name, dir_out):
@@ -137,7 +129,31 @@ class PhonemeDurationLabelGen(LabelGen):
         return self.norm_params
 
     @staticmethod
-    def gen_data(dir_in, dir_out=None, file_id_list="", id_list=None, return_dict=False):
+    def _gen_sample(dir_in, dir_out, file_name):
+        """
+        Extract and save the durations of a single utterance. Used by gen_data, possibly in a worker process.
+
+        :return:               The durations and a normalisation computation unit containing only this utterance.
+        """
+        logging.debug("Extract phoneme durations from " + file_name)
+
+        with open(os.path.join(dir_in, file_name + PhonemeDurationLabelGen.ext_phonemes), 'r') as f:
+            htk_labels = [line.rstrip('\n').split()[:2] for line in f]
+            timings = np.array(htk_labels, dtype=np.float32) / PhonemeDurationLabelGen.min_phoneme_length
+            dur = timings[:, 1] - timings[:, 0]
+            dur = dur.reshape(-1, PhonemeDurationLabelGen.num_states).astype(np.float32)
+
+        if dir_out is not None:
+            dur.tofile(os.path.join(dir_out, file_name + PhonemeDurationLabelGen.ext_durations))
+
+        # Add sample to normalisation computation unit.
+        normaliser = MeanStdDevExtractor()
+        normaliser.add_sample(dur)
+
+        return dur, normaliser
+
+    @staticmethod
+    def gen_data(dir_in, dir_out=None, file_id_list="", id_list=None, return_dict=False, num_workers=1):
         """
         Prepare durations from HTK labels (forced-aligned).
         Each numpy array has the dimension num_phonemes x PhonemeDurationLabelGen.num_states (default num_state=5).
@@ -151,6 +167,8 @@ class PhonemeDurationLabelGen(LabelGen):
                                Should have the form uttId1 \\n uttId2 \\n ...\\n uttIdN.
                                If None, all file in dir_in are used.
         :param return_dict:    If true, returns an OrderedDict of all samples as first output.
+        :param num_workers:    Number of processes extracting durations in parallel. The normalisation statistics of
+                               all utterances are merged in the order of id_list, so results equal a serial run.
         :return:               Returns two normalisation parameters as tuple. If return_dict is True it returns
                                all processed labels in an OrderedDict followed by the two normalisation parameters.
         """
@@ -178,22 +196,13 @@ class PhonemeDurationLabelGen(LabelGen):
         norm_params_ext_dur = MeanStdDevExtractor()
 
         logging.info("Extract phoneme durations for " + "[{0}]".format(", ".join(str(i) for i in id_list)))
-        for file_name in id_list:
-            logging.debug("Extract phoneme durations from " + file_name)
-
-            with open(os.path.join(dir_in, file_name + PhonemeDurationLabelGen.ext_phonemes), 'r') as f:
-                htk_labels = [line.rstrip('\n').split()[:2] for line in f]
-                timings = np.array(htk_labels, dtype=np.float32) / PhonemeDurationLabelGen.min_phoneme_length
-                dur = timings[:, 1] - timings[:, 0]
-                dur = dur.reshape(-1, PhonemeDurationLabelGen.num_states).astype(np.float32)
-
+        gen_sample_fn = partial(PhonemeDurationLabelGen._gen_sample, dir_in, dir_out)
+        for file_name, (dur, normaliser) in zip(id_list, LabelGen.map_id_list(gen_sample_fn, id_list, num_workers)):
             if return_dict:
                 label_dict[file_name] = dur
-            if dir_out is not None:
-                dur.tofile(os.path.join(dir_out, file_name + PhonemeDurationLabelGen.ext_durations))
 
-            # Add sample to normalisation computation unit.
-            norm_params_ext_dur.add_sample(dur)
+            # Merge the statistics in order, so that they are identical to a serial run.
+            norm_params_ext_dur.merge(normaliser)
 
         # Save mean and std dev of all features.
         norm_params_ext_dur.save(os.path.join(dir_out, file_id_list_name))
@@ -221,6 +230,8 @@ def main():
     parser.add_argument("-o", "--dir_out", help="Output directory to store the labels."
                                                 "Within the output directory folders for each feature will be created.",
                         type=str, dest="dir_out", required=True)
+    parser.add_argument("--num_workers", help="Number of processes used to extract the durations.",
+                        type=int, dest="num_workers", default=1)
 
     # Parse arguments
     args = parser.parse_args()
@@ -243,7 +254,8 @@ def main():
         file_id_list_name = "all"
 
     # Execute main functionality.
-    PhonemeDurationLabelGen.gen_data(dir_labels, dir_out, args.file_id_list_path, id_list, return_dict=False)
+    PhonemeDurationLabelGen.gen_data(dir_labels, dir_out, args.file_id_list_path, id_list, return_dict=False,
+                                     num_workers=args.num_workers)
 
     # # DEBUG
     # label_dict, *_ = dur_gen.gen_data(dir_labels, dir_out, args.file_id_list_path, id_list, return_dict=True)
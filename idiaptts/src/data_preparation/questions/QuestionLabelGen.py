@@ -21,31 +21,92 @@ import numpy as np
 
 # Local source tree imports.
 from idiaptts.misc.normalisation.MinMaxExtractor import MinMaxExtractor as NormExtractor
+from idiaptts.src.data_preparation.FeatureCodec import FeatureCodec
 from idiaptts.src.data_preparation.LabelGen import LabelGen
+from idiaptts.src.data_preparation.NormTransform import NormTransform
 from idiaptts.src.data_preparation.questions.label_normalisation import HTSLabelNormalisation
 from idiaptts.misc.utils import makedirs_safe, file_len
 
 
 class QuestionLabelGen(LabelGen):
-    """Create question labels for .lab files."""
+    """
+    Create question labels for .lab files.
+
+    Question labels are stored as float32 (num_frames x num_questions) in .questions files, or bit-packed in
+    .questions_packed files where the binary questions (the first num_binary_questions, i.e. all QS) are stored with
+    one bit each (np.packbits) followed by the remaining continuous questions (CQS and frame features) as float32.
+    State-level labels in .questions_state files contain one row per state instead of per frame, see
+    HTSLabelNormalisation.load_state_labels_with_state_alignment. They are expanded to frames per batch by the
+    FrameExpansionCollator.
+    Bit-packed labels can also be loaded as sparse samples which only contain the indices and values of the non-zero
+    binary questions of each frame, see preprocess_sparse_sample and the Sparse layers of RNNDyn.
+    """
 
     ext_question = ".questions"
+    ext_question_packed = ".questions_packed"
+    ext_question_state = ".questions_state"
     logger = logging.getLogger(__name__)
 
-    def __init__(self, dir_labels, num_questions):
+    def __init__(self, dir_labels, num_questions, num_binary_questions=None, state_level=False, subphone_feats="full",
+                 sparse_num_active=None):
+        """
+        :param dir_labels:              Directory containing the question labels.
+        :param num_questions:           Total number of questions (binary and continuous) per frame.
+        :param num_binary_questions:    If given, samples are loaded from the bit-packed format, see save_packed_sample.
+        :param state_level:             Load state-level samples, see preprocess_state_sample.
+        :param subphone_feats:          Type of frame features of state-level samples, see HTSLabelNormalisation.
+        :param sparse_num_active:       If given, bit-packed samples are loaded as sparse samples with this maximum
+                                        number of non-zero binary questions per frame, see preprocess_sparse_sample.
+        """
+        if state_level and num_binary_questions is not None:
+            raise ValueError("State-level question labels cannot be bit-packed.")
+        if sparse_num_active is not None and num_binary_questions is None:
+            raise ValueError("Sparse question labels require num_binary_questions of bit-packed labels.")
 
         # Attributes.
         self.dir_labels = dir_labels
         self.num_questions = num_questions
+        self.num_binary_questions = num_binary_questions
+        self.state_level = state_level
+        self.num_state_questions = num_questions - HTSLabelNormalisation.frame_feature_sizes[subphone_feats]
+        self.sparse_num_active = sparse_num_active
         self.norm_params = None
 
     def __getitem__(self, id_name):
         """Return the preprocessed sample with the given id_name."""
-        sample = self.load_sample(id_name, self.dir_labels, self.num_questions)
-        sample = self.preprocess_sample(sample)
+        if self.state_level:
+            sample = self.load_state_sample(id_name, self.dir_labels, self.num_state_questions)
+            sample = self.preprocess_state_sample(sample)
+        elif self.num_binary_questions is None:
+            sample = self.load_sample(id_name, self.dir_labels, self.num_questions)
+            sample = self.preprocess_sample(sample)
+        else:
+            packed_sample = self.load_packed_sample(id_name, self.dir_labels, self.num_questions,
+                                                    self.num_binary_questions)
+            if self.sparse_num_active is None:
+                sample = self.preprocess_packed_sample(*packed_sample)
+            else:
+                sample = self.preprocess_sparse_sample(*packed_sample, self.sparse_num_active)
 
         return sample
 
+    def get_length(self, id_name):
+        """
+        Return the number of frames of a sample from its file size without loading it. State-level samples are
+        loaded to sum up the frames of their states.
+        """
+        id_name = os.path.splitext(os.path.basename(id_name))[0]
+        if self.state_level:
+            sample = self.load_state_sample(id_name, self.dir_labels, self.num_state_questions)
+            return int(sample[:, self.num_state_questions].sum())
+        elif self.num_binary_questions is None:
+            label_file = os.path.join(self.dir_labels, id_name + self.ext_question)
+            return FeatureCodec.get_num_frames(label_file, self.num_questions)
+        else:
+            label_file = os.path.join(self.dir_labels, id_name + self.ext_question_packed)
+            return os.path.getsize(label_file) // self.get_num_packed_frame_bytes(self.num_questions,
+                                                                                  self.num_binary_questions)
+
     @staticmethod
     def trim_end_sample(sample, length, reverse=False):
         """
@@ -70,6 +131,119 @@ class QuestionLabelGen(LabelGen):
         :return:                  Pre-processed sample.
         """
 
+        norm_transform = self._get_norm_transform(norm_params, NormTransform.from_min_max)
+        if norm_transform is None:
+            return None
+
+        # Return normalised questions.
+        return norm_transform.apply(sample)
+
+    def preprocess_packed_sample(self, packed_questions, continuous_questions, norm_params=None):
+        """
+        Unpack a sample loaded with load_packed_sample directly into a normalised float32 array. The result is
+        identical to preprocess_sample of the unpacked sample. Binary questions can only take two values, so their
+        normalised values are looked up instead of computed for every frame.
+
+        :param packed_questions:        Bit-packed binary questions (num_frames x ceil(num_binary_questions / 8)).
+        :param continuous_questions:    Continuous questions (num_frames x num_continuous_questions).
+        :param norm_params:             Use this normalisation parameters instead of self.norm_params.
+        :return:                        Pre-processed sample.
+        """
+        norm_transform = self._get_norm_transform(norm_params, NormTransform.from_min_max)
+        if norm_transform is None:
+            return None
+        num_questions = len(norm_transform.scale)
+        num_binary_questions = num_questions - continuous_questions.shape[1]
+
+        sample = np.empty((len(packed_questions), num_questions), dtype=np.float32)
+
+        sample[:, :num_binary_questions] = self._normalise_packed_questions(
+            packed_questions, norm_transform.scale[:num_binary_questions], norm_transform.offset[:num_binary_questions])
+        np.multiply(continuous_questions, norm_transform.scale[num_binary_questions:],
+                    out=sample[:, num_binary_questions:])
+        sample[:, num_binary_questions:] += norm_transform.offset[num_binary_questions:]
+
+        return sample
+
+    @staticmethod
+    def _normalise_packed_questions(packed_questions, binary_scale, binary_offset):
+        """Return the normalised float32 binary questions of bit-packed questions."""
+        value_false, value_true = np.multiply([[0.0], [1.0]], binary_scale, dtype=np.float32) + binary_offset
+        binary_questions = np.unpackbits(packed_questions, axis=1, count=len(binary_scale)).view(np.bool_)
+        return np.where(binary_questions, value_true, value_false)
+
+    def preprocess_sparse_sample(self, packed_questions, continuous_questions, num_active, norm_params=None):
+        """
+        Convert a sample loaded with load_packed_sample into a normalised sparse sample. Each frame of a sparse sample
+        contains the normalised continuous questions followed by the indices and then the values of the binary
+        questions whose normalised value is not zero (num_frames x (num_continuous_questions + 2 * num_active)).
+        Unused slots have index 0 and value 0, so they do not contribute to a weighted sum. A linear layer on the
+        sample from preprocess_packed_sample is equivalent to the sum of the continuous part through the linear layer
+        and the weighted sum of the columns of the binary part at the given indices (see SparseInputLinear).
+
+        :param packed_questions:        Bit-packed binary questions (num_frames x ceil(num_binary_questions / 8)).
+        :param continuous_questions:    Continuous questions (num_frames x num_continuous_questions).
+        :param num_active:              Maximum number of non-zero binary questions per frame.
+        :param norm_params:             Use this normalisation parameters instead of self.norm_params.
+        :return:                        Pre-processed sparse sample.
+        """
+        norm_transform = self._get_norm_transform(norm_params, NormTransform.from_min_max)
+        if norm_transform is None:
+            return None
+        num_continuous_questions = continuous_questions.shape[1]
+        num_binary_questions = len(norm_transform.scale) - num_continuous_questions
+
+        binary_questions = self._normalise_packed_questions(packed_questions,
+                                                            norm_transform.scale[:num_binary_questions],
+                                                            norm_transform.offset[:num_binary_questions])
+        frames, questions = np.nonzero(binary_questions)
+        num_frame_active = np.bincount(frames, minlength=len(binary_questions))
+        if len(frames) > 0 and num_frame_active.max() > num_active:
+            raise ValueError("A frame has {} non-zero binary questions but only {} are allowed."
+                             .format(num_frame_active.max(), num_active))
+        # Position of each non-zero question within its frame.
+        slots = np.arange(len(frames)) - np.repeat(np.cumsum(num_frame_active) - num_frame_active, num_frame_active)
+
+        sample = np.zeros((len(packed_questions), num_continuous_questions + 2 * num_active), dtype=np.float32)
+        np.multiply(continuous_questions, norm_transform.scale[num_binary_questions:],
+                    out=sample[:, :num_continuous_questions])
+        sample[:, :num_continuous_questions] += norm_transform.offset[num_binary_questions:]
+        sample[frames, num_continuous_questions + slots] = questions
+        sample[frames, num_continuous_questions + num_active + slots] = binary_questions[frames, questions]
+
+        return sample
+
+    def preprocess_state_sample(self, state_sample, norm_params=None):
+        """
+        Normalise the label vectors of a state-level sample with the normalisation parameters of the frame-level
+        questions. The state information columns stay unnormalised, they are required for the frame expansion.
+
+        :param state_sample:      The state-level sample to pre-process.
+        :param norm_params:       Use this normalisation parameters instead of self.norm_params.
+        :return:                  Pre-processed sample.
+        """
+        norm_transform = self._get_norm_transform(norm_params, NormTransform.from_min_max)
+        if norm_transform is None:
+            return None
+        num_state_questions = state_sample.shape[1] - HTSLabelNormalisation.num_state_info
+
+        sample = np.array(state_sample, dtype=np.float32)
+        sample[:, :num_state_questions] *= norm_transform.scale[:num_state_questions]
+        sample[:, :num_state_questions] += norm_transform.offset[:num_state_questions]
+
+        return sample
+
+    def get_frame_feature_norm_params(self, norm_params=None):
+        """Return the (min, max) normalisation parameters of the frame features of state-level samples."""
+        norm_params = self._get_checked_norm_params(norm_params)
+        if norm_params is None:
+            return None
+        samples_min, samples_max = norm_params
+
+        return samples_min[self.num_state_questions:], samples_max[self.num_state_questions:]
+
+    def _get_checked_norm_params(self, norm_params=None):
+        """Return the given or stored normalisation parameters where max is always greater than min."""
         if norm_params is not None:
             samples_min, samples_max = norm_params
         elif self.norm_params is not None:
@@ -78,18 +252,7 @@ class QuestionLabelGen(LabelGen):
             self.logger.error("Please give norm_params argument or call get_normaliations_params() before.")
             return None
 
-        # Prevent division by zero.
-        for index in range(len(samples_min)):
-            if samples_min[index] == samples_max[index]:
-                samples_max[index] += 1
-            elif samples_min[index] > samples_max[index]:
-                logging.warning("Min greater then max for feature " + str(index) + ": ("
-                                + str(samples_min[index]) + " > " + str(samples_max[index]) + "), changing max to "
-                                + str(samples_min[index] + 1))
-                samples_max[index] = samples_min[index] + 1
-
-        # Return normalised questions.
-        return np.float32((sample - samples_min) / (samples_max - samples_min))
+        return NormTransform.get_checked_min_max(samples_min, samples_max)
 
     def postprocess_sample(self, sample, norm_params=None):
         """
@@ -99,43 +262,123 @@ class QuestionLabelGen(LabelGen):
         :param norm_params:       Use this normalisation parameters instead of self.norm_params.
         :return:                  Post-processed sample.
         """
-        if norm_params is not None:
-            samples_min, samples_max = norm_params
-        elif self.norm_params is not None:
-            samples_min, samples_max = self.norm_params
-        else:
-            self.logger.error("Please give norm_params argument or call get_normaliations_params() before.")
+        norm_transform = self._get_norm_transform(norm_params, NormTransform.from_min_max)
+        if norm_transform is None:
             return None
 
-        # Prevent multiplication by zero.
-        for index in range(len(samples_min)):
-            if samples_min[index] == samples_max[index]:
-                samples_max[index] += 1
-            elif samples_min[index] > samples_max[index]:
-                logging.warning("Min greater then max for feature " + str(index) + ": ("
-                                + str(samples_min[index]) + " > " + str(samples_max[index]) + "), changing max to "
-                                + str(samples_min[index] + 1))
-                samples_max[index] = samples_min[index] + 1
-
-        sample = np.copy(sample * (samples_max - samples_min) + samples_min)
-
-        return sample
+        return norm_transform.invert(sample)
 
     @staticmethod
-    def load_sample(id_name, dir_out, num_questions=425):
+    def load_sample(id_name, dir_out, num_questions=425, num_binary_questions=None):
         """
         Load labels from dir_out int a numpy array.
 
-        :param id_name:         Id of the sample.
-        :param dir_out:         Directory containing the sample.
-        :param num_questions:   Required to reshape the array.
+        :param id_name:                 Id of the sample.
+        :param dir_out:                 Directory containing the sample.
+        :param num_questions:           Required to reshape the array.
+        :param num_binary_questions:    If given, the sample is loaded from the bit-packed format and unpacked.
 
         :return:                Numpy array with dimensions num_frames x num_questions.
         """
+        if num_binary_questions is not None:
+            packed_questions, continuous_questions = QuestionLabelGen.load_packed_sample(id_name, dir_out, num_questions,
+                                                                                         num_binary_questions)
+            return QuestionLabelGen.unpack_sample(packed_questions, continuous_questions, num_binary_questions)
+
         id_name = os.path.splitext(os.path.basename(id_name))[0]  # Features should be stored in same directory, no speaker dependent subdirs.
         label_file = os.path.join(dir_out, id_name + QuestionLabelGen.ext_question)
 
-        return np.fromfile(label_file, dtype=np.float32).reshape(-1, num_questions)
+        return FeatureCodec.load_frames(label_file, num_questions).reshape(-1, num_questions)
+
+    @staticmethod
+    def load_state_sample(id_name, dir_out, num_state_questions):
+        """
+        Load state-level labels from dir_out into a numpy array.
+
+        :param id_name:               Id of the sample.
+        :param dir_out:               Directory containing the sample.
+        :param num_state_questions:   Number of questions without frame features.
+        :return:                      Numpy array with dimensions num_states x (num_state_questions + num_state_info).
+        """
+        id_name = os.path.splitext(os.path.basename(id_name))[0]
+        label_file = os.path.join(dir_out, id_name + QuestionLabelGen.ext_question_state)
+
+        return np.fromfile(label_file, dtype=np.float32).reshape(-1, num_state_questions
+                                                                 + HTSLabelNormalisation.num_state_info)
+
+    @staticmethod
+    def get_num_packed_frame_bytes(num_questions, num_binary_questions):
+        """Return the number of bytes of one frame in the bit-packed format."""
+        num_packed_bytes = (num_binary_questions + 7) // 8
+        return num_packed_bytes + np.dtype(np.float32).itemsize * (num_questions - num_binary_questions)
+
+    @staticmethod
+    def pack_sample(sample, num_binary_questions):
+        """
+        Split a sample into its bit-packed binary questions and its continuous questions.
+
+        :param sample:                  Question labels (num_frames x num_questions).
+        :param num_binary_questions:    Number of binary questions, which are the first questions of a sample.
+        :return:                        Tuple of packed binary questions (uint8) and continuous questions (float32).
+        """
+        binary_questions = sample[:, :num_binary_questions]
+        if not np.all((binary_questions == 0) | (binary_questions == 1)):
+            raise ValueError("The first {} questions are not binary.".format(num_binary_questions))
+
+        packed_questions = np.packbits(binary_questions.astype(np.bool_), axis=1)
+        continuous_questions = np.ascontiguousarray(sample[:, num_binary_questions:], dtype=np.float32)
+
+        return packed_questions, continuous_questions
+
+    @staticmethod
+    def unpack_sample(packed_questions, continuous_questions, num_binary_questions=None):
+        """Inverse of pack_sample, returns the float32 sample (num_frames x num_questions)."""
+        if num_binary_questions is None:
+            num_binary_questions = packed_questions.shape[1] * 8
+
+        sample = np.empty((len(packed_questions), num_binary_questions + continuous_questions.shape[1]),
+                          dtype=np.float32)
+        sample[:, :num_binary_questions] = np.unpackbits(packed_questions, axis=1, count=num_binary_questions)
+        sample[:, num_binary_questions:] = continuous_questions
+
+        return sample
+
+    @staticmethod
+    def save_packed_sample(sample, file_path, num_binary_questions):
+        """
+        Save a sample in the bit-packed format, which stores all packed binary questions of the sample followed by all
+        continuous questions.
+        """
+        packed_questions, continuous_questions = QuestionLabelGen.pack_sample(sample, num_binary_questions)
+        with open(file_path, 'wb') as f:
+            packed_questions.tofile(f)
+            continuous_questions.tofile(f)
+
+    @staticmethod
+    def load_packed_sample(id_name, dir_out, num_questions, num_binary_questions):
+        """
+        Load a sample in the bit-packed format without unpacking it, use unpack_sample or preprocess_packed_sample
+        to expand it.
+
+        :param id_name:                 Id of the sample.
+        :param dir_out:                 Directory containing the sample.
+        :param num_questions:           Total number of questions.
+        :param num_binary_questions:    Number of binary questions.
+        :return:                        Tuple of packed binary questions (num_frames x ceil(num_binary_questions / 8)
+                                        uint8) and continuous questions (num_frames x num_continuous_questions float32).
+        """
+        id_name = os.path.splitext(os.path.basename(id_name))[0]
+        label_file = os.path.join(dir_out, id_name + QuestionLabelGen.ext_question_packed)
+
+        data = np.fromfile(label_file, dtype=np.uint8)
+        num_packed_bytes = (num_binary_questions + 7) // 8
+        num_frames = len(data) // QuestionLabelGen.get_num_packed_frame_bytes(num_questions, num_binary_questions)
+
+        packed_questions = data[:num_frames * num_packed_bytes].reshape(num_frames, num_packed_bytes)
+        continuous_questions = data[num_frames * num_packed_bytes:].view(np.float32)\
+            .reshape(num_frames, num_questions - num_binary_questions)
+
+        return packed_questions, continuous_questions
 
     def get_normalisation_params(self, dir_out, file_name=None):
         """
@@ -155,12 +398,14 @@ class QuestionLabelGen(LabelGen):
         return self.norm_params
 
     @staticmethod
-    def gen_data(dir_in, file_questions, dir_out=None, file_id_list="", id_list=None, return_dict=False):
+    def gen_data(dir_in, file_questions, dir_out=None, file_id_list="", id_list=None, return_dict=False, num_workers=1,
+                 save_packed=False, state_level=False):
         """
         Generate question labels from HTK labels.
 
         :param dir_in:         Directory containing the HTK labels.
-        :param file_questions: Full file path to the question file.
+        :param file_questions: Full file path to the question file, a QuestionSet saved with QuestionSet.save
+                               (*.qset.pkl), or a QuestionSet instance.
         :param dir_out:        Directory to store the question labels. If None, labels are not saved.
         :param file_id_list:   Name of the file containing the ids. Normalisation parameters are saved using
                                this name to differentiate parameters between subsets.a
@@ -168,6 +413,12 @@ class QuestionLabelGen(LabelGen):
                                Should have the form uttId1 \\n uttId2 \\n ...\\n uttIdN.
                                If None, all file in audio_dir are used.
         :param return_dict:    If true, returns an OrderedDict of all samples as first output.
+        :param num_workers:    Number of processes creating question labels in parallel. The normalisation statistics
+                               of all utterances are merged in the order of id_list, so results equal a serial run.
+        :param save_packed:    Save the labels in the bit-packed format (.questions_packed) instead of float32. Load
+                               them with num_binary_questions set to the number of QS in the question file.
+        :param state_level:    Save one row per state (.questions_state) instead of one per frame. Returned labels are
+                               state-level as well. The normalisation parameters are the ones of the frames.
         :return:               Returns two normalisation parameters as tuple. If return_dict is True it returns
                                all processed labels in an OrderedDict followed by the two normalisation parameters.
         """
@@ -187,14 +438,40 @@ class QuestionLabelGen(LabelGen):
         if dir_out is not None:
             makedirs_safe(dir_out)
 
+        if save_packed and state_level:
+            raise ValueError("State-level question labels cannot be bit-packed.")
+
         # Get question generation class.
         label_operater = HTSLabelNormalisation(file_questions)
         if return_dict:
-            label_dict, norm_params = label_operater.perform_normalisation(file_id_list_name, id_list, dir_in, dir_out, return_dict=True)
+            label_dict, norm_params = label_operater.perform_normalisation(file_id_list_name, id_list, dir_in, dir_out,
+                                                                           return_dict=True, num_workers=num_workers,
+                                                                           state_level=state_level)
+        else:
+            norm_params = label_operater.perform_normalisation(file_id_list_name, id_list, dir_in, dir_out,
+                                                               return_dict=False, num_workers=num_workers,
+                                                               state_level=state_level)
+
+        if save_packed:
+            num_binary_questions = len(label_operater.discrete_dict)
+            QuestionLabelGen.logger.info("Save question labels bit-packed with {} binary questions.".format(num_binary_questions))
+            for id_name in id_list:
+                label_file = os.path.join(dir_out, id_name + QuestionLabelGen.ext_question)
+                if return_dict:
+                    labels = np.asarray(label_dict[id_name])
+                else:
+                    labels = QuestionLabelGen.load_sample(id_name, dir_out, label_operater.dimension)
+                QuestionLabelGen.save_packed_sample(
+                    labels, os.path.join(dir_out, id_name + QuestionLabelGen.ext_question_packed),
+                    num_binary_questions)
+                if return_dict:
+                    label_dict[id_name] = np.array(labels)  # Copy labels which may map the removed file.
+                os.remove(label_file)
+
+        if return_dict:
             # self.norm_params = (samples_min, samples_max)
             return label_dict, norm_params[0], norm_params[1]
         else:
-            norm_params = label_operater.perform_normalisation(file_id_list_name, id_list, dir_in, dir_out, return_dict=False)
             return norm_params[0], norm_params[1]
 
     def get_HTK_label_timings_ms(self, htk_label):
@@ -285,6 +562,12 @@ def main():
                         type=str, dest="file_id_list_path", default=None)
     parser.add_argument("-o", "--dir_out", help="Output directory to store the labels.",
                         type=str, dest="dir_out", required=True)
+    parser.add_argument("--num_workers", help="Number of processes used to create the question labels.",
+                        type=int, dest="num_workers", default=1)
+    parser.add_argument("--save_packed", help="Save the binary questions bit-packed.", action="store_true",
+                        dest="save_packed")
+    parser.add_argument("--state_level", help="Save one row of questions per state instead of per frame.",
+                        action="store_true", dest="state_level")
 
     # Parse arguments
     args = parser.parse_args()
@@ -304,7 +587,9 @@ def main():
     dir_out = os.path.abspath(args.dir_out)
 
     # Execute main functionality.
-    QuestionLabelGen.gen_data(dir_labels, file_questions, dir_out=dir_out, file_id_list=args.file_id_list_path, id_list=id_list, return_dict=False)
+    QuestionLabelGen.gen_data(dir_labels, file_questions, dir_out=dir_out, file_id_list=args.file_id_list_path, id_list=id_list, return_dict=False,
+                              num_workers=args.num_workers, save_packed=args.save_packed,
+                              state_level=args.state_level)
 
     # DEBUG
     # label_dict, _, _ = QuestionLabelGen.gen_dict(dir_labels, file_questions, dir_out=dir_out,
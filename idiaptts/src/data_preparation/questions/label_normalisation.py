@@ -12,9 +12,11 @@
 import argparse
 import logging
 import os
+import pickle
 import re
 import sys
 from collections import OrderedDict
+from functools import partial
 import matplotlib.mlab as mlab
 import numpy
 
@@ -22,6 +24,10 @@ import numpy
 
 # Local source tree imports.
 from idiaptts.misc.normalisation.MinMaxExtractor import MinMaxExtractor
+from idiaptts.misc.utils import makedirs_safe
+from idiaptts.src.data_preparation.LabelGen import LabelGen
+from idiaptts.src.data_preparation.NormTransform import NormTransform
+from idiaptts.src.data_preparation.SampleCache import SampleCache
 
 
 class LabelNormalisation(object):
@@ -29,14 +35,31 @@ class LabelNormalisation(object):
     logger = logging.getLogger(__name__)
     htk_label_extension = ".lab"
     questions_label_extension = ".questions"
+    questions_state_label_extension = ".questions_state"
     file_name_mean_std = "-mean_std_dev"
     file_name_min_max = "-min_max"
 
+    _worker_instance = None  # Copy of the instance in each process of a parallel perform_normalisation.
+
     def __init__(self, file_questions):
         self.file_questions = file_questions
 
-    def perform_normalisation(self, file_id_list, id_list, dir_labels, dir_out, return_dict=False):
-
+    def perform_normalisation(self, file_id_list, id_list, dir_labels, dir_out, return_dict=False, num_workers=1,
+                              state_level=False):
+        """
+        Create the question labels of all ids and their min/max normalisation parameters.
+
+        :param file_id_list:   Name of the id list, used for the normalisation parameter file.
+        :param id_list:        List of ids.
+        :param dir_labels:     Directory containing the HTK labels.
+        :param dir_out:        Directory where the question files and normalisation parameters are saved.
+        :param return_dict:    Additionally return an OrderedDict of all question labels.
+        :param num_workers:    Number of processes, each receives a copy of this instance (and its question set)
+                               once. Per-utterance statistics are merged in the order of id_list.
+        :param state_level:    Save one row per state (see HTSLabelNormalisation.load_state_labels_with_state_alignment)
+                               instead of one per frame. The normalisation parameters are the ones of the frames.
+        :return:               Normalisation parameters, preceded by the label dictionary if return_dict is True.
+        """
         self.logger.info('perform linguistic feature extraction')
 
         normParamsExtractor = MinMaxExtractor()
@@ -44,47 +67,72 @@ class LabelNormalisation(object):
         if return_dict:
             dict_labels = OrderedDict()
 
-        for file_id in id_list:
-            self.logger.debug("Create question labels for " + file_id)
-            labels = self.extract_linguistic_features(os.path.join(dir_labels, file_id + self.htk_label_extension),
-                                                      os.path.join(dir_out, file_id + self.questions_label_extension))
-            normParamsExtractor.add_sample(labels)
+        if num_workers is None or num_workers <= 1:
+            fun = partial(self._extract_sample, dir_labels, dir_out, return_dict, state_level)
+            results = LabelGen.map_id_list(fun, id_list)
+        else:
+            # Labels are read back from the written files instead of sending them between processes.
+            fun = partial(LabelNormalisation._extract_sample_worker, dir_labels, dir_out, False, state_level)
+            results = LabelGen.map_id_list(fun, id_list, num_workers,
+                                           initializer=LabelNormalisation._init_worker, initargs=(self,))
+
+        for file_id, (sample_extractor, labels) in zip(id_list, results):
+            normParamsExtractor.merge(sample_extractor)
 
             if return_dict:
+                if labels is None and state_level:
+                    labels = numpy.fromfile(os.path.join(dir_out, file_id + self.questions_state_label_extension),
+                                            dtype=numpy.float32).reshape(-1, self.dict_size + self.num_state_info)
+                elif labels is None:
+                    labels = numpy.fromfile(os.path.join(dir_out, file_id + self.questions_label_extension),
+                                            dtype=numpy.float32).reshape(-1, self.dimension)
                 dict_labels[file_id] = labels
 
         file_id_list_name = os.path.splitext(os.path.basename(file_id_list))[0]
         normParamsExtractor.save(os.path.join(dir_out, file_id_list_name))
 
-        # def _perform_normalisation(i):
-        #     lab_file = os.path.join(dir_labels, file_id + self.htk_label_extension)
-        #     if not dur_file_list:
-        #         self.extract_linguistic_features(lab_file, lab_file, label_type)
-        #     else:
-        #         out_file = os.path.join(dir_out, file_id + self.questions_label_extension)
-        #         self.extract_linguistic_features(lab_file, out_file, label_type, dur_file_list[i])
-        # pool = Pool()
-        # self.utterance_num = len(id_list)
-        # pool.map(_perform_normalisation, range(self.utterance_num))
-        # pool.close()
-        # pool.join()
-
         norm_params = normParamsExtractor.get_params()
         if return_dict:
             return dict_labels, norm_params
         else:
             return norm_params
 
+    def _extract_sample(self, dir_labels, dir_out, return_labels, state_level, file_id):
+        """Extract the question labels of a single id, return its min/max statistics and optionally the labels."""
+        self.logger.debug("Create question labels for " + file_id)
+        file_labels = os.path.join(dir_labels, file_id + self.htk_label_extension)
+        sample_extractor = MinMaxExtractor()
+        if state_level:
+            labels = self.load_state_labels_with_state_alignment(
+                file_labels, os.path.join(dir_out, file_id + self.questions_state_label_extension))
+            sample_extractor.add_sample(self.expand_state_labels(labels, self.subphone_feats))
+        else:
+            labels = self.extract_linguistic_features(file_labels,
+                                                      os.path.join(dir_out, file_id + self.questions_label_extension))
+            sample_extractor.add_sample(labels)
+
+        return sample_extractor, labels if return_labels else None
+
+    @staticmethod
+    def _init_worker(label_normaliser):
+        LabelNormalisation._worker_instance = label_normaliser
+
+    @staticmethod
+    def _extract_sample_worker(dir_labels, dir_out, return_labels, state_level, file_id):
+        return LabelNormalisation._worker_instance._extract_sample(dir_labels, dir_out, return_labels, state_level,
+                                                                   file_id)
+
     def extract_linguistic_features(self, file_id, out_file_name=None, label_type="state_align", dur_file_name=None):
         if label_type == "phone_align":
             labels = self.load_labels_with_phone_alignment(file_id, dur_file_name)
         elif label_type == "state_align":
-            labels = self.load_labels_with_state_alignment(file_id)
+            # Rows are written directly into a memory map of the output file.
+            return self.load_labels_with_state_alignment(file_id, out_file_name=out_file_name)
         else:
             self.logger.critical("we don't support %s labels as of now!!" % (label_type))
 
         if out_file_name:
-            labels = numpy.array(labels, numpy.float32)
+            labels = numpy.asarray(labels, numpy.float32)
             # numpy.savetxt(out_file_name, labels)
             # path = os.path.dirname(out_file_name)
             # if not os.path.exists(path):
@@ -94,6 +142,164 @@ class LabelNormalisation(object):
 
         return labels
 
+    @staticmethod
+    def allocate_labels(num_rows, num_features, out_file_name=None):
+        """
+        Allocate a zero initialised float32 label matrix of the exact size. If out_file_name is given the matrix is
+        a memory map of that file (in the raw format written by numpy.tofile), so that rows are written to disk
+        directly and memory is bounded by the pages of a single utterance.
+        """
+        if out_file_name is None:
+            return numpy.zeros((num_rows, num_features), dtype=numpy.float32)
+
+        makedirs_safe(os.path.dirname(os.path.abspath(out_file_name)))
+        if num_rows == 0:
+            # Zero sized memory maps are not supported.
+            open(out_file_name, 'w').close()
+            return numpy.zeros((0, num_features), dtype=numpy.float32)
+
+        return numpy.memmap(out_file_name, dtype=numpy.float32, mode='w+', shape=(num_rows, num_features))
+
+    @staticmethod
+    def release_labels(labels):
+        """
+        Return a label matrix of allocate_labels as in-memory array. A memory map is flushed to its file first and
+        closed with the last reference to it, so no file stays open and the returned labels do not alias the file.
+        """
+        if isinstance(labels, numpy.memmap):
+            labels.flush()
+            return numpy.array(labels)
+        return labels
+
+
+class QuestionMatcher(object):
+    """
+    Evaluates all binary questions (QS) of a question set in a single pass over a full-context label, with the same
+    results as searching the regular expressions created by HTSLabelNormalisation.wildcards2regex.
+
+    HTK patterns without inner wildcards are literals which have to be contained in, start, end, or equal the label.
+    Contained literals which start and end with a delimiter (any non-alphanumeric character, e.g. -+/:_) are found
+    by looking up all delimiter-bounded substrings of the label (up to the longest literal) in a dictionary which
+    maps literals to question indices. Prefix, suffix, and equality literals are looked up with the prefix/suffix
+    of the label for each occurring literal length. Only the remaining patterns are tested one by one.
+    """
+
+    def __init__(self, questions):
+        """
+        :param questions:    List with one (patterns, regexes, anchor_start) tuple per question, where patterns is the
+                             list of HTK patterns, regexes the list of their compiled regular expressions (used for
+                             patterns with inner wildcards), and anchor_start forces matches at the label start.
+        """
+        self.num_questions = len(questions)
+
+        self._delimited = dict()  # Maps contained delimiter-bounded literals to question indices.
+        self._max_delimited_length = 0
+        self._prefixes = dict()  # Maps literal length to a dictionary of literals to question indices.
+        self._suffixes = dict()
+        self._equals = dict()
+        self._contained = list()  # Other contained literals as (literal, question index).
+        self._regexes = list()  # Patterns with inner wildcards as (compiled regex, question index).
+
+        for question_index, (patterns, regexes, anchor_start) in enumerate(questions):
+            for pattern, regex in zip(patterns, regexes):
+                self._add_pattern(question_index, pattern, regex, anchor_start)
+
+    @staticmethod
+    def _is_delimiter(character):
+        return not character.isalnum()
+
+    def _add_pattern(self, question_index, pattern, regex, anchor_start):
+        # Anchors as set by wildcards2regex.
+        if '*' in pattern:
+            anchor_start = anchor_start or not pattern.startswith('*')
+            anchor_end = not pattern.endswith('*')
+        else:
+            anchor_end = False
+        literal = pattern.strip('*')
+
+        if '*' in literal:
+            self._regexes.append((regex, question_index))
+        elif anchor_start and anchor_end:
+            self._equals.setdefault(literal, []).append(question_index)
+        elif anchor_start:
+            self._prefixes.setdefault(len(literal), dict()).setdefault(literal, []).append(question_index)
+        elif anchor_end:
+            self._suffixes.setdefault(len(literal), dict()).setdefault(literal, []).append(question_index)
+        elif len(literal) > 0 and self._is_delimiter(literal[0]) and self._is_delimiter(literal[-1]):
+            self._delimited.setdefault(literal, []).append(question_index)
+            self._max_delimited_length = max(self._max_delimited_length, len(literal))
+        else:
+            self._contained.append((literal, question_index))
+
+    def match(self, label):
+        """Return the set of indices of all questions which match the label."""
+        matched = set()
+
+        if len(self._delimited) > 0:
+            delimited = self._delimited
+            max_length = self._max_delimited_length
+            positions = [index for index, character in enumerate(label) if not character.isalnum()]
+            for position_index, start in enumerate(positions):
+                for end in positions[position_index:]:
+                    if end - start >= max_length:
+                        break
+                    question_indices = delimited.get(label[start:end + 1])
+                    if question_indices is not None:
+                        matched.update(question_indices)
+
+        for length, literals in self._prefixes.items():
+            question_indices = literals.get(label[:length])
+            if question_indices is not None:
+                matched.update(question_indices)
+
+        for length, literals in self._suffixes.items():
+            question_indices = literals.get(label[len(label) - length:])
+            if question_indices is not None:
+                matched.update(question_indices)
+
+        question_indices = self._equals.get(label)
+        if question_indices is not None:
+            matched.update(question_indices)
+
+        for literal, question_index in self._contained:
+            if question_index not in matched and literal in label:
+                matched.add(question_index)
+
+        for regex, question_index in self._regexes:
+            if question_index not in matched and regex.search(label) is not None:
+                matched.add(question_index)
+
+        return matched
+
+
+class QuestionSet(object):
+    """
+    Parsed and compiled HTS question set, see HTSLabelNormalisation.load_question_set_continous. The question set
+    is picklable, so it can be sent to worker processes or saved once and loaded from disk instead of parsing the
+    question file again (compiled regular expressions are pickled by their pattern).
+    """
+    ext = "qset.pkl"
+
+    def __init__(self, discrete_dict, continuous_dict, binary_questions):
+        """
+        :param discrete_dict:       Dictionary mapping str(index) to a list of compiled regexes of each QS.
+        :param continuous_dict:     Dictionary mapping str(index) to the compiled regex of each CQS.
+        :param binary_questions:    List of (patterns, regexes, anchor_start) tuples, see QuestionMatcher.
+        """
+        self.discrete_dict = discrete_dict
+        self.continuous_dict = continuous_dict
+        self.matcher = QuestionMatcher(binary_questions)
+
+    def save(self, file_path):
+        makedirs_safe(os.path.dirname(os.path.abspath(file_path)))
+        with open(file_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(file_path):
+        with open(file_path, 'rb') as f:
+            return pickle.load(f)
+
 
 class HTSLabelNormalisation(LabelNormalisation):
     """This class is to convert HTS format labels into continous or binary values, and store as binary format with float32 precision.
@@ -122,7 +328,22 @@ class HTSLabelNormalisation(LabelNormalisation):
 
     # this subclass support HTS labels, which include time alignments
 
-    def __init__(self, file_questions=None, add_frame_features=True, subphone_feats='full', continuous_flag=True):
+    frame_feature_sizes = {
+        'full': 9,  ## zhizheng's original 5 state features + 4 phoneme features
+        'minimal_frame': 2,  ## the minimal features necessary to go from a state-level to frame-level model
+        'state_only': 1,  ## this is equivalent to a state-based system
+        'none': 0,  ## the phoneme level features only
+        'frame_only': 1,  ## this is equivalent to a frame-based system without relying on state-features
+        'uniform_state': 2,  ## this is equivalent to a frame-based system with uniform state-features
+        'minimal_phoneme': 3,  ## this is equivalent to a frame-based system with minimal features
+        'coarse_coding': 4  ## this is equivalent to a frame-based positioning system reported in Heiga Zen's work
+    }
+    ## columns appended to state-level labels: number of frames of the state, state index, number of frames of the
+    ## phone, number of frames of the previous states in the phone
+    num_state_info = 4
+
+    def __init__(self, file_questions=None, add_frame_features=True, subphone_feats='full', continuous_flag=True,
+                 label_cache_size_mb=64):
 
         self.question_dict = {}
         self.ori_question_dict = {}
@@ -130,10 +351,19 @@ class HTSLabelNormalisation(LabelNormalisation):
         self.continuous_flag = continuous_flag
         try:
 #            self.question_dict, self.ori_question_dict = self.load_question_set(question_file_name)
-            self.discrete_dict, self.continuous_dict = self.load_question_set_continous(file_questions)
+            if isinstance(file_questions, QuestionSet):
+                self.question_set = file_questions
+            elif file_questions.endswith(QuestionSet.ext):
+                self.question_set = QuestionSet.load(file_questions)
+            else:
+                self.question_set = self.load_question_set_continous(file_questions)
         except:
             self.logger.critical('error whilst loading HTS question set')
             raise
+        self.discrete_dict = self.question_set.discrete_dict
+        self.continuous_dict = self.question_set.continuous_dict
+        # Question vectors of full-context labels, which repeat often within and across utterances.
+        self.label_vector_cache = SampleCache(label_cache_size_mb * 1024 ** 2)
 
         ###self.dict_size = len(self.question_dict)
 
@@ -141,25 +371,11 @@ class HTSLabelNormalisation(LabelNormalisation):
         self.add_frame_features = add_frame_features
         self.subphone_feats = subphone_feats
 
-        if self.subphone_feats == 'full':
-            self.frame_feature_size = 9   ## zhizheng's original 5 state features + 4 phoneme features
-        elif self.subphone_feats == 'minimal_frame':
-            self.frame_feature_size = 2   ## the minimal features necessary to go from a state-level to frame-level model
-        elif self.subphone_feats == 'state_only':
-            self.frame_feature_size = 1   ## this is equivalent to a state-based system
-        elif self.subphone_feats == 'none':
-            self.frame_feature_size = 0   ## the phoneme level features only
-        elif self.subphone_feats == 'frame_only':
-            self.frame_feature_size = 1   ## this is equivalent to a frame-based system without relying on state-features
-        elif self.subphone_feats == 'uniform_state':
-            self.frame_feature_size = 2   ## this is equivalent to a frame-based system with uniform state-features
-        elif self.subphone_feats == 'minimal_phoneme':
-            self.frame_feature_size = 3   ## this is equivalent to a frame-based system with minimal features
-        elif self.subphone_feats == 'coarse_coding':
-            self.frame_feature_size = 4   ## this is equivalent to a frame-based positioning system reported in Heiga Zen's work
-            self.cc_features = self.compute_coarse_coding_features(3)
-        else:
+        if self.subphone_feats not in self.frame_feature_sizes:
             sys.exit('Unknown value for subphone_feats: %s'%(subphone_feats))
+        self.frame_feature_size = self.frame_feature_sizes[self.subphone_feats]
+        if self.subphone_feats == 'coarse_coding':
+            self.cc_features = self.compute_coarse_coding_features(3)
 
         self.dimension = self.dict_size + self.frame_feature_size
 
@@ -169,6 +385,12 @@ class HTSLabelNormalisation(LabelNormalisation):
 
         self.logger.debug('HTS-derived input feature dimension is %d + %d = %d' % (self.dict_size, self.frame_feature_size, self.dimension) )
 
+    def __getstate__(self):
+        # Do not send cached label vectors to worker processes.
+        state = self.__dict__.copy()
+        state["label_vector_cache"] = SampleCache(self.label_vector_cache.max_bytes)
+        return state
+
     def prepare_dur_data(self, ori_file_list, output_file_list, label_type="state_align", feature_type=None, unit_size=None, feat_size=None):
         '''
         extracting duration binary features or numerical features.
@@ -470,12 +692,7 @@ class HTSLabelNormalisation(LabelNormalisation):
                     cc_feat_matrix = self.extract_coarse_coding_features_relative(frame_number)
 
             ph_count = ph_count+1
-            #label_binary_vector = self.pattern_matching(full_label)
-            label_binary_vector = self.pattern_matching_binary(full_label)
-
-            # if there is no CQS question, the label_continuous_vector will become to empty
-            label_continuous_vector = self.pattern_matching_continous_position(full_label)
-            label_vector = numpy.concatenate([label_binary_vector, label_continuous_vector], axis = 1)
+            label_vector = self.get_label_vector(full_label)
 
             if self.add_frame_features:
                 current_block_binary_array = numpy.zeros((frame_number, self.dict_size+self.frame_feature_size))
@@ -516,8 +733,34 @@ class HTSLabelNormalisation(LabelNormalisation):
         return  label_feature_matrix
 
 
-    def load_labels_with_state_alignment(self, file_name):
+    def get_num_rows_state_alignment(self, utt_labels, state_number=5):
+        """Return the number of rows load_labels_with_state_alignment creates for the given label lines."""
+        num_rows = 0
+        for line in utt_labels:
+            temp_list = line.split()
+            if len(temp_list) == 0:
+                continue
+
+            if len(temp_list) == 1:
+                frame_number = 0
+                state_index = state_number  # Lines without timings are expanded to all states at once.
+            else:
+                frame_number = int((int(temp_list[1]) - int(temp_list[0]))/50000)
+                state_index = int(temp_list[2][-2]) - 1
+
+            if self.add_frame_features:
+                num_rows += frame_number
+            elif self.subphone_feats == 'state_only' and state_index == state_number:
+                num_rows += state_number
+            elif self.subphone_feats == 'none' and state_index == state_number:
+                num_rows += 1
+
+        return num_rows
+
+    def load_labels_with_state_alignment(self, file_name, out_file_name=None):
         ## setting add_frame_features to False performs either state/phoneme level normalisation
+        ## the exact number of rows is computed from the label timings first, the float32 output is allocated once
+        ## and written to a memory map of out_file_name if given
 
         if self.add_frame_features:
             assert self.dimension == self.dict_size+self.frame_feature_size
@@ -526,14 +769,10 @@ class HTSLabelNormalisation(LabelNormalisation):
         else:
             assert self.dimension == self.dict_size
 
-        # label_feature_matrix = numpy.empty((100000, self.dict_size+self.frame_feature_size))
-        label_feature_matrix = numpy.empty((100000, self.dimension))
-
         label_feature_index = 0
 
         state_number = 5
 
-        lab_binary_vector = numpy.zeros((1, self.dict_size))
         fid = open(file_name)
         utt_labels = fid.readlines()
         fid.close()
@@ -541,6 +780,9 @@ class HTSLabelNormalisation(LabelNormalisation):
         label_number = len(utt_labels)
         self.logger.info('loaded %s, %3d labels' % (file_name, label_number) )
 
+        label_feature_matrix = self.allocate_labels(self.get_num_rows_state_alignment(utt_labels, state_number),
+                                                    self.dimension, out_file_name)
+
         phone_duration = 0
         state_duration_base = 0
         for line in utt_labels:
@@ -572,12 +814,7 @@ class HTSLabelNormalisation(LabelNormalisation):
                 phone_duration = frame_number
                 state_duration_base = 0
 
-#                label_binary_vector = self.pattern_matching(full_label)
-                label_binary_vector = self.pattern_matching_binary(full_label)
-
-                # if there is no CQS question, the label_continuous_vector will become to empty
-                label_continuous_vector = self.pattern_matching_continous_position(full_label)
-                label_vector = numpy.concatenate([label_binary_vector, label_continuous_vector], axis = 1)
+                label_vector = self.get_label_vector(full_label)
 
                 if len(temp_list)==1:
                     state_index = state_number
@@ -591,9 +828,10 @@ class HTSLabelNormalisation(LabelNormalisation):
                         cc_feat_matrix = self.extract_coarse_coding_features_relative(phone_duration)
 
             if self.add_frame_features:
-                current_block_binary_array = numpy.zeros((frame_number, self.dict_size+self.frame_feature_size))
+                # Write directly into the (zero initialised) output rows of this state.
+                current_block_binary_array = label_feature_matrix[label_feature_index:label_feature_index+frame_number]
+                current_block_binary_array[:, 0:self.dict_size] = label_vector
                 for i in range(frame_number):
-                    current_block_binary_array[i, 0:self.dict_size] = label_vector
 
                     if self.subphone_feats == 'full':
                         ## Zhizheng's original 9 subphone features:
@@ -641,14 +879,12 @@ class HTSLabelNormalisation(LabelNormalisation):
                     else:
                         sys.exit('unknown subphone_feats type')
 
-                label_feature_matrix[label_feature_index:label_feature_index+frame_number,] = current_block_binary_array
                 label_feature_index = label_feature_index + frame_number
             elif self.subphone_feats == 'state_only' and state_index == state_number:
-                current_block_binary_array = numpy.zeros((state_number, self.dict_size+self.frame_feature_size))
+                current_block_binary_array = label_feature_matrix[label_feature_index:label_feature_index+state_number]
+                current_block_binary_array[:, 0:self.dict_size] = label_vector
                 for i in range(state_number):
-                    current_block_binary_array[i, 0:self.dict_size] = label_vector
                     current_block_binary_array[i, self.dict_size] = float(i+1)   ## state index (counting forwards)
-                label_feature_matrix[label_feature_index:label_feature_index+state_number,] = current_block_binary_array
                 label_feature_index = label_feature_index + state_number
             elif self.subphone_feats == 'none' and state_index == state_number:
                 current_block_binary_array = label_vector
@@ -659,9 +895,126 @@ class HTSLabelNormalisation(LabelNormalisation):
 
             current_index += 1
 
-        label_feature_matrix = label_feature_matrix[0:label_feature_index,]
+        assert label_feature_index == len(label_feature_matrix)
         self.logger.debug('made label matrix of %d frames x %d labels' % label_feature_matrix.shape )
-        return  label_feature_matrix
+        return self.release_labels(label_feature_matrix)
+
+    def load_state_labels_with_state_alignment(self, file_name, out_file_name=None):
+        """
+        Create one row per state of a state-aligned label file: the label vector (dict_size) followed by the
+        num_state_info columns (frames of the state, state index, frames of the phone, frames of the previous
+        states in the phone). expand_state_labels creates the frame-level labels of load_labels_with_state_alignment
+        from it, while only a fraction of the memory and disk space is required.
+
+        :param file_name:         Path to the HTK label file with state alignment.
+        :param out_file_name:     If given, rows are written directly into a memory map of this file.
+        :return:                  Float32 array of shape num_states x (dict_size + num_state_info).
+        """
+        assert self.add_frame_features, "State-level labels are expanded to frames, set add_frame_features=True."
+
+        state_number = 5
+
+        fid = open(file_name)
+        utt_labels = [line.strip() for line in fid.readlines()]
+        fid.close()
+        utt_labels = [line for line in utt_labels if len(line) > 0]
+        self.logger.info('loaded %s, %3d labels' % (file_name, len(utt_labels)))
+
+        state_labels = self.allocate_labels(len(utt_labels), self.dict_size + self.num_state_info, out_file_name)
+
+        phone_duration = 0
+        state_duration_base = 0
+        for current_index, line in enumerate(utt_labels):
+            temp_list = line.split()
+            if len(temp_list) == 1:
+                frame_number = 0
+                state_index = 1
+                full_label = temp_list[0]
+            else:
+                frame_number = int((int(temp_list[1]) - int(temp_list[0]))/50000)  # TODO: Frame size should not be hardcoded.
+                full_label = temp_list[2]
+                state_index = int(full_label[-2]) - 1  # remove state information [k]
+                full_label = full_label[:-3]
+
+            if state_index == 1:
+                phone_duration = frame_number
+                state_duration_base = 0
+                label_vector = self.get_label_vector(full_label)
+
+                if len(temp_list) > 1:
+                    for i in range(state_number - 1):
+                        next_list = utt_labels[current_index + i + 1].split()
+                        phone_duration += int((int(next_list[1]) - int(next_list[0]))/50000)
+
+            state_labels[current_index, :self.dict_size] = label_vector
+            state_labels[current_index, self.dict_size:] = (frame_number, state_index, phone_duration,
+                                                            state_duration_base)
+            state_duration_base += frame_number
+
+        return self.release_labels(state_labels)
+
+    @staticmethod
+    def expand_state_labels(state_labels, subphone_feats='full', norm_params=None):
+        """
+        Expand state-level labels (see load_state_labels_with_state_alignment) to frames. The label vector of each
+        state is repeated for its frames and the frame features of subphone_feats are computed for all frames at
+        once. The result equals load_labels_with_state_alignment. The states of several utterances can be expanded
+        in one call by concatenating them, because each row contains all information about its phone.
+
+        :param state_labels:      Array of shape num_states x (dict_size + num_state_info).
+        :param subphone_feats:    Type of frame features, coarse_coding and minimal_phoneme are not supported.
+        :param norm_params:       Optional tuple of (min, max) of the frame features used to normalise them.
+        :return:                  Float32 array of shape num_frames x (dict_size + frame_feature_size).
+        """
+        dict_size = state_labels.shape[1] - HTSLabelNormalisation.num_state_info
+        frame_number = state_labels[:, dict_size].astype(numpy.int64)
+        num_frames = int(frame_number.sum())
+
+        def repeat(column):
+            return numpy.repeat(state_labels[:, dict_size + column].astype(numpy.float64), frame_number)
+
+        state_frames = repeat(0)
+        state_index = repeat(1)
+        phone_duration = repeat(2)
+        state_duration_base = repeat(3)
+        # Index of each frame in its state.
+        i = (numpy.arange(num_frames) - numpy.repeat(numpy.cumsum(frame_number) - frame_number, frame_number))\
+            .astype(numpy.float64)
+
+        if subphone_feats == 'full':
+            frame_features = [(i + 1) / state_frames,  ## fraction through state (forwards)
+                              (state_frames - i) / state_frames,  ## fraction through state (backwards)
+                              state_frames,  ## length of state in frames
+                              state_index,  ## state index (counting forwards)
+                              6 - state_index,  ## state index (counting backwards)
+                              phone_duration,  ## length of phone in frames
+                              state_frames / phone_duration,  ## fraction of the phone made up by current state
+                              (phone_duration - i - state_duration_base) / phone_duration,  ## fraction through phone (backwards)
+                              (state_duration_base + i + 1) / phone_duration]  ## fraction through phone (forwards)
+        elif subphone_feats == 'state_only':
+            frame_features = [state_index]
+        elif subphone_feats == 'frame_only':
+            frame_features = [(state_duration_base + i + 1) / phone_duration]
+        elif subphone_feats == 'uniform_state':
+            fraction_phone = (state_duration_base + i + 1) / phone_duration
+            frame_features = [fraction_phone, numpy.maximum(1, numpy.round(fraction_phone * 5))]
+        elif subphone_feats == 'minimal_frame':
+            frame_features = [(i + 1) / state_frames, state_index]
+        elif subphone_feats == 'none':
+            frame_features = []
+        else:
+            raise NotImplementedError("Frame expansion of subphone_feats {} is not supported.".format(subphone_feats))
+
+        labels = numpy.empty((num_frames, dict_size + len(frame_features)), dtype=numpy.float32)
+        labels[:, :dict_size] = numpy.repeat(state_labels[:, :dict_size], frame_number, axis=0)
+        for index, feature in enumerate(frame_features):
+            labels[:, dict_size + index] = feature
+
+        if norm_params is not None and len(frame_features) > 0:
+            # Same float32 transform as QuestionLabelGen.preprocess_sample, so the result is bit-identical.
+            NormTransform.from_min_max(*norm_params).apply(labels[:, dict_size:], out=labels[:, dict_size:])
+
+        return labels
 
     def extract_durational_features(self, dur_file_name=None, dur_data=None):
 
@@ -748,22 +1101,28 @@ class HTSLabelNormalisation(LabelNormalisation):
         return cc_feat_matrix
 
 
+    def get_label_vector(self, full_label):
+        """
+        Return the binary question values followed by the continuous question values of a full-context label
+        (without state information) as array of shape 1 x dict_size. Results are memoised per label string, so
+        the returned array must not be modified.
+        """
+        label_vector = self.label_vector_cache.get(full_label)
+        if label_vector is None:
+            label_binary_vector = self.pattern_matching_binary(full_label)
+
+            # if there is no CQS question, the label_continuous_vector will become to empty
+            label_continuous_vector = self.pattern_matching_continous_position(full_label)
+            label_vector = numpy.concatenate([label_binary_vector, label_continuous_vector], axis = 1)
+            self.label_vector_cache.put(full_label, label_vector)
+
+        return label_vector
+
     def pattern_matching_binary(self, label):
 
         dict_size = len(self.discrete_dict)
         lab_binary_vector = numpy.zeros((1, dict_size))
-
-        for i in range(dict_size):
-            current_question_list = self.discrete_dict[str(i)]
-            binary_flag = 0
-            for iq in range(len(current_question_list)):
-                current_compiled = current_question_list[iq]
-
-                ms = current_compiled.search(label)
-                if ms is not None:
-                    binary_flag = 1
-                    break
-            lab_binary_vector[0, i] = binary_flag
+        lab_binary_vector[0, list(self.question_set.matcher.match(label))] = 1
 
         return   lab_binary_vector
 
@@ -821,6 +1180,7 @@ class HTSLabelNormalisation(LabelNormalisation):
         continuous_qs_index = 0
         binary_dict = {}
         continuous_dict = {}
+        binary_questions = []
         LL=re.compile(re.escape('LL-'))
 
         for line in fid.readlines():
@@ -851,6 +1211,7 @@ class HTSLabelNormalisation(LabelNormalisation):
                         re_list.append(re.compile(processed_question))
 
                     binary_dict[str(binary_qs_index)] = re_list
+                    binary_questions.append((question_list, re_list, LL.search(question_key) is not None))
                     binary_qs_index = binary_qs_index + 1
                 else:
                     logger.critical('The question set is not defined correctly: %s' %(line))
@@ -858,7 +1219,7 @@ class HTSLabelNormalisation(LabelNormalisation):
 
         fid.close()
 #                question_index = question_index + 1
-        return  binary_dict, continuous_dict
+        return  QuestionSet(binary_dict, continuous_dict, binary_questions)
 
 
     def wildcards2regex(self, question, convert_number_pattern=False):
@@ -907,19 +1268,16 @@ class HTSDurationLabelNormalisation(HTSLabelNormalisation):
         self.dimension = self.dict_size
 
 
-    def load_labels_with_state_alignment(self, file_name, add_frame_features=False):
+    def load_labels_with_state_alignment(self, file_name, add_frame_features=False, out_file_name=None):
         ## add_frame_features not used in HTSLabelNormalisation -- only in XML version
 
         logger = logging.getLogger("labels")
 
         assert self.dimension == self.dict_size
 
-        label_feature_matrix = numpy.empty((100000, self.dimension))
-
         label_feature_index = 0
 
 
-        lab_binary_vector = numpy.zeros((1, self.dict_size))
         fid = open(file_name)
         utt_labels = fid.readlines()
         fid.close()
@@ -930,22 +1288,19 @@ class HTSDurationLabelNormalisation(HTSLabelNormalisation):
         ## remove empty lines
         utt_labels = [line for line in utt_labels if line != '']
 
+        label_feature_matrix = self.allocate_labels(len(utt_labels), self.dimension, out_file_name)
+
         for (line_number, line) in enumerate(utt_labels):
             temp_list = re.split('\s+', line.strip())
             full_label = temp_list[-1]  ## take last entry -- ignore timings if present
 
-            label_binary_vector = self.pattern_matching_binary(full_label)
-
-            # if there is no CQS question, the label_continuous_vector will become to empty
-            label_continuous_vector = self.pattern_matching_continous_position(full_label)
-            label_vector = numpy.concatenate([label_binary_vector, label_continuous_vector], axis = 1)
+            label_vector = self.get_label_vector(full_label)
 
             label_feature_matrix[line_number, :] = label_vector[:]
 
 
-        label_feature_matrix = label_feature_matrix[:line_number+1,:]
         logger.debug('made label matrix of %d frames x %d labels' % label_feature_matrix.shape )
-        return  label_feature_matrix
+        return self.release_labels(label_feature_matrix)
 
 
 #  -----------------------------
@@ -963,6 +1318,8 @@ if __name__ == '__main__':
                         dest="file_questions", required=True)
     parser.add_argument("-f", "--file_id_list", help="Full path to file containing the ids.", type=str,
                         dest="file_id_list", required=True)
+    parser.add_argument("--num_workers", help="Number of processes used to create the question labels.", type=int,
+                        dest="num_workers", default=1)
     # parser.add_argument("-c", "--config_file", help="File used as config for the _HCopy function of htk/hts.", type=str,
     #                     dest="config_file", required=False)
     
@@ -977,7 +1334,8 @@ if __name__ == '__main__':
     id_list[:] = [s.strip(' \t\n\r') for s in id_list]
 
     label_operater = HTSLabelNormalisation(args.file_questions)
-    label_operater.perform_normalisation(args.file_id_list, id_list, args.dir_labels, args.dir_questions)
+    label_operater.perform_normalisation(args.file_id_list, id_list, args.dir_labels, args.dir_questions,
+                                         num_workers=args.num_workers)
     #feature_type="binary"
     #unit_size = "phoneme"
     #feat_size = "phoneme"
@@ -17,6 +17,7 @@ import math
 import os
 import sys
 from collections import OrderedDict
+from functools import partial
 import numpy as np
 
 # Third-party imports.
@@ -26,7 +27,9 @@ import soundfile
 # Local source tree imports.
 from idiaptts.misc.normalisation.MeanStdDevExtractor import MeanStdDevExtractor
 from idiaptts.misc.normalisation.MinMaxExtractor import MinMaxExtractor
+from idiaptts.src.data_preparation.FeatureCodec import FeatureCodec
 from idiaptts.src.data_preparation.LabelGen import LabelGen
+from idiaptts.src.data_preparation.NormTransform import NormTransform
 from idiaptts.misc.utils import makedirs_safe, interpolate_lin, compute_deltas
 
 
@@ -88,15 +91,11 @@ class LF0LabelGen(LabelGen):
         :return:                  Pre-processed sample.
         """
 
-        if norm_params is not None:
-            mean, std_dev = norm_params
-        elif self.norm_params is not None:
-            mean, std_dev = self.norm_params
-        else:
-            self.logger.error("Please give norm_params argument or call get_normaliations_params() before.")
+        norm_transform = self._get_norm_transform(norm_params, NormTransform.from_mean_std_dev)
+        if norm_transform is None:
             return None
 
-        return np.float32((sample - mean) / std_dev)
+        return norm_transform.apply(sample)
 
     def postprocess_sample(self, sample, norm_params=None):
         """
@@ -106,17 +105,11 @@ class LF0LabelGen(LabelGen):
         :param norm_params:       Use this normalisation parameters instead of self.norm_params.
         :return:                  Post-processed sample.
         """
-        if norm_params is not None:
-            mean, std_dev = norm_params
-        elif self.norm_params is not None:
-            mean, std_dev = self.norm_params
-        else:
-            self.logger.error("Please give norm_params argument or call get_normaliations_params() before.")
+        norm_transform = self._get_norm_transform(norm_params, NormTransform.from_mean_std_dev)
+        if norm_transform is None:
             return None
 
-        sample = np.copy((sample * std_dev) + mean)
-
-        return sample
+        return norm_transform.invert(sample)
 
     @staticmethod
     def load_sample(id_name, dir_out, add_deltas=False):
@@ -140,22 +133,22 @@ class LF0LabelGen(LabelGen):
     def load_lf0(id_name, dir_out, add_deltas=False):
         """Loads LF0 features from dir_out."""
         if add_deltas:
-            with open(os.path.join(dir_out, LF0LabelGen.dir_lf0, id_name + LF0LabelGen.ext_deltas), 'rb') as f:
-                lf0 = np.fromfile(f, dtype=np.float32)
-                lf0 = np.reshape(lf0, [-1, 3])
+            lf0 = FeatureCodec.load_frames(
+                os.path.join(dir_out, LF0LabelGen.dir_lf0, id_name + LF0LabelGen.ext_deltas), 3)
+            lf0 = np.reshape(lf0, [-1, 3])
         else:
-            with open(os.path.join(dir_out, LF0LabelGen.dir_lf0, id_name + LF0LabelGen.ext_lf0), 'rb') as f:
-                lf0 = np.fromfile(f, dtype=np.float32)
-                lf0 = np.reshape(lf0, [-1, 1])
+            lf0 = FeatureCodec.load_frames(
+                os.path.join(dir_out, LF0LabelGen.dir_lf0, id_name + LF0LabelGen.ext_lf0), 1)
+            lf0 = np.reshape(lf0, [-1, 1])
         return lf0
 
     @staticmethod
     def load_vuv(id_name, dir_out):
         """Loads V/UV features from dir_out."""
         dim_vuv = 1
-        with open(os.path.join(dir_out, LF0LabelGen.dir_vuv, id_name + LF0LabelGen.ext_vuv), 'rb') as f:
-            vuv = np.fromfile(f, dtype=np.float32)
-            vuv = np.reshape(vuv, [-1, dim_vuv])
+        vuv = FeatureCodec.load_frames(
+            os.path.join(dir_out, LF0LabelGen.dir_vuv, id_name + LF0LabelGen.ext_vuv), dim_vuv)
+        vuv = np.reshape(vuv, [-1, dim_vuv])
         return vuv
 
     @staticmethod
@@ -207,7 +200,57 @@ class LF0LabelGen(LabelGen):
 
         return self.norm_params
 
-    def gen_data(self, dir_in, dir_out=None, file_id_list="", id_list=None, add_deltas=False, return_dict=False):
+    @staticmethod
+    def _gen_sample(dir_in, dir_out, add_deltas, return_labels, file_name):
+        """
+        Extract and save the LF0 and V/UV features of a single utterance. Used by gen_data, possibly in a worker
+        process.
+
+        :return:               The labels (None if return_labels is False) and a normalisation computation unit
+                               containing only this utterance.
+        """
+        logging.debug("Extract WORLD LF0 features from " + file_name)
+
+        # Load audio file and extract features.
+        audio_name = os.path.join(dir_in, file_name + ".wav")
+        raw, fs = soundfile.read(audio_name)
+        _f0, t = pyworld.dio(raw, fs)  # Raw pitch extraction. TODO: Use magphase here?
+        f0 = pyworld.stonemask(raw, _f0, t, fs)  # Pitch refinement.
+
+        # Compute lf0 and vuv information.
+        lf0 = np.log(f0, dtype=np.float32)
+        lf0[lf0 <= math.log(LF0LabelGen.f0_silence_threshold)] = LF0LabelGen.lf0_zero
+        lf0, vuv = interpolate_lin(lf0)
+
+        normaliser = MeanStdDevExtractor()
+        if add_deltas:
+            # Compute the deltas and double deltas for all features.
+            lf0_deltas, lf0_double_deltas = compute_deltas(lf0)
+
+            # Combine them to a single feature sample.
+            labels = np.concatenate((lf0, lf0_deltas, lf0_double_deltas, vuv), axis=1)
+
+            # Save into file.
+            if dir_out is not None:
+                labels.tofile(os.path.join(dir_out, LF0LabelGen.dir_deltas, file_name + LF0LabelGen.ext_deltas))
+
+            # Add sample to normalisation computation unit.
+            normaliser.add_sample(labels)
+        else:
+            labels = np.concatenate((lf0, vuv), axis=1) if return_labels else None
+
+            # Save into file.
+            if dir_out is not None:
+                lf0.tofile(os.path.join(dir_out, LF0LabelGen.dir_lf0, file_name + LF0LabelGen.ext_lf0))
+                vuv.astype(np.float32).tofile(os.path.join(dir_out, LF0LabelGen.dir_vuv, file_name + LF0LabelGen.ext_vuv))
+
+            # Add sample to normalisation computation unit.
+            normaliser.add_sample(lf0)
+
+        return labels if return_labels else None, normaliser
+
+    def gen_data(self, dir_in, dir_out=None, file_id_list="", id_list=None, add_deltas=False, return_dict=False,
+                 num_workers=1):
         """
         Prepare LF0 and V/UV features from audio files. If add_delta is false each numpy array has the dimension
         num_frames x 2 [f0, vuv], otherwise the deltas and double deltas are added between
@@ -223,6 +266,8 @@ class LF0LabelGen(LabelGen):
                                If None, all file in audio_dir are used.
         :param add_deltas:     Add deltas and double deltas to all features except vuv.
         :param return_dict:    If true, returns an OrderedDict of all samples as first output.
+        :param num_workers:    Number of processes extracting features in parallel. The normalisation statistics of
+                               all utterances are merged in the order of id_list, so results equal a serial run.
         :return:               Returns two normalisation parameters as tuple. If return_dict is True it returns
                                all processed labels in an OrderedDict followed by the two normalisation parameters.
         """
@@ -255,45 +300,17 @@ class LF0LabelGen(LabelGen):
         norm_params_ext_deltas = MeanStdDevExtractor()
 
         logging.info("Extract WORLD LF0 features for " + "[{0}]".format(", ".join(str(i) for i in id_list)))
-        for file_name in id_list:
-            logging.debug("Extract WORLD LF0 features from " + file_name)
-
-            # Load audio file and extract features.
-            audio_name = os.path.join(dir_in, file_name + ".wav")
-            raw, fs = soundfile.read(audio_name)
-            _f0, t = pyworld.dio(raw, fs)  # Raw pitch extraction. TODO: Use magphase here?
-            f0 = pyworld.stonemask(raw, _f0, t, fs)  # Pitch refinement.
-
-            # Compute lf0 and vuv information.
-            lf0 = np.log(f0, dtype=np.float32)
-            lf0[lf0 <= math.log(LF0LabelGen.f0_silence_threshold)] = LF0LabelGen.lf0_zero
-            lf0, vuv = interpolate_lin(lf0)
+        gen_sample_fn = partial(LF0LabelGen._gen_sample, dir_in, dir_out, add_deltas, return_dict)
+        for file_name, (labels, normaliser) in zip(id_list, self.map_id_list(gen_sample_fn, id_list, num_workers)):
+            # Save into return dictionary.
+            if return_dict:
+                label_dict[file_name] = labels
 
+            # Merge the statistics in order, so that they are identical to a serial run.
             if add_deltas:
-                # Compute the deltas and double deltas for all features.
-                lf0_deltas, lf0_double_deltas = compute_deltas(lf0)
-
-                # Combine them to a single feature sample.
-                labels = np.concatenate((lf0, lf0_deltas, lf0_double_deltas, vuv), axis=1)
-
-                # Save into return dictionary and/or file.
-                if return_dict:
-                    label_dict[file_name] = labels
-                if dir_out is not None:
-                    labels.tofile(os.path.join(dir_out, LF0LabelGen.dir_deltas, file_name + LF0LabelGen.ext_deltas))
-
-                # Add sample to normalisation computation unit.
-                norm_params_ext_deltas.add_sample(labels)
+                norm_params_ext_deltas.merge(normaliser)
             else:
-                # Save into return dictionary and/or file.
-                if return_dict:
-                    label_dict[file_name] = np.concatenate((lf0, vuv), axis=1)
-                if dir_out is not None:
-                    lf0.tofile(os.path.join(dir_out, LF0LabelGen.dir_lf0, file_name + LF0LabelGen.ext_lf0))
-                    vuv.astype(np.float32).tofile(os.path.join(dir_out, LF0LabelGen.dir_vuv, file_name + LF0LabelGen.ext_vuv))
-
-                # Add sample to normalisation computation unit.
-                norm_params_ext_lf0.add_sample(lf0)
+                norm_params_ext_lf0.merge(normaliser)
                 # norm_params_ext_vuv.add_sample(vuv)
 
         # Save mean and std dev of all features.
@@ -339,6 +356,8 @@ def main():
     parser.add_argument("--add_deltas", help="Defines if features are augmented by their deltas and double deltas."
                                              "Features will then be stored as a single file.",
                         dest="add_deltas", action='store_const', const=True, default=False)
+    parser.add_argument("--num_workers", help="Number of processes used to extract the features.",
+                        type=int, dest="num_workers", default=1)
 
     # Parse arguments
     args = parser.parse_args()
@@ -367,7 +386,8 @@ def main():
                      file_id_list=args.file_id_list_path,
                      id_list=id_list,
                      add_deltas=args.add_deltas,
-                     return_dict=False)
+                     return_dict=False,
+                     num_workers=args.num_workers)
 
     # # DEBUG
     # label_dict, norm_first, norm_second = lf0_gen.gen_data(dir_audio,
@@ -20,6 +20,7 @@ import os
 import math
 import sys
 from collections import OrderedDict
+from functools import partial
 
 # Third-party imports.
 import pyworld
@@ -27,12 +28,17 @@ import soundfile
 import pysptk
 import librosa
 import librosa.display
+from nnmnkwii import metrics
 from nnmnkwii.postfilters import merlin_post_filter
 
 # Local source tree imports.
 from idiaptts.misc.normalisation.MeanStdDevExtractor import MeanStdDevExtractor
 from idiaptts.misc.normalisation.MeanCovarianceExtractor import MeanCovarianceExtractor
 from idiaptts.src.data_preparation.LabelGen import LabelGen
+from idiaptts.src.data_preparation.NormTransform import NormTransform
+from idiaptts.src.data_preparation.PackedFeatureStore import PackedFeatureStore
+from idiaptts.src.data_preparation.ExtractionManifest import ExtractionManifest
+from idiaptts.src.data_preparation.FeatureCodec import FeatureCodec
 from idiaptts.misc.utils import makedirs_safe, interpolate_lin, compute_deltas
 from idiaptts.misc.mlpg import MLPG
 
@@ -49,6 +55,8 @@ class WorldFeatLabelGen(LabelGen):
     dir_vuv = "vuv"
     dir_bap = "bap"
     dir_deltas = "cmp"
+    dir_packed = "packed"
+    manifest_save_interval = 50  # Number of extracted ids after which the manifest of an incremental run is saved.
 
     ext_lf0 = "lf0"
     ext_vuv = "vuv"
@@ -58,7 +66,7 @@ class WorldFeatLabelGen(LabelGen):
     logger = logging.getLogger(__name__)
 
     def __init__(self, dir_labels, add_deltas=False, sampling_fn=None, num_coded_sps=60, sp_type="mcep", hop_size_ms=5,
-                 load_sp=True, load_lf0=True, load_vuv=True, load_bap=True):
+                 load_sp=True, load_lf0=True, load_vuv=True, load_bap=True, load_packed=False):
         """
         Constructor to use the class as a database.
         If add_delta is false labels have the dimension num_frames x (num_coded_sps + 3) [sp_type(num_coded_sps), lf0,
@@ -75,6 +83,8 @@ class WorldFeatLabelGen(LabelGen):
         :param load_lf0:          Whether to extract/load LF0.
         :param load_vuv:          Whether to extract/load V/UV flag.
         :param load_bap:          Whether to extract/load BAP.
+        :param load_packed:       Load samples from the packed store created by gen_data(..., save_packed=True)
+                                  instead of from separate feature files.
         """
 
         # Save parameters.
@@ -88,6 +98,7 @@ class WorldFeatLabelGen(LabelGen):
         self.load_lf0 = load_lf0
         self.load_vuv = load_vuv
         self.load_bap = load_bap
+        self.load_packed = load_packed
 
         # Attributes.
         self.norm_params = None
@@ -97,9 +108,14 @@ class WorldFeatLabelGen(LabelGen):
         # self.cov_bap = None
         self.dir_coded_sps = self.sp_type + str(self.num_coded_sps)
         self.dir_deltas += "_" + self.dir_coded_sps
+        self.packed_store = None
 
     def __getitem__(self, id_name):
         """Return the preprocessed sample with the given id_name."""
+        if self.load_packed:
+            sample = self.get_packed_store()[os.path.splitext(os.path.basename(id_name))[0]]
+            return self.preprocess_sample(sample)
+
         sample = self.load_sample(id_name,
                                   self.dir_labels,
                                   add_deltas=self.add_deltas,
@@ -113,6 +129,79 @@ class WorldFeatLabelGen(LabelGen):
 
         return sample
 
+    def getitem_range(self, id_name, start_frame, num_frames):
+        """
+        Return the preprocessed frames [start_frame, start_frame + num_frames) of a sample, only these frames are
+        read from disk or the packed store. With a sampling_fn the full sample is loaded and sliced, because the
+        sampling function can depend on the full sample.
+        """
+        if self.sampling_fn is not None:
+            return self[id_name][start_frame:start_frame + num_frames]
+
+        if self.load_packed:
+            sample = self.get_packed_store()[os.path.splitext(os.path.basename(id_name))[0]]
+            sample = sample[start_frame:start_frame + num_frames]
+        else:
+            sample = self.load_sample(id_name,
+                                      self.dir_labels,
+                                      add_deltas=self.add_deltas,
+                                      num_coded_sps=self.num_coded_sps,
+                                      sp_type=self.sp_type,
+                                      load_sp=self.load_sp,
+                                      load_lf0=self.load_lf0,
+                                      load_vuv=self.load_vuv,
+                                      load_bap=self.load_bap,
+                                      start_frame=start_frame,
+                                      num_frames=num_frames)
+
+        return self.preprocess_sample(sample)
+
+    def get_length(self, id_name):
+        """Return the number of frames of a sample from the packed index or the file size without loading it."""
+        if self.sampling_fn is not None:
+            return super().get_length(id_name)  # The sampling function can change the length.
+
+        id_name = os.path.splitext(os.path.basename(id_name))[0]
+        if self.load_packed:
+            return self.get_packed_store().get_length(id_name)
+
+        deltas_factor = 3 if self.add_deltas else 1
+        saved_as_cmp = self.add_deltas and self.load_sp and self.load_lf0 and self.load_vuv and self.load_bap
+        if not saved_as_cmp:
+            for load, feature_dir, feature_ext, feature_dim in \
+                    zip((self.load_sp, self.load_lf0, self.load_vuv, self.load_bap),
+                        (self.dir_coded_sps, self.dir_lf0, self.dir_vuv, self.dir_bap),
+                        (self.sp_type, self.ext_lf0, self.ext_vuv, self.ext_bap),
+                        (self.num_coded_sps * deltas_factor, deltas_factor, 1, deltas_factor)):
+                if load:
+                    path = os.path.join(self.dir_labels, feature_dir, "{}.{}".format(id_name, feature_ext))
+                    if self.add_deltas and feature_ext != self.ext_vuv:
+                        path += "_deltas"
+                    if FeatureCodec.exists(path):
+                        return FeatureCodec.get_num_frames(path, feature_dim)
+                    break  # Fall back to the cmp file like load_sample.
+
+        path = os.path.join(self.dir_labels, self.dir_deltas, "{}.{}".format(id_name, self.ext_deltas))
+        return FeatureCodec.get_num_frames(path, 3 * (self.num_coded_sps + 1 + 1) + 1)
+
+    def get_packed_name(self):
+        """Return the name of the packed store, which encodes the features it contains."""
+        features = list()
+        for load, feature in zip((self.load_sp, self.load_lf0, self.load_vuv, self.load_bap),
+                                 (self.dir_coded_sps, self.dir_lf0, self.dir_vuv, self.dir_bap)):
+            if load:
+                features.append(feature)
+        return "-".join(features) + ("_deltas" if self.add_deltas else "")
+
+    def get_packed_store(self, dir_labels=None):
+        """Open the packed store in dir_labels (default self.dir_labels) once and return it."""
+        if self.packed_store is None:
+            self.packed_store = PackedFeatureStore(
+                os.path.join(dir_labels if dir_labels is not None else self.dir_labels,
+                             self.dir_packed,
+                             self.get_packed_name()))
+        return self.packed_store
+
     @staticmethod
     def trim_end_sample(sample, length, reverse=False):
         """
@@ -187,8 +276,8 @@ class WorldFeatLabelGen(LabelGen):
                                   bap, bap deltas, bap double deltas.
         :return:                  Pre-processed sample.
         """
-        mean, std_dev = self._get_norm_params(norm_params)
-        sample = np.float32((sample - mean) / std_dev)
+        norm_transform = self._get_norm_transform(self._get_norm_params(norm_params), NormTransform.from_mean_std_dev)
+        sample = norm_transform.apply(sample)
 
         if self.sampling_fn is not None:
             sample = self.sampling_fn(sample)
@@ -204,8 +293,8 @@ class WorldFeatLabelGen(LabelGen):
         :param apply_mlpg:        Apply the MLPG algorithm on the post-processed sample.
         :return:                  Post-processed sample.
         """
-        mean, std_dev = self._get_norm_params(norm_params)
-        sample = np.copy((sample * std_dev) + mean)
+        norm_transform = self._get_norm_transform(self._get_norm_params(norm_params), NormTransform.from_mean_std_dev)
+        sample = norm_transform.invert(sample)
 
         if self.add_deltas:
             output_list = list()
@@ -255,7 +344,7 @@ class WorldFeatLabelGen(LabelGen):
 
     @staticmethod
     def load_sample(id_name, dir_out, add_deltas=False, num_coded_sps=60, sp_type="mcep",
-                    load_sp=True, load_lf0=True, load_vuv=True, load_bap=True):
+                    load_sp=True, load_lf0=True, load_vuv=True, load_bap=True, start_frame=0, num_frames=None):
         """
         Load world features from dir_out. It does not pre-process, use __getitem__ method instead.
 
@@ -268,6 +357,8 @@ class WorldFeatLabelGen(LabelGen):
         :param load_lf0:        Load fundamental frequency.
         :param load_vuv:        Load voiced/unvoiced flag.
         :param load_bap:        Load band aperiodicity features.
+        :param start_frame:     First frame to load, frames before it are not read from disk.
+        :param num_frames:      Maximum number of frames to load, None loads all frames after start_frame.
         :return:                Numpy array with dimensions num_frames x len(coded_sp, lf0, vuv, bap).
         """
         id_name = os.path.splitext(os.path.basename(id_name))[0]
@@ -296,13 +387,12 @@ class WorldFeatLabelGen(LabelGen):
                         path = os.path.join(dir_out, feature_dir, "{}.{}".format(id_name, feature_ext))
                         if add_deltas and feature_ext != WorldFeatLabelGen.ext_vuv:
                             path += "_deltas"
-                        with open(path, 'rb') as f:
-                            try:
-                                feature = np.fromfile(f, dtype=np.float32)
-                                labels = np.reshape(feature, [-1, feature_dim])
-                            except ValueError as e:
-                                logging.error("Cannot load labels from {}.".format(path))
-                                raise e
+                        try:
+                            feature = FeatureCodec.load_frames(path, feature_dim, start_frame, num_frames)
+                            labels = np.reshape(feature, [-1, feature_dim])
+                        except ValueError as e:
+                            logging.error("Cannot load labels from {}.".format(path))
+                            raise e
                         output_list.append(labels)
 
                 assert len(output_list) > 0, "At least one type of acoustic feature has to be loaded."
@@ -315,14 +405,14 @@ class WorldFeatLabelGen(LabelGen):
         path = os.path.join(dir_out,
                             "{}_{}{}".format(WorldFeatLabelGen.dir_deltas, sp_type, num_coded_sps),
                             "{}.{}".format(id_name, WorldFeatLabelGen.ext_deltas))
-        with open(path, 'rb') as f:
-            try:
-                cmp = np.fromfile(f, dtype=np.float32)
-                # cmp files always contain deltas.
-                labels = np.reshape(cmp, [-1, 3 * (num_coded_sps + 1 + 1) + dim_vuv])
-            except ValueError as e:
-                logging.error("Cannot load labels from {}.".format(path))
-                raise e
+        try:
+            # cmp files always contain deltas.
+            dim_cmp = 3 * (num_coded_sps + 1 + 1) + dim_vuv
+            cmp = FeatureCodec.load_frames(path, dim_cmp, start_frame, num_frames)
+            labels = np.reshape(cmp, [-1, dim_cmp])
+        except ValueError as e:
+            logging.error("Cannot load labels from {}.".format(path))
+            raise e
 
         if load_sp:
             output_list.append(labels[:, :dim_coded_sp])
@@ -881,7 +971,175 @@ class WorldFeatLabelGen(LabelGen):
         else:
             raise NotImplementedError("Unknown feature type {}. No decoding method available.".format(sp_type))
 
-    def gen_data(self, dir_in, dir_out=None, file_id_list="", file_ext="wav", id_list=None, return_dict=False):
+    class NormaliserVUVDummy(object):
+        """A dummy class to include VUV in the loops of gen_data."""
+        def add_sample(self, *args):
+            pass
+
+        def merge(self, *args):
+            pass
+
+        def save(self, *args):
+            pass
+
+        def get_params(self):
+            return (0.0,), (1.0,)
+
+    def _create_normalisers(self):
+        """Return normalisation computation units for coded_sp, lf0, vuv, and bap."""
+        if self.add_deltas:
+            return MeanCovarianceExtractor(), MeanCovarianceExtractor(), self.NormaliserVUVDummy(),\
+                   MeanCovarianceExtractor()
+        else:
+            return MeanStdDevExtractor(), MeanStdDevExtractor(), self.NormaliserVUVDummy(), MeanStdDevExtractor()
+
+    def _gen_sample(self, dir_in, dir_out, file_ext, save_as_cmp, return_features, file_name):
+        """
+        Extract, save, and collect the normalisation statistics of the features of a single utterance.
+        Used by gen_data, possibly in a worker process.
+
+        :return:               List of features (None if return_features is False), a tuple of normalisation
+                               computation units containing only this utterance, and a dictionary with the saved
+                               output files (relative to dir_out), feature dimensions, and data types.
+        """
+        # Extract acoustic features from an audio file.
+        coded_sp, lf0, vuv, bap = self.extract_features(dir_in, file_name, file_ext,
+                                                        preemphasis=self.preemphasis,
+                                                        sp_type=self.sp_type,
+                                                        num_coded_sps=self.num_coded_sps,
+                                                        load_sp=self.load_sp,
+                                                        load_lf0=self.load_lf0,
+                                                        load_vuv=self.load_vuv,
+                                                        load_bap=self.load_bap,
+                                                        hop_size_ms=self.hop_size_ms,
+                                                        f0_silence_threshold=WorldFeatLabelGen.f0_silence_threshold,
+                                                        lf0_zero=WorldFeatLabelGen.lf0_zero)
+
+        normalisers = self._create_normalisers()
+        output = list()
+        output_files = list()
+        for load, feature, feature_dir, feature_ext, normaliser in\
+                zip((self.load_sp, self.load_lf0, self.load_vuv, self.load_bap),
+                    (coded_sp, lf0, vuv, bap),
+                    (self.dir_coded_sps, self.dir_lf0, self.dir_vuv, self.dir_bap),
+                    (self.sp_type, self.ext_lf0, self.ext_vuv, self.ext_bap),
+                    normalisers):
+            if load:  # Check if feature should be loaded.
+                if self.add_deltas:  # Add deltas if requested.
+                    if feature_ext != "vuv":
+                        deltas, double_deltas = compute_deltas(feature)
+                        feature = np.concatenate((feature, deltas, double_deltas), axis=1)
+                    if dir_out is not None and not save_as_cmp:
+                        # Not all features for cmp are present so save the labels separately in deltas directory.
+                        output_files.append(os.path.join(feature_dir,
+                                                         "{}.{}{}".format(
+                                                             file_name,
+                                                             feature_ext,
+                                                             "_deltas" if feature_ext != self.ext_vuv else "")))
+                        feature.tofile(os.path.join(dir_out, output_files[-1]))
+                else:
+                    # Save features without deltas in their respective subdirectory.
+                    output_files.append(os.path.join(feature_dir, "{}.{}".format(file_name, feature_ext)))
+                    feature.tofile(os.path.join(dir_out, output_files[-1]))
+
+                # Add sample to normalisation computation unit.
+                normaliser.add_sample(feature)
+
+                # Add to list of output features.
+                output.append(feature)
+
+        # Save into a single file if all features are present (only when deltas are added).
+        if dir_out is not None and save_as_cmp:
+            # Combine them to a single feature sample.
+            labels = np.concatenate(output, axis=1)
+            output_files = [os.path.join(self.dir_deltas, "{}.{}".format(os.path.basename(file_name),
+                                                                         self.ext_deltas))]
+            labels.tofile(os.path.join(dir_out, output_files[0]))
+            dtypes = [labels.dtype.name] * len(output)
+        else:
+            dtypes = [feature.dtype.name for feature in output]
+
+        output_info = {"outputs": output_files, "dims": [feature.shape[1] for feature in output], "dtypes": dtypes}
+
+        return output if return_features else None, normalisers, output_info
+
+    @staticmethod
+    def _load_extracted_sample(dir_out, output_info):
+        """Load the list of features saved by _gen_sample, described by its output_info (e.g. from a manifest)."""
+        outputs, dims, dtypes = output_info["outputs"], output_info["dims"], output_info["dtypes"]
+        if len(outputs) == 1 and len(dims) > 1:
+            # All features are saved in a single cmp file.
+            labels = np.fromfile(os.path.join(dir_out, outputs[0]), dtype=dtypes[0]).reshape(-1, sum(dims))
+            return np.split(labels, np.cumsum(dims)[:-1], axis=1)
+        else:
+            return [np.fromfile(os.path.join(dir_out, output), dtype=dtype).reshape(-1, dim)
+                    for output, dim, dtype in zip(outputs, dims, dtypes)]
+
+    def _get_extraction_params(self, file_ext):
+        """Return all parameters which influence the extracted features, used to invalidate a manifest."""
+        return {"file_ext": file_ext, "sp_type": self.sp_type, "num_coded_sps": self.num_coded_sps,
+                "hop_size_ms": self.hop_size_ms, "add_deltas": self.add_deltas, "preemphasis": self.preemphasis,
+                "load_sp": self.load_sp, "load_lf0": self.load_lf0, "load_vuv": self.load_vuv,
+                "load_bap": self.load_bap, "f0_silence_threshold": self.f0_silence_threshold,
+                "lf0_zero": self.lf0_zero}
+
+    def _get_norm_file_path(self, dir_out, file_id_list_name, save_as_cmp, feature_dir, ext):
+        """Return the path (without the extractor specific ending) of the normalisation parameters of a feature."""
+        # Select the correct output directory to save the normalisation parameters.
+        if self.add_deltas:
+            modified_file_id_list_name = file_id_list_name if (file_id_list_name is None
+                                                               or file_id_list_name == "")\
+                                                           else file_id_list_name + "-"
+            if save_as_cmp:
+                return os.path.join(dir_out, self.dir_deltas, "{}{}".format(modified_file_id_list_name, ext))
+            elif ext == self.ext_vuv:  # Special case; VUV should never be saved with deltas ending.
+                return os.path.join(dir_out, feature_dir, "{}{}".format(modified_file_id_list_name, ext))
+            else:
+                return os.path.join(dir_out, feature_dir, "{}{}_deltas".format(modified_file_id_list_name, ext))
+        else:
+            return os.path.join(dir_out, feature_dir, file_id_list_name)
+
+    def _load_incremental_normalisers(self, manifest, norm_file_paths, dir_out, id_list, process_ids):
+        """
+        Load the normalisation statistics saved by a previous (incremental) run and remove the contributions of ids
+        which are reprocessed or not in id_list anymore. The ids contained in the returned statistics are returned
+        as second output. If the statistics are invalid (e.g. previous run was interrupted), or old outputs are
+        missing, empty normalisers are returned, the statistics of all up-to-date ids are then loaded from their
+        saved features in gen_data.
+        """
+        normalisers = list(self._create_normalisers())
+        loads = (self.load_sp, self.load_lf0, self.load_vuv, self.load_bap)
+
+        # Statistics are only saved for the loaded features.
+        stats_paths = [None if not load or path is None or isinstance(normaliser, self.NormaliserVUVDummy)
+                       else "{}-{}.bin".format(path, normaliser.file_name_stats)
+                       for load, path, normaliser in zip(loads, norm_file_paths, normalisers)]
+        if manifest.stats_ids is None or not all(os.path.isfile(path) for path in stats_paths if path is not None):
+            return self._create_normalisers(), set()
+
+        for index, path in enumerate(stats_paths):
+            if path is not None:
+                normalisers[index] = type(normalisers[index]).from_stats(path)
+
+        stats_ids = set(manifest.stats_ids)
+        id_set = set(id_list)
+        for id_name in [id_name for id_name in manifest.stats_ids if id_name not in id_set or id_name in process_ids]:
+            entry = manifest.get_entry(id_name)
+            if entry is None or not all(os.path.isfile(os.path.join(dir_out, output)) for output in entry["outputs"]):
+                self.logger.info("Outputs of {} are missing, recompute normalisation statistics from saved features."
+                                 .format(id_name))
+                return self._create_normalisers(), set()
+
+            features = self._load_extracted_sample(dir_out, entry)
+            for normaliser, feature in zip([n for load, n in zip(loads, normalisers) if load], features):
+                if not isinstance(normaliser, self.NormaliserVUVDummy):
+                    normaliser.remove_sample(feature)
+            stats_ids.remove(id_name)
+
+        return tuple(normalisers), stats_ids
+
+    def gen_data(self, dir_in, dir_out=None, file_id_list="", file_ext="wav", id_list=None, return_dict=False,
+                 save_packed=False, num_workers=1, incremental=False):
         """
         Prepare acoustic features from audio files. Which features are extracted are determined by the parameters
         given in the constructor. The self.load_* flags determine if that features is extracted and the self.sp_type
@@ -897,6 +1155,14 @@ class WorldFeatLabelGen(LabelGen):
                                Should have the form uttId1 \\n uttId2 \\n ...\\n uttIdN.
                                If None, all file in audio_dir are used.
         :param return_dict:    If true, returns an OrderedDict of all samples as first output_return_dict.
+        :param save_packed:    If true, additionally save all labels of id_list in a single packed store in
+                               dir_out/packed, which can be loaded with load_packed=True.
+        :param num_workers:    Number of processes extracting features in parallel. The normalisation statistics of
+                               all utterances are merged in the order of id_list, so results equal a serial run.
+        :param incremental:    If true, a manifest in dir_out records the source file and output files of each id.
+                               Ids which are up-to-date are skipped, and the normalisation statistics of a previous
+                               run are updated instead of recomputed (up to floating point rounding). The manifest
+                               is saved regularly, so an interrupted run can be resumed.
         :return:               Returns two normalisation parameters as tuple. If return_dict is True it returns
                                all processed labels in an OrderedDict followed by the two normalisation parameters.
         """
@@ -933,98 +1199,87 @@ class WorldFeatLabelGen(LabelGen):
         if return_dict:
             label_dict = OrderedDict()
 
-        if self.add_deltas:
-            # Create normalisation computation units.
-            norm_params_ext_coded_sp = MeanCovarianceExtractor()
-            norm_params_ext_lf0 = MeanCovarianceExtractor()
-            norm_params_ext_bap = MeanCovarianceExtractor()
+        packed_store = None
+        if dir_out is not None and save_packed:
+            packed_store = PackedFeatureStore(os.path.join(dir_out, self.dir_packed, self.get_packed_name()), mode="w")
+
+        loads = (self.load_sp, self.load_lf0, self.load_vuv, self.load_bap)
+        norm_file_paths = [self._get_norm_file_path(dir_out, file_id_list_name, save_as_cmp, feature_dir, ext)
+                           if dir_out else None
+                           for feature_dir, ext in zip((self.dir_coded_sps, self.dir_lf0, self.dir_vuv, self.dir_bap),
+                                                       (self.dir_coded_sps, self.ext_lf0, self.ext_vuv, self.ext_bap))]
+
+        manifest = None
+        if incremental:
+            if dir_out is None:
+                raise ValueError("Incremental feature extraction requires dir_out.")
+            manifest = ExtractionManifest(os.path.join(dir_out, "{}-{}.{}".format(file_id_list_name,
+                                                                                 self.get_packed_name(),
+                                                                                 ExtractionManifest.ext)),
+                                          self._get_extraction_params(file_ext))
+            process_ids = [id_name for id_name in id_list if not manifest.is_up_to_date(
+                id_name, os.path.join(dir_in, "{}.{}".format(id_name, file_ext)), dir_out)]
+            process_id_set = set(process_ids)
+            # Create normalisation computation units and update them with the statistics of the previous run.
+            normalisers, stats_ids = self._load_incremental_normalisers(manifest, norm_file_paths, dir_out, id_list,
+                                                                        process_id_set)
+            # Statistics are invalid until they are saved at the end of this run.
+            manifest.stats_ids = None
+            manifest.save()
+            logging.info("Extract acoustic features for {} new or changed of {} ids.".format(len(process_ids),
+                                                                                             len(id_list)))
         else:
+            process_ids = id_list
+            process_id_set = set(id_list)
             # Create normalisation computation units.
-            norm_params_ext_coded_sp = MeanStdDevExtractor()
-            norm_params_ext_lf0 = MeanStdDevExtractor()
-            norm_params_ext_bap = MeanStdDevExtractor()
-
-        class NormaliserVUVDummy(object):
-            """A dummy class to include VUV in the following loops."""
-            def add_sample(self, *args):
-                pass
-
-            def save(self, *args):
-                pass
-
-            def get_params(self):
-                return (0.0,), (1.0,)
-
-        norm_params_ext_vuv = NormaliserVUVDummy()
+            normalisers = self._create_normalisers()
+            stats_ids = set()
+        normalisers_loaded = [normaliser for load, normaliser in zip(loads, normalisers) if load]
 
         logging.info("Extract acoustic features{} for ".format("" if not self.add_deltas else " with deltas")
-                     + "[{0}]".format(", ".join(str(i) for i in id_list)))
+                     + "[{0}]".format(", ".join(str(i) for i in process_ids)))
 
-        # Extract feature for each
+        # Extract feature for each utterance, possibly in parallel, and merge the statistics in order.
+        return_features = return_dict or packed_store is not None
+        gen_sample_fn = partial(self._gen_sample, dir_in, dir_out, file_ext, save_as_cmp, return_features)
+        results = self.map_id_list(gen_sample_fn, process_ids, num_workers)
+        num_processed = 0
         for file_name in id_list:
-            # Extract acoustic features from an audio file.
-            coded_sp, lf0, vuv, bap = self.extract_features(dir_in, file_name, file_ext,
-                                                            preemphasis=self.preemphasis,
-                                                            sp_type=self.sp_type,
-                                                            num_coded_sps=self.num_coded_sps,
-                                                            load_sp=self.load_sp,
-                                                            load_lf0=self.load_lf0,
-                                                            load_vuv=self.load_vuv,
-                                                            load_bap=self.load_bap,
-                                                            hop_size_ms=self.hop_size_ms,
-                                                            f0_silence_threshold=WorldFeatLabelGen.f0_silence_threshold,
-                                                            lf0_zero=WorldFeatLabelGen.lf0_zero)
-
-            output = list()
-            for load, feature, feature_dir, feature_ext, normaliser in\
-                    zip((self.load_sp, self.load_lf0, self.load_vuv, self.load_bap),
-                        (coded_sp, lf0, vuv, bap),
-                        (self.dir_coded_sps, self.dir_lf0, self.dir_vuv, self.dir_bap),
-                        (self.sp_type, self.ext_lf0, self.ext_vuv, self.ext_bap),
-                        (norm_params_ext_coded_sp, norm_params_ext_lf0, norm_params_ext_vuv, norm_params_ext_bap)):
-                if load:  # Check if feature should be loaded.
-                    if self.add_deltas:  # Add deltas if requested.
-                        if feature_ext != "vuv":
-                            deltas, double_deltas = compute_deltas(feature)
-                            feature = np.concatenate((feature, deltas, double_deltas), axis=1)
-                        if dir_out is not None and not save_as_cmp:
-                            # Not all features for cmp are present so save the labels separately in deltas directory.
-                            feature.tofile(os.path.join(dir_out,
-                                                        feature_dir,
-                                                        "{}.{}{}".format(
-                                                            file_name,
-                                                            feature_ext,
-                                                            "_deltas" if feature_ext != self.ext_vuv else "")))
-                    else:
-                        # Save features without deltas in their respective subdirectory.
-                        feature.tofile(os.path.join(dir_out, feature_dir, "{}.{}".format(file_name, feature_ext)))
-
-                    # Add sample to normalisation computation unit.
-                    normaliser.add_sample(feature)
-
-                    # Add to list of output features.
-                    output.append(feature)
-
-            # Save into a single file if all features are present (only when deltas are added).
-            if dir_out is not None and save_as_cmp:
-                # Combine them to a single feature sample.
-                labels = np.concatenate(output, axis=1)
-                labels.tofile(os.path.join(dir_out, self.dir_deltas, "{}.{}".format(os.path.basename(file_name),
-                                                                                    self.ext_deltas)))
+            if file_name in process_id_set:
+                output, sample_normalisers, output_info = next(results)
+                num_processed += 1
+                for normaliser, sample_normaliser in zip(normalisers, sample_normalisers):
+                    normaliser.merge(sample_normaliser)
+
+                if manifest is not None:
+                    manifest.set_entry(file_name, os.path.join(dir_in, "{}.{}".format(file_name, file_ext)),
+                                       **output_info)
+                    if num_processed % self.manifest_save_interval == 0:
+                        manifest.save()
+            else:
+                # Up-to-date in the manifest, load the saved features if required.
+                output = None
+                if return_features or file_name not in stats_ids:
+                    output = self._load_extracted_sample(dir_out, manifest.get_entry(file_name))
+                if file_name not in stats_ids:
+                    for normaliser, feature in zip(normalisers_loaded, output):
+                        normaliser.add_sample(feature)
+
+            if packed_store is not None and len(output) > 0:
+                packed_store.add_sample(os.path.basename(file_name), np.concatenate(output, axis=1))
 
             if return_dict:
                 # Save into return dictionary.
                 label_dict[file_name] = np.concatenate(output, axis=1) if len(output) > 0 else None
         # END feature extraction loop.
 
+        if packed_store is not None:
+            packed_store.close()
+
         # Collect normalisation parameters.
         output_means = list()
         output_std_dev = list()
-        for load, feature_dir, normaliser, ext in\
-                zip((self.load_sp, self.load_lf0, self.load_vuv, self.load_bap),
-                    (self.dir_coded_sps, self.dir_lf0, self.dir_vuv, self.dir_bap),
-                    (norm_params_ext_coded_sp, norm_params_ext_lf0, norm_params_ext_vuv, norm_params_ext_bap),
-                    (self.dir_coded_sps, self.ext_lf0, self.ext_vuv, self.ext_bap)):
+        for load, normaliser, norm_file_path in zip(loads, normalisers, norm_file_paths):
             if load:  # Check if feature was extracted.
                 # Collect the normalisation parameters to return them.
                 norm = normaliser.get_params()
@@ -1032,30 +1287,13 @@ class WorldFeatLabelGen(LabelGen):
                 output_std_dev.append(norm[1])
 
                 if dir_out:
-                    # Select the correct output directory to save the normalisation parameters.
-                    if self.add_deltas:
-                        modified_file_id_list_name = file_id_list_name if (file_id_list_name is None
-                                                                           or file_id_list_name == "")\
-                                                                       else file_id_list_name + "-"
-                        if save_as_cmp:
-                            norm_file_path = os.path.join(
-                                dir_out,
-                                self.dir_deltas,
-                                "{}{}".format(modified_file_id_list_name, ext))
-                        else:
-                            if ext == self.ext_vuv:  # Special case; VUV should never be saved with deltas ending.
-                                norm_file_path = os.path.join(dir_out,
-                                                              feature_dir,
-                                                              "{}{}".format(modified_file_id_list_name, ext))
-                            else:
-                                norm_file_path = os.path.join(dir_out,
-                                                              feature_dir,
-                                                              "{}{}_deltas".format(modified_file_id_list_name, ext))
-                    else:
-                        norm_file_path = os.path.join(dir_out, feature_dir, file_id_list_name)
                     self.logger.info("Write norm_prams to {}".format(norm_file_path))
                     normaliser.save(norm_file_path)
 
+        if manifest is not None:
+            manifest.stats_ids = list(id_list)
+            manifest.save()
+
         if not self.add_deltas:
             output_means = np.concatenate(output_means, axis=0) if len(output_means) > 0 else None
             output_std_dev = np.concatenate(output_std_dev, axis=0) if len(output_std_dev) > 0 else None
@@ -1066,6 +1304,97 @@ class WorldFeatLabelGen(LabelGen):
         else:
             return output_means, output_std_dev
 
+    def _get_feature_files(self, id_name):
+        """Return a list of (path, dimension, feature names) of the raw feature files of a sample, see load_sample."""
+        deltas_factor = 3 if self.add_deltas else 1
+        saved_as_cmp = self.add_deltas and self.load_sp and self.load_lf0 and self.load_vuv and self.load_bap
+        if saved_as_cmp:
+            return [(os.path.join(self.dir_labels, self.dir_deltas, "{}.{}".format(id_name, self.ext_deltas)),
+                     3 * (self.num_coded_sps + 1 + 1) + 1, ("sp", "lf0", "vuv", "bap"))]
+
+        feature_files = list()
+        for load, name, feature_dir, feature_ext, feature_dim in\
+                zip((self.load_sp, self.load_lf0, self.load_vuv, self.load_bap),
+                    ("sp", "lf0", "vuv", "bap"),
+                    (self.dir_coded_sps, self.dir_lf0, self.dir_vuv, self.dir_bap),
+                    (self.sp_type, self.ext_lf0, self.ext_vuv, self.ext_bap),
+                    (self.num_coded_sps * deltas_factor, deltas_factor, 1, deltas_factor)):
+            if load:
+                path = os.path.join(self.dir_labels, feature_dir, "{}.{}".format(id_name, feature_ext))
+                if self.add_deltas and feature_ext != self.ext_vuv:
+                    path += "_deltas"
+                feature_files.append((path, feature_dim, (name,)))
+        return feature_files
+
+    def encode_data(self, id_list, dtype="float16", compression=None, remove_raw=False, norm_params=None):
+        """
+        Encode the raw feature files of the samples in self.dir_labels with a FeatureCodec, afterwards they are
+        loaded transparently from the encoded files when the raw files are removed. The reconstruction error is
+        logged per feature stream as MCD (spectral features without energy), F0 RMSE in Hz (voiced frames), V/UV
+        error rate, and BAP error like in AcousticModelTrainer.compute_score.
+
+        :param id_list:           List of ids to encode.
+        :param dtype:             Storage type, see FeatureCodec.
+        :param compression:       None or zlib.
+        :param remove_raw:        Remove the raw files after encoding them.
+        :param norm_params:       Tuple of (mean, std_dev) of the loaded features used to quantise int16 features.
+                                  Uses self.norm_params when None, without any the range of each file is used.
+        :return:                  Dictionary of the mean error of each feature stream.
+        """
+        if norm_params is None:
+            norm_params = self.norm_params
+        if norm_params is not None:
+            norm_params = tuple(np.asarray(param).reshape(-1) for param in norm_params)
+
+        deltas_factor = 3 if self.add_deltas else 1
+        dims = {"sp": self.num_coded_sps * deltas_factor, "lf0": deltas_factor, "vuv": 1, "bap": deltas_factor}
+        static_dims = {"sp": self.num_coded_sps, "lf0": 1, "vuv": 1, "bap": 1}
+        errors = {"MCD": list(), "F0 RMSE": list(), "VUV error": list(), "BAP error": list()}
+
+        for id_name in id_list:
+            id_name = os.path.splitext(os.path.basename(id_name))[0]
+            streams_org = dict()
+            streams_decoded = dict()
+            start_dim = 0
+            for path, feature_dim, names in self._get_feature_files(id_name):
+                codec_norm_params = None
+                if norm_params is not None:
+                    codec_norm_params = tuple(param[start_dim:start_dim + feature_dim] for param in norm_params)
+                codec = FeatureCodec(dtype, compression, norm_params=codec_norm_params)
+                feature, decoded = codec.encode_file(path, feature_dim, remove_raw)
+                start_dim += feature_dim
+
+                # Split files into their streams and keep the static features only.
+                stream_start = 0
+                for name in names:
+                    streams_org[name] = feature[:, stream_start:stream_start + static_dims[name]]
+                    streams_decoded[name] = decoded[:, stream_start:stream_start + static_dims[name]]
+                    stream_start += dims[name]
+
+            if "vuv" in streams_org:
+                voiced = streams_org["vuv"][:, 0] >= 0.5
+                errors["VUV error"].append(np.mean(voiced != (streams_decoded["vuv"][:, 0] >= 0.5)))
+            else:
+                voiced = None
+            if "sp" in streams_org:
+                errors["MCD"].append(metrics.melcd(streams_decoded["sp"][:, 1:], streams_org["sp"][:, 1:]))
+            if "lf0" in streams_org:
+                f0_diff = (np.exp(streams_decoded["lf0"][:, 0]) - np.exp(streams_org["lf0"][:, 0]))
+                if voiced is not None:
+                    f0_diff = f0_diff[voiced]
+                if len(f0_diff) > 0:
+                    errors["F0 RMSE"].append(math.sqrt((f0_diff.astype(np.float64) ** 2).mean()))
+            if "bap" in streams_org:
+                bap_diff = streams_org["bap"].astype(np.float64) - streams_decoded["bap"]
+                errors["BAP error"].append(math.sqrt((bap_diff ** 2).mean()) * (10.0 / np.log(10) * np.sqrt(2.0)))
+
+        mean_errors = {name: float(np.mean(values)) for name, values in errors.items() if len(values) > 0}
+        self.logger.info("Reconstruction error of {} {}features: {}".format(
+            dtype, "compressed " if compression is not None else "",
+            ", ".join("{} {:.4f}".format(name, value) for name, value in mean_errors.items())))
+
+        return mean_errors
+
 
 def main():
     logging.basicConfig(level=logging.INFO)
@@ -1090,6 +1419,19 @@ def main():
     parser.add_argument("--add_deltas", help="Defines if features are augmented by their deltas and double deltas."
                                              "Features will then be stored as a single file.",
                         dest="add_deltas", action='store_const', const=True, default=False)
+    parser.add_argument("--save_packed", help="Additionally save all features in a single memory-mappable file.",
+                        dest="save_packed", action='store_const', const=True, default=False)
+    parser.add_argument("--num_workers", help="Number of processes used to extract the features.",
+                        type=int, dest="num_workers", default=1)
+    parser.add_argument("--incremental", help="Only extract features of new or changed files, tracked in a manifest.",
+                        dest="incremental", action='store_const', const=True, default=False)
+    parser.add_argument("--codec", help="Additionally store the features lossy as float16 or int16 and log the "
+                                        "reconstruction error. Loaders decode them transparently.",
+                        type=str, dest="codec", choices=FeatureCodec.dtypes, default=None)
+    parser.add_argument("--compress", help="Compress the features stored with --codec with zlib.",
+                        dest="compress", action='store_const', const=True, default=False)
+    parser.add_argument("--remove_raw", help="Remove the float32 features after storing them with --codec.",
+                        dest="remove_raw", action='store_const', const=True, default=False)
 
     # Parse arguments
     args = parser.parse_args()
@@ -1115,11 +1457,17 @@ def main():
                                        num_coded_sps=args.num_coded_sps,
                                        sp_type=args.sp_type,
                                        hop_size_ms=args.hop_size_ms)
-    world_feat_gen.gen_data(dir_audio,
-                            dir_out=dir_out,
-                            file_id_list=args.file_id_list_path,
-                            id_list=id_list,
-                            return_dict=True)
+    label_dict, *_ = world_feat_gen.gen_data(dir_audio,
+                                             dir_out=dir_out,
+                                             file_id_list=args.file_id_list_path,
+                                             id_list=id_list,
+                                             return_dict=True,
+                                             save_packed=args.save_packed,
+                                             num_workers=args.num_workers,
+                                             incremental=args.incremental)
+    if args.codec is not None:
+        world_feat_gen.encode_data(list(label_dict.keys()), args.codec, "zlib" if args.compress else None,
+                                   remove_raw=args.remove_raw)
 
     sys.exit(0)
 
@@ -25,9 +25,11 @@ import torch
 from idiaptts.src.model_trainers.ModelTrainer import ModelTrainer
 from idiaptts.src.DataPlotter import DataPlotter
 from idiaptts.src.data_preparation.questions.QuestionLabelGen import QuestionLabelGen
+from idiaptts.src.data_preparation.questions.label_normalisation import HTSLabelNormalisation
 from idiaptts.src.data_preparation.world.WorldFeatLabelGen import WorldFeatLabelGen
 from idiaptts.src.data_preparation.world.WorldFeatLabelGen import interpolate_lin
 from idiaptts.src.data_preparation.PyTorchLabelGensDataset import PyTorchLabelGensDataset as LabelGensDataset
+from idiaptts.src.neural_networks.pytorch.FrameExpansionCollator import FrameExpansionCollator
 
 
 class AcousticModelTrainer(ModelTrainer):
@@ -65,8 +67,15 @@ class AcousticModelTrainer(ModelTrainer):
 
         super(AcousticModelTrainer, self).__init__(id_list, hparams)
 
-        self.InputGen = QuestionLabelGen(dir_question_labels, num_questions)
+        self.InputGen = QuestionLabelGen(dir_question_labels, num_questions, hparams.num_binary_questions,
+                                         state_level=hparams.question_labels_state_level,
+                                         subphone_feats=hparams.question_subphone_feats,
+                                         sparse_num_active=hparams.question_labels_sparse_num_active)
         self.InputGen.get_normalisation_params(dir_question_labels, hparams.input_norm_params_file_prefix)
+        if hparams.question_labels_state_level:
+            # Expand states to frames per batch, lengths can only be matched after the expansion.
+            self.batch_collate_fn = FrameExpansionCollator(hparams.question_subphone_feats,
+                                                           self.InputGen.get_frame_feature_norm_params())
 
         self.OutputGen = WorldFeatLabelGen(dir_world_features,
                                            add_deltas=hparams.add_deltas,
@@ -78,12 +87,12 @@ class AcousticModelTrainer(ModelTrainer):
                                               self.InputGen,
                                               self.OutputGen,
                                               hparams,
-                                              match_lengths=True)
+                                              match_lengths=not hparams.question_labels_state_level)
         self.dataset_val = LabelGensDataset(self.id_list_val,
                                             self.InputGen,
                                             self.OutputGen,
                                             hparams,
-                                            match_lengths=True)
+                                            match_lengths=not hparams.question_labels_state_level)
 
         if self.loss_function is None:
             self.loss_function = torch.nn.MSELoss(reduction='none')
@@ -99,6 +108,11 @@ class AcousticModelTrainer(ModelTrainer):
 
         hparams.add_hparams(
             num_questions=None,
+            num_binary_questions=None,  # Load bit-packed question labels with this many binary questions (QS).
+            question_labels_state_level=False,  # Load state-level question labels and expand them per batch.
+            question_subphone_feats="full",  # Frame features of state-level question labels.
+            question_labels_sparse_num_active=None,  # Load bit-packed question labels as sparse input with this
+                                                     # many non-zero binary questions per frame (RNNDyn Sparse layer).
             question_file=None,  # Used to add labels in plot.
             num_coded_sps=60,
             sp_type="mcep",
@@ -169,9 +183,16 @@ class AcousticModelTrainer(ModelTrainer):
 
         if hasattr(hparams, "phoneme_indices") and hparams.phoneme_indices is not None \
            and hasattr(hparams, "question_file") and hparams.question_file is not None:
-            questions = QuestionLabelGen.load_sample(id_name,
-                                                     "experiments/" + hparams.voice + "/questions/",
-                                                     num_questions=hparams.num_questions)[:len(lf0)]
+            dir_questions = "experiments/" + hparams.voice + "/questions/"
+            if hparams.question_labels_state_level:
+                questions = QuestionLabelGen.load_state_sample(id_name, dir_questions, self.InputGen.num_state_questions)
+                questions = HTSLabelNormalisation.expand_state_labels(questions,
+                                                                      hparams.question_subphone_feats)[:len(lf0)]
+            else:
+                questions = QuestionLabelGen.load_sample(id_name,
+                                                         dir_questions,
+                                                         num_questions=hparams.num_questions,
+                                                         num_binary_questions=hparams.num_binary_questions)[:len(lf0)]
             np_phonemes = QuestionLabelGen.questions_to_phonemes(questions,
                                                                  hparams.phoneme_indices,
                                                                  hparams.question_file)
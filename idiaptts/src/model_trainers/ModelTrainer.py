@@ -28,7 +28,9 @@ import git
 
 # Local source tree imports.
 from idiaptts.src.ExtendedHParams import ExtendedHParams
+from idiaptts.src.data_preparation.CompiledDataset import CompiledDataset
 from idiaptts.src.neural_networks.pytorch.ModelHandlerPyTorch import ModelHandlerPyTorch
+from idiaptts.src.neural_networks.pytorch.CheckpointWriter import CheckpointWriter
 from idiaptts.misc.utils import makedirs_safe, get_gpu_memory_map
 from idiaptts.src.Synthesiser import Synthesiser
 
@@ -74,7 +76,12 @@ class ModelTrainer(object):
         if not hasattr(hparams, "batch_size_val") or not hparams.batch_size_val > 1:
             hparams.variable_sequence_length_val = False
 
-        if hparams.use_gpu:
+        if getattr(hparams, "distributed_backend", None) is not None:
+            if hparams.use_gpu and not ModelHandlerPyTorch.cuda_is_available():
+                self.logger.warning("No CUDA device available, use CPU mode instead.")
+                hparams.use_gpu = False
+            ModelHandlerPyTorch.init_distributed(hparams)
+        elif hparams.use_gpu:
             if hparams.num_gpus > 1:
                 os.environ['CUDA_VISIBLE_DEVICES'] = str(tuple(range(hparams.num_gpus)))
             if ModelHandlerPyTorch.cuda_is_available():
@@ -123,6 +130,7 @@ class ModelTrainer(object):
         # Create and initialize model.
         self.logger.info("Create ModelHandler.")
         self.model_handler = ModelHandlerPyTorch()  # A handler for the NN models depending on the NN frameworks.
+        self.checkpoint_writer = CheckpointWriter()  # Writes checkpoints during training, configured in train.
 
         # Data attributes.
         self.InputGen = None  # Used in the datasets.
@@ -215,7 +223,8 @@ class ModelTrainer(object):
                     dim_in, dim_out = self.dataset_train.get_dims()
                     self.model_handler.create_model(hparams, dim_in, dim_out)
                     self.total_epoch = 0
-                    self.model_handler.save_checkpoint(model_path_out, self.total_epoch)
+                    if self.model_handler.is_main_process():
+                        self.model_handler.save_checkpoint(model_path_out, self.total_epoch)
 
             self.logger.info("Model ready.")
             return
@@ -265,7 +274,21 @@ class ModelTrainer(object):
                                                   os.path.splitext(os.path.basename(id_name))[0]) for id_name in testset_keys]))
 
         # Setup the dataloaders.
-        self.model_handler.set_dataset(hparams, self.dataset_train, self.dataset_val, self.batch_collate_fn)
+        dataset_train, dataset_val = self.dataset_train, self.dataset_val
+        if getattr(hparams, "dataset_compiled_dir", None) is not None:
+            # Only training streams from the compiled samples, synthesis still uses the LabelGens.
+            # In distributed training only the first process compiles, the others open the stores afterwards.
+            is_main_process = self.model_handler.is_main_process()
+            if not is_main_process:
+                self.model_handler.barrier()
+            dataset_train = CompiledDataset(dataset_train, os.path.join(hparams.dataset_compiled_dir, "train"),
+                                            allow_compile=is_main_process)
+            if dataset_val is not None:
+                dataset_val = CompiledDataset(dataset_val, os.path.join(hparams.dataset_compiled_dir, "val"),
+                                              allow_compile=is_main_process)
+            if is_main_process:
+                self.model_handler.barrier()
+        self.model_handler.set_dataset(hparams, dataset_train, dataset_val, self.batch_collate_fn)
 
         self.logger.info("CPU memory: " + str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1e3) + " MB.")
         if hparams.use_gpu:
@@ -299,6 +322,9 @@ class ModelTrainer(object):
 
         self.model_handler.set_optimiser(hparams)
         self.model_handler.set_scheduler(hparams, self.total_epoch if hparams.use_saved_learning_rate else 0)
+        self.checkpoint_writer.keep_last = hparams.checkpoints_keep_last
+        self.checkpoint_writer.keep_best = hparams.checkpoints_keep_best
+        self.checkpoint_writer.asynchronous = hparams.checkpoint_async
 
         assert(self.loss_function)  # Please set self.loss_function in the trainer construction.
         loss_function = self.loss_function.cuda() if hparams.use_gpu else self.loss_function
@@ -340,18 +366,21 @@ class ModelTrainer(object):
                 if np.isnan(loss):
                     break
 
-                # Save checkpoint if path is given.
-                if hparams.out_dir is not None:
+                # Save checkpoint if path is given. Only the first process saves in distributed training.
+                if hparams.out_dir is not None and self.model_handler.is_main_process():
                     path_checkpoint = os.path.join(hparams.out_dir, hparams.networks_dir, hparams.checkpoints_dir)
+                    file_path, best_path = None, None
                     # Check when to save a checkpoint.
                     if hparams.epochs_per_checkpoint > 0 and self.total_epoch % hparams.epochs_per_checkpoint == 0:
                         model_name = "{}-e{}-{}".format(hparams.model_name, self.total_epoch, loss_function)
-                        self.model_handler.save_checkpoint(os.path.join(path_checkpoint, model_name), self.total_epoch)
-                    # Always save best checkpoint with special name.
+                        file_path = os.path.join(path_checkpoint, model_name)
+                    # Always save best checkpoint with special name, it is linked to the checkpoint of this epoch.
                     if loss < best_loss or np.isnan(best_loss):
                         best_loss = loss
-                        model_name = hparams.model_name + "-best"
-                        self.model_handler.save_checkpoint(os.path.join(path_checkpoint, model_name), self.total_epoch)
+                        best_path = os.path.join(path_checkpoint, hparams.model_name + "-best")
+                    if file_path is not None or best_path is not None:
+                        self.checkpoint_writer.save(self.model_handler.get_checkpoint_files(self.total_epoch),
+                                                    file_path, best_path, loss)
 
                 # Run the scheduler if requested.
                 if hparams.epochs_per_scheduler_step:
@@ -359,6 +388,7 @@ class ModelTrainer(object):
                             % hparams.epochs_per_scheduler_step == 0:
                         self.model_handler.run_scheduler(loss, self.total_epoch + 1)
 
+        self.checkpoint_writer.wait()  # Make sure all checkpoints are written.
         t_training = timer() - t_start
         self.logger.info('Training time: ' + str(timedelta(seconds=t_training)))
         self.logger.info('Loss progress: ' + ', '.join('{:.4f}'.format(l) for l in all_loss))
@@ -367,6 +397,7 @@ class ModelTrainer(object):
         if hparams.out_dir is not None:
             # Check if best model should be used as final model. Only possible when it was save in out_dir.
             if hparams.use_best_as_final_model:
+                self.model_handler.barrier()  # Wait until the first process saved the best model.
                 best_model_path = os.path.join(hparams.out_dir, hparams.networks_dir, hparams.checkpoints_dir, hparams.model_name + "-best")
                 try:
                     self.total_epoch = self.model_handler.load_checkpoint(best_model_path,
@@ -383,7 +414,7 @@ class ModelTrainer(object):
                     self.logger.warning("No best model exists yet. Continue with the current one.")
 
             # Save the model if requested.
-            if hparams.save_final_model:
+            if hparams.save_final_model and self.model_handler.is_main_process():
                 self.model_handler.save_checkpoint(os.path.join(hparams.out_dir, hparams.networks_dir, hparams.model_name), self.total_epoch)
 
         return all_loss, all_loss_train, self.model_handler
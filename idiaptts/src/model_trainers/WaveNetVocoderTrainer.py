@@ -54,14 +54,22 @@ class WaveNetVocoderTrainer(ModelTrainer):
         super().__init__(id_list, hparams)
 
         in_to_out_multiplier = int(hparams.frame_rate_output_Hz / (1000.0 / hparams.frame_size_ms))
-        max_frames_input_trainset = int(1000.0 / hparams.frame_size_ms * hparams.max_input_train_sec) * in_to_out_multiplier  # Multiply by number of seconds.
-        max_frames_input_testset = int(1000.0 / hparams.frame_size_ms * hparams.max_input_test_sec) * in_to_out_multiplier  # Ensure that test takes all frames. NOTE: Had to limit it because of memory constraints.
+        max_frames_input_trainset = int(1000.0 / hparams.frame_size_ms * hparams.max_input_train_sec)  # Multiply by number of seconds.
+        max_frames_input_testset = int(1000.0 / hparams.frame_size_ms * hparams.max_input_test_sec)  # Ensure that test takes all frames. NOTE: Had to limit it because of memory constraints.
+        if hparams.cond_upsampling == "loader":
+            # Conditioning features are upsampled to the audio frame rate when loading them.
+            sampling_fn = partial(sample_linearly, in_to_out_multiplier=in_to_out_multiplier, dtype=np.float32)
+            max_frames_input_trainset *= in_to_out_multiplier
+            max_frames_input_testset *= in_to_out_multiplier
+            dataset_len_in_out_multiplier = 1
+        else:
+            # Frame rate conditioning features are upsampled in the model.
+            sampling_fn = None
+            dataset_len_in_out_multiplier = in_to_out_multiplier
 
         self.InputGen = WorldFeatLabelGen(dir_world_features,
                                           add_deltas=False,
-                                          sampling_fn=partial(sample_linearly,
-                                                              in_to_out_multiplier=in_to_out_multiplier,
-                                                              dtype=np.float32),
+                                          sampling_fn=sampling_fn,
                                           num_coded_sps=hparams.num_coded_sps,
                                           sp_type=hparams.sp_type,
                                           load_sp=hparams.load_sp,
@@ -73,11 +81,16 @@ class WaveNetVocoderTrainer(ModelTrainer):
         self.OutputGen = RawWaveformLabelGen(frame_rate_output_Hz=hparams.frame_rate_output_Hz,
                                              frame_size_ms=hparams.frame_size_ms,
                                              mu=hparams.mu if hparams.input_type == "mulaw-quantize" else None,
-                                             silence_threshold_quantized=hparams.silence_threshold_quantized)
+                                             silence_threshold_quantized=hparams.silence_threshold_quantized,
+                                             index_targets=hparams.index_targets)
         # No normalisation parameters required.
 
-        self.dataset_train = LabelGensDataset(self.id_list_train, self.InputGen, self.OutputGen, hparams, random_select=True, max_frames_input=max_frames_input_trainset)
-        self.dataset_val = LabelGensDataset(self.id_list_val, self.InputGen, self.OutputGen, hparams, random_select=True, max_frames_input=max_frames_input_testset)
+        self.dataset_train = LabelGensDataset(self.id_list_train, self.InputGen, self.OutputGen, hparams,
+                                              len_in_out_multiplier=dataset_len_in_out_multiplier,
+                                              random_select=True, max_frames_input=max_frames_input_trainset)
+        self.dataset_val = LabelGensDataset(self.id_list_val, self.InputGen, self.OutputGen, hparams,
+                                            len_in_out_multiplier=dataset_len_in_out_multiplier,
+                                            random_select=True, max_frames_input=max_frames_input_testset)
 
         if self.loss_function is None:
             if hparams.input_type == "mulaw-quantize":
@@ -109,6 +122,9 @@ class WaveNetVocoderTrainer(ModelTrainer):
             mu=255,
             bit_depth=16,
             silence_threshold_quantized=None,  # Beginning and end of audio below the threshold are trimmed.
+            index_targets=False,  # Load mu-law targets as uint8 class indices, one-hot vectors are created on device.
+            cond_upsampling="loader",  # "loader": conditioning features are linearly interpolated to the audio frame
+            # rate in the data loader. "linear" or "repeat": frame rate features are loaded and upsampled in the model.
             teacher_forcing_in_test=True,
             ema_decay=0.9999,
 
@@ -177,7 +193,10 @@ class WaveNetVocoderTrainer(ModelTrainer):
                 targets = targets.transpose(1, 2).contiguous()
 
             if not one_hot_target:
-                targets = targets.max(dim=1, keepdim=True)[1].float()
+                if targets.is_floating_point():
+                    targets = targets.max(dim=1, keepdim=True)[1].float()
+                else:
+                    targets = targets.float()  # Targets are class indices already.
 
         if mask is not None:
             mask = mask[:, 1:].contiguous()
@@ -65,6 +65,10 @@ class ModelHandler(object):
         """
         raise NotImplementedError("Class %s doesn't implement load_checkpoint()" % self.__class__.__name__)
 
+    def get_checkpoint_files(self, current_epoch):
+        """Return the checkpoint as dictionary of file name suffix to object, see save_checkpoint."""
+        raise NotImplementedError("Class %s doesn't implement get_checkpoint_files()" % self.__class__.__name__)
+
     def save_checkpoint(self, file_path, current_epoch):
         """Save a CPU version of the model combined with optimiser and other parameters."""
         raise NotImplementedError("Class %s doesn't implement save_checkpoint()" % self.__class__.__name__)
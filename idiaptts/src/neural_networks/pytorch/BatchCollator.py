@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Collate function which copies each sample of a batch directly into its final position of a preallocated
+   (optionally pinned) buffer and creates the mask in the same pass.
+"""
+
+# System imports.
+import logging
+
+# Third-party imports.
+import numpy as np
+import torch
+
+# Local source tree imports.
+
+
+class BatchCollator(object):
+    """
+    Convert a list of (input, target) tuples to a batch sorted by input length (longest first), see
+    ModelHandlerPyTorch.prepare_batch for the returned values, which are identical.
+
+    Lengths are computed once, inputs and targets are written directly to their padded position (targets stay
+    in the order of the sorted inputs without being sorted themselves) and only the padded regions are zeroed.
+    With num_buffers > 0 the buffers are reused in a ring, so the returned tensors of a batch are only valid until
+    num_buffers further batches were collated. Only use reuse and pinning in the main process (num_workers=0),
+    because tensors returned from DataLoader workers are moved to shared memory and must not be overwritten.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, common_divisor=1, batch_first=False, pin_memory=False, num_buffers=0):
+        """
+        Create a collate function.
+
+        :param common_divisor:    Batch is trimmed so that dividable by the common_divisor (usually number of GPUs).
+        :param batch_first:       Use the first dimension as batch dimension.
+        :param pin_memory:        Allocate the buffers in page-locked memory (only when CUDA is available).
+        :param num_buffers:       Number of buffer sets reused in a ring, 0 allocates new tensors for every batch.
+        """
+        self.common_divisor = common_divisor
+        self.batch_first = batch_first
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.num_buffers = num_buffers
+
+        self._buffers = [dict() for _ in range(max(1, num_buffers))]
+        self._buffer_index = 0
+
+    def __getstate__(self):
+        # Do not send (pinned) buffers to DataLoader workers.
+        state = self.__dict__.copy()
+        state["_buffers"] = [dict() for _ in range(max(1, self.num_buffers))]
+        return state
+
+    def _get_buffer(self, name, shape, dtype):
+        """Return a tensor of the given shape which is a view on the beginning of a (reused) flat buffer."""
+        numel = int(np.prod(shape))
+        torch_dtype = torch.from_numpy(np.empty(0, dtype=dtype)).dtype
+        if self.num_buffers > 0:
+            buffers = self._buffers[self._buffer_index]
+            buffer = buffers.get((name, torch_dtype))
+            if buffer is None or buffer.numel() < numel:
+                # Leave some head room so that slightly longer batches do not cause a new allocation.
+                buffer = torch.empty(int(numel * 1.25) + 1, dtype=torch_dtype, pin_memory=self.pin_memory)
+                buffers[(name, torch_dtype)] = buffer
+        else:
+            buffer = torch.empty(numel, dtype=torch_dtype, pin_memory=self.pin_memory)
+
+        return buffer[:numel].view(shape)
+
+    def _pad(self, name, samples, order, lengths, max_length):
+        """Copy samples in the given order into a zero padded (T x B x ...) or (B x T x ...) tensor."""
+        feature_shape = samples[order[0]].shape[1:]
+        dtype = samples[order[0]].dtype
+        if self.batch_first:
+            shape = (len(order), max_length, *feature_shape)
+        else:
+            shape = (max_length, len(order), *feature_shape)
+
+        padded = self._get_buffer(name, shape, dtype)
+        padded_np = padded.numpy()
+        if not self.batch_first:
+            padded_np = padded_np.swapaxes(0, 1)  # View with batch first, writing into the same memory.
+
+        for batch_index, (sample_index, length) in enumerate(zip(order, lengths)):
+            padded_np[batch_index, :length] = samples[sample_index]
+            padded_np[batch_index, length:] = 0
+
+        return padded
+
+    def _mask(self, lengths, max_length):
+        """Create the float mask of shape (T x B x 1) or (B x T x 1)."""
+        if self.batch_first:
+            shape = (len(lengths), max_length, 1)
+        else:
+            shape = (max_length, len(lengths), 1)
+
+        mask = self._get_buffer("mask", shape, np.float32)
+        mask_np = mask.numpy()
+        if not self.batch_first:
+            mask_np = mask_np.swapaxes(0, 1)
+
+        for batch_index, length in enumerate(lengths):
+            mask_np[batch_index, :length] = 1.0
+            mask_np[batch_index, length:] = 0.0
+
+        return mask
+
+    def __call__(self, batch):
+        # Remove samples if not equally dividable by given divisor (usually number of GPUs).
+        # Remove before sorting to keep it unbiased.
+        assert(len(batch) >= self.common_divisor)
+        remainder = len(batch) % self.common_divisor
+        if remainder > 0:
+            batch = batch[:-remainder]
+
+        inputs = [np.asarray(sample[0]) for sample in batch]
+        lengths_input = np.fromiter((len(sample) for sample in inputs), dtype=np.int64, count=len(inputs))
+
+        # Sort batch if it contains more than one sample (longest first, stable for equal lengths).
+        permutation = None
+        if len(batch) > 1:
+            order = np.argsort(-lengths_input, kind="stable")
+            permutation = tuple(order.tolist())
+        else:
+            order = np.zeros(1, dtype=np.int64)
+        order = order.tolist()
+
+        lengths_input_sorted = lengths_input[order]
+        seq_lengths_input = torch.from_numpy(lengths_input_sorted)
+
+        if self.num_buffers > 0:
+            self._buffer_index = (self._buffer_index + 1) % self.num_buffers
+
+        inputs_padded = self._pad("inputs", inputs, order, lengths_input_sorted, int(lengths_input_sorted[0]))
+
+        targets_padded = None
+        if batch[0][1] is None:
+            # If no target is given, output lengths are assumed to be the same as input lengths.
+            seq_lengths_target = seq_lengths_input
+            lengths_target_sorted = lengths_input_sorted
+        else:
+            targets = [np.asarray(sample[1]) for sample in batch]
+            lengths_target_sorted = np.fromiter((len(targets[i]) for i in order), dtype=np.int64, count=len(order))
+            seq_lengths_target = torch.from_numpy(lengths_target_sorted)
+            targets_padded = self._pad("targets", targets, order, lengths_target_sorted,
+                                       int(lengths_target_sorted.max()))
+
+        # Create a mask for the loss, ignore it if all entries would be 1.
+        mask = None
+        if len(batch) > 1 and lengths_target_sorted.min() != lengths_target_sorted.max():
+            mask = self._mask(lengths_target_sorted, int(lengths_target_sorted.max()))
+
+        return inputs_padded, targets_padded, seq_lengths_input, seq_lengths_target, mask, permutation
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Write checkpoints on a background thread with a retention policy. Every file is written to a temporary file first
+   which is then renamed, so a crash never leaves a partially written checkpoint behind.
+"""
+
+# System imports.
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import logging
+import os
+import shutil
+
+# Third-party imports.
+import torch
+
+# Local source tree imports.
+from idiaptts.misc.utils import makedirs_safe
+
+
+class CheckpointWriter(object):
+    """
+    A checkpoint is given as dictionary of file name suffix to object, e.g. {"": checkpoint, "_ema": ema_model}, where
+    each object is saved to file_path + suffix. All tensors are copied to CPU memory before save returns, so training
+    continues while the files are serialised and written on a worker thread. Only one checkpoint is written at a
+    time, save waits for the previous one.
+
+    Periodic checkpoints are removed by a retention policy, which keeps the last keep_last checkpoints and the
+    keep_best checkpoints with the lowest loss. A best checkpoint of the same epoch as a periodic checkpoint is
+    hard-linked to it instead of being written twice. Because files are always replaced and never written in-place,
+    a linked best checkpoint is not changed by later checkpoints and survives the removal of the periodic one.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, keep_last=0, keep_best=0, asynchronous=True):
+        """
+        :param keep_last:       Number of the most recent periodic checkpoints which are kept.
+        :param keep_best:       Number of periodic checkpoints with the lowest loss which are kept in addition.
+                                All periodic checkpoints are kept when both are 0.
+        :param asynchronous:    Write on a worker thread, otherwise save blocks until the files are written.
+        """
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.asynchronous = asynchronous
+
+        self._executor = None
+        self._future = None
+        self._checkpoints = list()  # Tuples of (file_path, suffixes, loss) of periodic checkpoints, oldest first.
+
+    @staticmethod
+    def to_cpu(obj):
+        """Return a copy of obj where all tensors, also in nested dictionaries, lists, and tuples, are on CPU."""
+        if torch.is_tensor(obj):
+            return obj.detach().to("cpu", copy=True)
+        if isinstance(obj, torch.nn.Module):
+            return copy.deepcopy(obj).cpu()
+        if isinstance(obj, dict):
+            obj_cpu = type(obj)((key, CheckpointWriter.to_cpu(value)) for key, value in obj.items())
+            if hasattr(obj, "_metadata"):
+                obj_cpu._metadata = obj._metadata  # Version information of state dicts.
+            return obj_cpu
+        if type(obj) in (list, tuple):
+            return type(obj)(CheckpointWriter.to_cpu(value) for value in obj)
+        return obj
+
+    @staticmethod
+    def save_atomic(obj, file_path):
+        """Save obj with torch.save to a temporary file which replaces file_path once it is completely written."""
+        tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                torch.save(obj, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def link_atomic(src_path, dst_path):
+        """Replace dst_path by a hard link to src_path, or by a copy if the file system does not support links."""
+        tmp_path = "{}.{}.tmp".format(dst_path, os.getpid())
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(src_path, tmp_path)
+        except OSError:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+
+    def save(self, files, file_path=None, best_path=None, loss=None):
+        """
+        Save a checkpoint as periodic checkpoint and/or as best checkpoint.
+
+        :param files:         Dictionary of file name suffix to object to save.
+        :param file_path:     Path of the periodic checkpoint, which is subject to the retention policy, or None.
+        :param best_path:     Path of the best checkpoint or None. It is hard-linked to the periodic checkpoint if
+                              both are given.
+        :param loss:          Loss of the checkpoint used by the retention policy.
+        """
+        assert file_path is not None or best_path is not None, "Either file_path or best_path is required."
+        self.logger.info("Save checkpoint to " + ", ".join(path for path in (file_path, best_path) if path is not None))
+        files = self.to_cpu(files)
+
+        self.wait()
+        if self.asynchronous:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            self._future = self._executor.submit(self._write, files, file_path, best_path, loss)
+        else:
+            self._write(files, file_path, best_path, loss)
+
+    def _write(self, files, file_path, best_path, loss):
+        makedirs_safe(os.path.dirname(file_path if file_path is not None else best_path))
+        for suffix, obj in files.items():
+            if file_path is not None:
+                self.save_atomic(obj, file_path + suffix)
+                if best_path is not None:
+                    self.link_atomic(file_path + suffix, best_path + suffix)
+            else:
+                self.save_atomic(obj, best_path + suffix)
+
+        if file_path is not None:
+            # A checkpoint saved again to the same path only exists once.
+            self._checkpoints = [checkpoint for checkpoint in self._checkpoints if checkpoint[0] != file_path]
+            self._checkpoints.append((file_path, tuple(files), loss))
+            self._apply_retention()
+
+    def _apply_retention(self):
+        if self.keep_last <= 0 and self.keep_best <= 0:
+            return
+
+        num_checkpoints = len(self._checkpoints)
+        keep = set(range(max(0, num_checkpoints - self.keep_last), num_checkpoints))
+        with_loss = [index for index, checkpoint in enumerate(self._checkpoints) if checkpoint[2] is not None]
+        keep.update(sorted(with_loss, key=lambda index: self._checkpoints[index][2])[:max(0, self.keep_best)])
+
+        for index in reversed(range(num_checkpoints)):
+            if index not in keep:
+                file_path, suffixes, _ = self._checkpoints.pop(index)
+                for suffix in suffixes:
+                    if os.path.isfile(file_path + suffix):
+                        os.remove(file_path + suffix)
+                self.logger.info("Removed checkpoint {}.".format(file_path))
+
+    def wait(self):
+        """Block until the pending checkpoint is written. Exceptions of the worker thread are raised here."""
+        if self._future is not None:
+            future, self._future = self._future, None
+            future.result()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+"""Module description:
+   Collate function which expands state-level question labels of a batch to frames before padding them.
+"""
+
+# System imports.
+import logging
+
+# Third-party imports.
+import numpy as np
+
+# Local source tree imports.
+from idiaptts.src.data_preparation.questions.label_normalisation import HTSLabelNormalisation
+from idiaptts.src.neural_networks.pytorch.BatchCollator import BatchCollator
+
+
+class FrameExpansionCollator(object):
+    """
+    Inputs are state-level question labels (see QuestionLabelGen with state_level=True). The states of all samples
+    of a batch are expanded to frames in a single call of HTSLabelNormalisation.expand_state_labels, which also
+    normalises the computed frame features with the same float32 NormTransform as QuestionLabelGen. Afterwards
+    input and target lengths are matched like in PyTorchLabelGensDataset with match_lengths=True and the batch is
+    collated by a BatchCollator, so the returned values are identical to ModelHandlerPyTorch.prepare_batch of
+    frame-level inputs.
+
+    Only the expanded batch exists at frame level, datasets, caches and files stay at state level.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, subphone_feats="full", norm_params=None, match_lengths=True):
+        """
+        Create a collate function.
+
+        :param subphone_feats:    Type of frame features, see HTSLabelNormalisation.
+        :param norm_params:       Tuple of (min, max) of the frame features, see
+                                  QuestionLabelGen.get_frame_feature_norm_params. Features are not normalised if None.
+        :param match_lengths:     Trim inputs or targets at both ends to the same length.
+        """
+        self.subphone_feats = subphone_feats
+        self.norm_params = norm_params
+        self.match_lengths = match_lengths
+
+    def expand(self, state_samples):
+        """Expand a list of state-level samples to a list of frame-level samples."""
+        state_samples = [np.asarray(sample) for sample in state_samples]
+        frames = HTSLabelNormalisation.expand_state_labels(np.concatenate(state_samples), self.subphone_feats,
+                                                           self.norm_params)
+
+        num_state_questions = state_samples[0].shape[1] - HTSLabelNormalisation.num_state_info
+        num_frames = [int(sample[:, num_state_questions].sum()) for sample in state_samples]
+        return np.split(frames, np.cumsum(num_frames)[:-1])
+
+    @staticmethod
+    def _match_lengths(labels_in, labels_out):
+        len_diff = len(labels_in) - len(labels_out)
+        if len_diff > 0:  # Input longer than output; trim input.
+            trim_front = len_diff // 2
+            labels_in = labels_in[trim_front:trim_front + len(labels_out)]
+        elif len_diff < 0:  # Output longer than input; trim output.
+            trim_front = abs(len_diff) // 2
+            labels_out = labels_out[trim_front:trim_front + len(labels_in)]
+
+        return labels_in, labels_out
+
+    def __call__(self, batch, common_divisor=1, batch_first=False):
+        inputs = self.expand([sample[0] for sample in batch])
+
+        frame_batch = list()
+        for labels_in, (_, labels_out, *misc) in zip(inputs, batch):
+            if labels_out is not None and self.match_lengths:
+                labels_in, labels_out = self._match_lengths(labels_in, labels_out)
+            frame_batch.append((labels_in, labels_out, *misc))
+
+        return BatchCollator(common_divisor, batch_first)(frame_batch)
@@ -12,17 +12,21 @@ Handler module to work with PyTorch models.
 # System imports.
 import sys
 import os
+import contextlib
 import resource
 import importlib
 from datetime import datetime
-from operator import itemgetter
 import logging
 import copy
 
 # Third-party imports.
 from torch.optim.lr_scheduler import *
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
 from torch.nn import DataParallel
+from torch.nn.parallel import DistributedDataParallel
+import torch.distributed as dist
+import torch.multiprocessing
 
 # Local source tree imports.
 from idiaptts.misc.utils import get_gpu_memory_map
@@ -30,7 +34,20 @@ from idiaptts.src.neural_networks.ModelHandler import ModelHandler
 from idiaptts.src.neural_networks.pytorch.models.RNNDyn import *
 from idiaptts.misc.utils import makedirs_safe
 from idiaptts.src.neural_networks.pytorch.ExponentialMovingAverage import ExponentialMovingAverage
+from idiaptts.src.neural_networks.pytorch.CheckpointWriter import CheckpointWriter
 from idiaptts.src.neural_networks.pytorch.ModelFactory import ModelFactory
+from idiaptts.src.data_preparation.LengthBucketBatchSampler import LengthBucketBatchSampler
+from idiaptts.src.neural_networks.pytorch.BatchCollator import BatchCollator
+
+
+def _run_distributed(rank, world_size, fn, args, master_addr, master_port):
+    """Entry point of processes started by ModelHandlerPyTorch.spawn_distributed."""
+    os.environ["RANK"] = str(rank)
+    os.environ["LOCAL_RANK"] = str(rank)
+    os.environ["WORLD_SIZE"] = str(world_size)
+    os.environ["MASTER_ADDR"] = master_addr
+    os.environ["MASTER_PORT"] = str(master_port)
+    fn(*args)
 
 
 class ModelHandlerPyTorch(ModelHandler):
@@ -55,6 +72,7 @@ class ModelHandlerPyTorch(ModelHandler):
 
         self._scheduler_step_fn = None
         self.ema = None  # Exponential moving average object.
+        self._parallel_model = None  # DataParallel or DistributedDataParallel wrapper, created once per model.
 
     @staticmethod
     def cuda_is_available():
@@ -68,6 +86,48 @@ class ModelHandlerPyTorch(ModelHandler):
     def seed(seed):
         torch.manual_seed(seed)
 
+    @staticmethod
+    def init_distributed(hparams):
+        """
+        Join the process group of distributed training with hparams.distributed_backend. Rank and world size are
+        read with hparams.distributed_init_method, by default from the RANK, WORLD_SIZE, MASTER_ADDR, and
+        MASTER_PORT environment variables set by torchrun or spawn_distributed. With GPUs each process uses the
+        device of its LOCAL_RANK. Only the process with rank 0 logs messages below warning level.
+        """
+        if not dist.is_initialized():
+            dist.init_process_group(backend=hparams.distributed_backend, init_method=hparams.distributed_init_method)
+        if hparams.use_gpu:
+            torch.cuda.set_device(int(os.environ.get("LOCAL_RANK", dist.get_rank() % torch.cuda.device_count())))
+        if dist.get_rank() != 0:
+            logging.getLogger().setLevel(logging.WARNING)
+        ModelHandlerPyTorch.logger.warning("Process {} of {} joined distributed training with {}."
+                                           .format(dist.get_rank(), dist.get_world_size(),
+                                                   hparams.distributed_backend))
+
+    @staticmethod
+    def spawn_distributed(fn, world_size, args=(), master_addr="127.0.0.1", master_port=29500):
+        """
+        Run fn(*args) in world_size local processes with the environment of distributed training, e.g. a function
+        which creates and trains a ModelTrainer with hparams.distributed_backend="gloo" on a machine without GPUs.
+        """
+        torch.multiprocessing.spawn(_run_distributed, args=(world_size, fn, args, master_addr, master_port),
+                                    nprocs=world_size, join=True)
+
+    @staticmethod
+    def is_distributed():
+        return dist.is_available() and dist.is_initialized()
+
+    @staticmethod
+    def is_main_process():
+        """Returns False for all but the rank 0 process of distributed training, use it for saving and logging."""
+        return not ModelHandlerPyTorch.is_distributed() or dist.get_rank() == 0
+
+    @staticmethod
+    def barrier():
+        """Wait for all processes of distributed training, does nothing otherwise."""
+        if ModelHandlerPyTorch.is_distributed():
+            dist.barrier()
+
     @staticmethod
     def prepare_batch(batch, common_divisor=1, batch_first=False):
         """
@@ -81,67 +141,8 @@ class ModelHandlerPyTorch(ModelHandler):
                                       and mask is also None if batch length is 1.
         """
 
-        # Remove samples if not equally dividable by given divisor (usually number of GPUs).
-        # Remove before sorting to keep it unbiased.
-        assert(len(batch) >= common_divisor)
-        remainder = len(batch) % common_divisor
-        if remainder > 0:
-            batch = batch[:-remainder]
-
-        # Sort batch if it contains more than one sample (longest first).
-        permutation = None
-        if len(batch) > 1:
-            batch_enumerated = [(batch[i], i) for i in range(len(batch))]
-            batch_enumerated.sort(key=lambda x: len(x[0][0]), reverse=True)
-            batch, permutation = zip(*batch_enumerated)
-
-        # Read lengths from samples.
-        seq_lengths_input = torch.tensor([len(x[0]) for x in batch], dtype=torch.long)
-
-        # V1: This version computes unnecessary padded zeros in forward pass of non-recurrent layers.
-        inputs = [torch.from_numpy(x[0]) for x in batch]
-        inputs = pad_sequence(inputs, batch_first)
-
-        targets = None
-        seq_lengths_target = None
-        mask = None
-        # Check if target is given.
-        if batch[0][1] is None:
-            # If no target is given, output lengths are assumed to be the same as input lengths.
-            # If this is not the case, consider writing your own batch_decollate_fn in your trainer.
-            seq_lengths_target = seq_lengths_input
-        else:
-            # Read lengths from samples.
-            seq_lengths_target = torch.tensor([len(x[1]) for x in batch], dtype=torch.long)
-
-            # V1: This version computes unnecessary padded zeros in forward pass of non-recurrent layers.
-            targets = [torch.from_numpy(x[1]) for x in batch]
-
-            # Check if longest input sequence is also longest output sequence.
-            if torch.argmax(seq_lengths_target) != 0:
-                seq_lengths_target_sorted, sort_indices = torch.sort(seq_lengths_target, descending=True)
-                targets_sorted = itemgetter(*sort_indices)(targets)  # itemgetter is faster than lambda function.
-                targets = pad_sequence(targets_sorted, batch_first)
-                unsort_indices = tuple(np.argsort(sort_indices.numpy()))  # arsort function not implemented in PyTorch.
-                if batch_first:
-                    targets = targets[unsort_indices]
-                else:
-                    targets = targets[:, unsort_indices]
-                targets = targets.contiguous()
-            else:
-                targets = pad_sequence(targets, batch_first)
-
-        # Crate a mask for the loss, target shape will be (T x B x C) or (B x T x C).
-        # A mask can only be created when targets are given, but it should also be only necessary when
-        # computing a loss which requires targets anyway.
-        if len(batch) > 1:
-            mask = ModelHandlerPyTorch.sequence_mask(seq_lengths_target, seq_lengths_target.max(), batch_first=batch_first)
-            # mask = mask.unsqueeze(-1).expand_as(targets).contiguous()
-            # Ignore the mask if all entries are 1.
-            if mask.min() == 1:
-                mask = None
-
-        return inputs, targets, seq_lengths_input, seq_lengths_target, mask, permutation
+        # Samples are copied directly into their padded position, see BatchCollator for details.
+        return BatchCollator(common_divisor, batch_first)(batch)
 
         # # V2: Concat batch to one vector. Requires handling in each model with recurrence.
         # time_dim = 1 if batch_first else 0
@@ -180,23 +181,110 @@ class ModelHandlerPyTorch(ModelHandler):
         return (seq_range_expand < seq_length_expand).unsqueeze(-1).contiguous().float()
 
     def set_dataset(self, hparams, dataset_train, dataset_val, collate_fn=None):
-        common_divisor = hparams.num_gpus  # Will be 1 if used on CPU.
-        self.dataloader_train = DataLoader(dataset=dataset_train,
-                                           batch_size=hparams.batch_size_train,
-                                           shuffle=hparams.shuffle_train_set,
-                                           num_workers=hparams.dataset_num_workers_gpu if hparams.use_gpu else hparams.dataset_num_workers_cpu,
-                                           collate_fn=partial(self.prepare_batch if collate_fn is None else collate_fn,
-                                                              common_divisor=common_divisor,
-                                                              batch_first=hparams.batch_first),
-                                           pin_memory=hparams.dataset_pin_memory)
-        self.dataloader_val = DataLoader(dataset_val,
-                                         batch_size=hparams.batch_size_val,  # Used to be batch_size_test, please change it in your My* class.
-                                         shuffle=hparams.shuffle_val_set,
-                                         num_workers=hparams.dataset_num_workers_gpu if hparams.use_gpu else hparams.dataset_num_workers_cpu,
-                                         collate_fn=partial(self.prepare_batch if collate_fn is None else collate_fn,
-                                                            common_divisor=common_divisor,
-                                                            batch_first=hparams.batch_first),
-                                         pin_memory=hparams.dataset_pin_memory)
+        """
+        Create the dataloaders of training and validation set. In distributed training each process loads a
+        different shard of the datasets with a DistributedSampler or the sharded LengthBucketBatchSampler.
+        """
+        # Will be 1 if used on CPU. Batches are not split by DistributedDataParallel.
+        common_divisor = 1 if self.is_distributed() else hparams.num_gpus
+        num_workers = hparams.dataset_num_workers_gpu if hparams.use_gpu else hparams.dataset_num_workers_cpu
+        pin_memory = hparams.dataset_pin_memory
+        if collate_fn is None:
+            # Buffers can only be reused (and pinned directly) when batches are collated in the main process.
+            num_buffers = getattr(hparams, "dataset_collate_num_buffers", 0) if num_workers == 0 else 0
+            collate_fn = BatchCollator(common_divisor,
+                                       hparams.batch_first,
+                                       pin_memory=pin_memory and hparams.use_gpu and num_buffers > 0,
+                                       num_buffers=num_buffers)
+            if num_buffers > 0:
+                pin_memory = False  # Already pinned by the collator if requested.
+        else:
+            collate_fn = partial(collate_fn, common_divisor=common_divisor, batch_first=hparams.batch_first)
+
+        batch_sampler_train = self._get_batch_sampler(hparams, dataset_train,
+                                                      getattr(hparams, "batch_max_frames_train", None),
+                                                      hparams.shuffle_train_set)
+        if batch_sampler_train is not None:
+            self.dataloader_train = DataLoader(dataset=dataset_train,
+                                               batch_sampler=batch_sampler_train,
+                                               num_workers=num_workers,
+                                               collate_fn=collate_fn,
+                                               pin_memory=pin_memory)
+        else:
+            sampler_train = self._get_distributed_sampler(hparams, dataset_train, hparams.shuffle_train_set)
+            self.dataloader_train = DataLoader(dataset=dataset_train,
+                                               batch_size=hparams.batch_size_train,
+                                               shuffle=hparams.shuffle_train_set if sampler_train is None else False,
+                                               sampler=sampler_train,
+                                               num_workers=num_workers,
+                                               collate_fn=collate_fn,
+                                               pin_memory=pin_memory)
+
+        # Validation shards are not padded, so that every sample contributes exactly once to the loss.
+        batch_sampler_val = self._get_batch_sampler(hparams, dataset_val,
+                                                    getattr(hparams, "batch_max_frames_val", None),
+                                                    hparams.shuffle_val_set, pad_replicas=False)
+        if batch_sampler_val is not None:
+            self.dataloader_val = DataLoader(dataset_val,
+                                             batch_sampler=batch_sampler_val,
+                                             num_workers=num_workers,
+                                             collate_fn=collate_fn,
+                                             pin_memory=pin_memory)
+        else:
+            sampler_val = self._get_distributed_sampler(hparams, dataset_val, hparams.shuffle_val_set, pad=False)
+            self.dataloader_val = DataLoader(dataset_val,
+                                             batch_size=hparams.batch_size_val,  # Used to be batch_size_test, please change it in your My* class.
+                                             shuffle=hparams.shuffle_val_set if sampler_val is None else False,
+                                             sampler=sampler_val,
+                                             num_workers=num_workers,
+                                             collate_fn=collate_fn,
+                                             pin_memory=pin_memory)
+
+    def _get_distributed_sampler(self, hparams, dataset, shuffle, pad=True):
+        """
+        Return a DistributedSampler in distributed training, otherwise None. The sampler pads the dataset with
+        its first samples so that all processes load the same number of batches. Without padding every
+        num_replicas-th sample starting at the rank is used, so processes can load different numbers of samples.
+        """
+        if not self.is_distributed() or dataset is None:
+            return None
+        if not pad:
+            return list(range(dist.get_rank(), len(dataset), dist.get_world_size()))
+        return DistributedSampler(dataset, shuffle=shuffle, seed=hparams.seed if hparams.seed is not None else 0)
+
+    @staticmethod
+    def _get_batch_sampler(hparams, dataset, max_frames, shuffle, pad_replicas=True):
+        """
+        Create a LengthBucketBatchSampler if a frame budget per batch is given, otherwise return None.
+        The dataset has to provide a get_lengths() method, see PyTorchLabelGensDataset.
+        """
+        if max_frames is None or dataset is None:
+            return None
+
+        if not callable(getattr(dataset, "get_lengths", None)):
+            raise TypeError("Length bucketing requires a dataset with a get_lengths() method, {} has none."
+                            .format(type(dataset).__name__))
+
+        lengths = dataset.get_lengths(getattr(hparams, "dataset_length_index_file", None))
+        if ModelHandlerPyTorch.is_distributed():
+            batch_sampler = LengthBucketBatchSampler(lengths,
+                                                     max_frames,
+                                                     num_buckets=getattr(hparams, "batch_num_buckets", 10),
+                                                     shuffle=shuffle,
+                                                     num_replicas=dist.get_world_size(),
+                                                     rank=dist.get_rank(),
+                                                     seed=hparams.seed if hparams.seed is not None else 0,
+                                                     pad_replicas=pad_replicas)
+        else:
+            batch_sampler = LengthBucketBatchSampler(lengths,
+                                                     max_frames,
+                                                     num_buckets=getattr(hparams, "batch_num_buckets", 10),
+                                                     shuffle=shuffle,
+                                                     common_divisor=hparams.num_gpus)
+        ModelHandlerPyTorch.logger.info("Planned {} batches of at most {} frames with {:.1%} padding efficiency."
+                                        .format(len(batch_sampler), max_frames,
+                                                batch_sampler.get_padding_efficiency()))
+        return batch_sampler
 
     def set_optimiser(self, hparams):
         """Initialise a PyTorch optimiser here."""
@@ -235,7 +323,9 @@ class ModelHandlerPyTorch(ModelHandler):
                     hparams.epochs_per_scheduler_step = 1
                 return
 
-            current_iteration = max((current_epoch - 1) * len(self.dataloader_train), -1)
+            # The scheduler is stepped once per optimiser update, see process_dataloader. The constructor steps once
+            # itself, so the first update of the next epoch uses the learning rate of the last update.
+            current_iteration = max(current_epoch * self._get_num_updates(hparams, self.dataloader_train) - 1, -1)
             if hparams.scheduler_type == "Exponential":
                 if hparams.epochs_per_scheduler_step is None:
                     if hparams.iterations_per_scheduler_step is None:
@@ -268,6 +358,12 @@ class ModelHandlerPyTorch(ModelHandler):
         else:
             self.scheduler = hparams.scheduler(self.optimiser)
 
+    @staticmethod
+    def _get_num_updates(hparams, dataloader):
+        """Return the number of optimiser updates per epoch, the last one can accumulate fewer batches."""
+        accumulation_steps = getattr(hparams, "accumulation_steps", 1)
+        return (len(dataloader) + accumulation_steps - 1) // accumulation_steps
+
     def _scheduler_step_with_loss(self, loss, iteration):
         self.scheduler.step(loss, iteration + 1)
         # self.logger.info("Epoch: " + str(epoch + 1) + ", lr: " + str(self.scheduler_type.get_lr()))
@@ -368,7 +464,8 @@ class ModelHandlerPyTorch(ModelHandler):
                 average_model, *_ = self.load_model(file_path + "_ema",
                                                     hparams,
                                                     verbose=True)
-                self.ema = ExponentialMovingAverage(average_model, hparams.ema_decay)
+                self.ema = ExponentialMovingAverage(average_model, hparams.ema_decay,
+                                                    getattr(hparams, "ema_update_interval", 1))
             except FileNotFoundError:
                 self.logger.warning("EMA is enabled but no EMA model can be found at {}. ".format(file_path + "_ema") +
                                     "A new one will be created for training.")
@@ -424,13 +521,12 @@ class ModelHandlerPyTorch(ModelHandler):
 
         return checkpoint['epoch']
 
-    def save_checkpoint(self, file_path, total_epoch):
+    def get_checkpoint_files(self, total_epoch):
         """
-        Save checkpoint which consists of epoch number, model type, in/out dimensions, model state dict, whole
-        optimiser, etc. Also save the EMA separately when one exists.
+        Return the checkpoint as dictionary of file name suffix to object. The checkpoint consists of epoch number,
+        model type, in/out dimensions, model state dict, optimiser state dict, etc. The EMA model is a separate file
+        with suffix _ema when one exists.
         """
-        self.logger.info("Save checkpoint to " + file_path)
-        makedirs_safe(os.path.dirname(file_path))  # Create directory if necessary.
         checkpoint_dict = {'epoch': total_epoch,
                            'model_name': self.model_name,
                            'optimiser_state_dict': self.optimiser.state_dict() if self.optimiser is not None else None,
@@ -443,16 +539,30 @@ class ModelHandlerPyTorch(ModelHandler):
                                     'model_state_dict': self.model.state_dict()})
         else:
             checkpoint_dict.update({'model': self.model})  # Special case where model_type is not given.
-
-        torch.save(checkpoint_dict, file_path)
         # TODO: Also save the random generator states:
         #       torch.random.get_rng_state()
         #       torch.random.set_rng_state()
         #       Same for random package?
         # TODO: Save scheduler_type in checkpoint as well.
+        files = {"": checkpoint_dict}
 
         if self.ema:
-            self.save_model(file_path + "_ema", self.ema.model, self.model_type, self.dim_in, self.dim_out, verbose=True)
+            files["_ema"] = {'model_type': self.model_type,
+                             'dim_in': self.dim_in,
+                             'dim_out': self.dim_out,
+                             'model_state_dict': self.ema.model.state_dict()}
+
+        return files
+
+    def save_checkpoint(self, file_path, total_epoch):
+        """
+        Save the checkpoint files of get_checkpoint_files next to file_path. Each file is written to a temporary file
+        first, which then replaces the file at its path.
+        """
+        self.logger.info("Save checkpoint to " + file_path)
+        makedirs_safe(os.path.dirname(file_path))  # Create directory if necessary.
+        for suffix, obj in self.get_checkpoint_files(total_epoch).items():
+            CheckpointWriter.save_atomic(obj, file_path + suffix)
 
     def forward(self, in_tensor, hparams, batch_seq_lengths=None, target=None):
         """Forward one example through the model.
@@ -528,9 +638,13 @@ class ModelHandlerPyTorch(ModelHandler):
         model = self.model
         if training:
             model.train()
+            if self.is_distributed():
+                device = "{} processes ({}).".format(dist.get_world_size(), dist.get_backend())
+            else:
+                device = str(torch.cuda.device_count()) + " GPU(s)." if hparams.use_gpu else "1 CPU."
             self.logger.info("{}: Train with {} on {}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                                                               self.optimiser,
-                                                              str(torch.cuda.device_count()) + " GPU(s)." if hparams.use_gpu else "1 CPU."))
+                                                              device))
         else:
             if self.ema is not None:
                 self.logger.info("Using averaged model for validation.")
@@ -543,19 +657,35 @@ class ModelHandlerPyTorch(ModelHandler):
                              .format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3,
                                      str(get_gpu_memory_map()) if hparams.use_gpu else "-"))
 
-        # Multi-GPU support.
-        if hparams.num_gpus > 1:
-            model = DataParallel(model, dim=0 if hparams.batch_first else 1)
-            model.init_hidden = model.module.init_hidden  # Make the init_hidden method directly accessible.
+        # Multi-GPU and distributed support.
+        model = self._get_parallel_model(model, hparams, training)
 
         # Log loss after each <hparams.logging_batch_index_perc>% of batches.
         logging_batch_index = (len(dataloader) // hparams.logging_batch_index_perc) + 1
 
+        # Gradients of accumulation_steps batches are summed up and normalised by their total number of frames (or
+        # samples) before each update of the model.
+        accumulation_steps = getattr(hparams, "accumulation_steps", 1)
+        num_updates = self._get_num_updates(hparams, dataloader)
+        accumulated_weight = 0
+
+        # NaN losses are flagged on the device and only checked every nan_check_interval batches. Updates applied
+        # since the last check are rolled back when a NaN is found.
+        nan_check_interval = getattr(hparams, "nan_check_interval", 1)
+        is_nan = None
+        last_good_state = None
+        if training and nan_check_interval > 1:
+            last_good_state = self._get_training_state(pin_memory=hparams.use_gpu)
+        num_inf_updates = None  # Number of updates with non-finite gradients, counted on the device.
+
         current_batch_index = -1  # Consider special case for first batch.
         current_batch = None
         loss = None
         total_loss = 0
         loss_features = None
+        num_samples = 0
+        num_frames = 0  # Number of real input frames, used to report the padding efficiency.
+        num_padded_frames = 0
 
         # FIXME: Experimental implementation to pre-load the next batch to GPU. Does not work yet because it blocks.
         if hparams.use_gpu and hparams.preload_next_batch_to_gpu:
@@ -566,23 +696,29 @@ class ModelHandlerPyTorch(ModelHandler):
             current_batch_index = 0
             # Move the first batch to GPU.
             inputs, target, seq_lengths_input, seq_lengths_target, mask, _ = current_batch
-            inputs = inputs.cuda(async=hparams.dataset_load_async) if inputs is not None else None
-            seq_lengths_input = seq_lengths_input.cuda(async=hparams.dataset_load_async)
-            target = target.cuda(async=hparams.dataset_load_async)
-            seq_lengths_target = seq_lengths_target.cuda(async=hparams.dataset_load_async)
-            mask = mask.cuda(async=hparams.dataset_load_async) if mask is not None else None
+            inputs = inputs.cuda(non_blocking=hparams.dataset_load_async) if inputs is not None else None
+            seq_lengths_input = seq_lengths_input.cuda(non_blocking=hparams.dataset_load_async)
+            target = target.cuda(non_blocking=hparams.dataset_load_async)
+            seq_lengths_target = seq_lengths_target.cuda(non_blocking=hparams.dataset_load_async)
+            mask = mask.cuda(non_blocking=hparams.dataset_load_async) if mask is not None else None
             current_batch = inputs, target, seq_lengths_input, seq_lengths_target, mask, _
 
         # Iterate on the batches.
         for next_batch_index, next_batch in enumerate(dataloader, current_batch_index + 1):
+            # Count real and padded input frames while the lengths are still on the CPU.
+            next_seq_lengths_input = next_batch[2]
+            num_samples += len(next_seq_lengths_input)
+            num_frames += int(next_seq_lengths_input.sum())
+            num_padded_frames += len(next_seq_lengths_input) * int(next_seq_lengths_input.max())
+
             # Move the next batch to GPU.
             if hparams.use_gpu:
                 next_inputs, next_target, next_seq_lengths_input, next_seq_lengths_target, next_mask, _ = next_batch
-                next_inputs = next_inputs.cuda(async=hparams.dataset_load_async) if next_inputs is not None else None
-                next_seq_lengths_input = next_seq_lengths_input.cuda(async=hparams.dataset_load_async)
-                next_target = next_target.cuda(async=hparams.dataset_load_async)
-                next_seq_lengths_target = next_seq_lengths_target.cuda(async=hparams.dataset_load_async)
-                next_mask = next_mask.cuda(async=hparams.dataset_load_async) if next_mask is not None else None
+                next_inputs = next_inputs.cuda(non_blocking=hparams.dataset_load_async) if next_inputs is not None else None
+                next_seq_lengths_input = next_seq_lengths_input.cuda(non_blocking=hparams.dataset_load_async)
+                next_target = next_target.cuda(non_blocking=hparams.dataset_load_async)
+                next_seq_lengths_target = next_seq_lengths_target.cuda(non_blocking=hparams.dataset_load_async)
+                next_mask = next_mask.cuda(non_blocking=hparams.dataset_load_async) if next_mask is not None else None
                 next_batch = next_inputs, next_target, next_seq_lengths_input, next_seq_lengths_target, next_mask, _
 
             # If there is no current batch either experiment is on CPU or hparams.preload_next_batch_to_gpu is False.
@@ -600,7 +736,7 @@ class ModelHandlerPyTorch(ModelHandler):
 
             # Forward the input through the model.
             max_length_inputs = seq_lengths_input[0]
-            if hparams.use_gpu and hparams.num_gpus > 1:
+            if hparams.use_gpu and hparams.num_gpus > 1 and not self.is_distributed():
                 assert(len(seq_lengths_input) % torch.cuda.device_count() == 0)  # Batch is not equally dividable into the given number of GPUs.
                 max_length_inputs = max_length_inputs.repeat(hparams.num_gpus)
 
@@ -633,18 +769,35 @@ class ModelHandlerPyTorch(ModelHandler):
                 # Average the loss on each sample of the batch and then compute the mean, which means that
                 # each sample in the batch contributes equally to the loss independently from its length.
 
-                # Automatically determine the time dimension and sum over it.
-                time_dim = 0 if loss_full.shape[0] == seq_lengths_target.max() else 1
+                # Sum over the time dimension, the targets are batched like the inputs.
+                time_dim = 1 if hparams.batch_first else 0
                 sample_loss_features = (loss_full.sum(dim=time_dim) / seq_lengths_target.unsqueeze(-1).float()).mean(0)  # Take mean over batch dimension.
                 loss = sample_loss_features.mean()
+                loss_weight = len(seq_lengths_target)
             else:
                 # Default: Average the loss over all frames, then compute the mean of all loss channels.
-                sample_loss_features = (loss_full.sum(dim=(0, 1)) / sum(seq_lengths_target).float())
+                loss_weight = seq_lengths_target.sum().float()
+                sample_loss_features = (loss_full.sum(dim=(0, 1)) / loss_weight)
                 loss = sample_loss_features.mean()
 
-            if torch.isnan(loss):
-                self.logger.error("Loss is nan: {}".format(sample_loss_features))
-                break
+            is_nan = torch.isnan(loss) if is_nan is None else is_nan | torch.isnan(loss)
+            if (current_batch_index + 1) % nan_check_interval == 0 or current_batch_index + 1 == len(dataloader):
+                if training and self.is_distributed():
+                    # Stop in all processes together, otherwise the others wait for the gradients of this one.
+                    is_nan = is_nan.float()
+                    dist.all_reduce(is_nan, op=dist.ReduceOp.MAX)
+                    is_nan = is_nan.bool()
+                if is_nan:
+                    self.logger.error("Loss is nan: {}".format(sample_loss_features))
+                    if last_good_state is not None:
+                        self.logger.error("Roll back the updates of the last {} batches."
+                                          .format((current_batch_index % nan_check_interval) + 1))
+                        self._set_training_state(last_good_state)
+                        total_loss = loss.new_tensor(np.nan)
+                    break
+                if last_good_state is not None:
+                    last_good_state = self._get_training_state(last_good_state, hparams.use_gpu)
+                self._log_inf_grads(num_inf_updates)
             # nan_or_inf = torch.isnan(loss)
             # for params in self.model.parameters():
             #     nan_or_inf |= torch.isnan(params.data).any()
@@ -654,10 +807,33 @@ class ModelHandlerPyTorch(ModelHandler):
             #         pdb.set_trace()
 
             if training:
-                # Zero all gradients in the optimiser.
-                self.optimiser.zero_grad()
-                # Propagate error backwards.
-                loss.backward(retain_graph=hparams.backward_retain_graph)
+                is_update_step = (current_batch_index + 1) % accumulation_steps == 0\
+                    or current_batch_index + 1 == len(dataloader)
+                if current_batch_index % accumulation_steps == 0:
+                    # Zero all gradients in the optimiser.
+                    self.optimiser.zero_grad()
+                    accumulated_weight = 0
+
+                if accumulation_steps > 1:
+                    # Propagate the summed instead of the averaged error, the sum of all accumulated batches is
+                    # normalised before the update.
+                    accumulated_weight += loss_weight
+                    backward_loss = loss * loss_weight
+                else:
+                    backward_loss = loss
+
+                # Gradients of DistributedDataParallel are only synchronised in the backward pass before an update.
+                no_sync = getattr(model, "no_sync", None) if not is_update_step else None
+                with no_sync() if no_sync is not None else contextlib.nullcontext():
+                    # Propagate error backwards.
+                    backward_loss.backward(retain_graph=hparams.backward_retain_graph)
+                del backward_loss
+
+            if training and is_update_step:
+                grads = [params.grad for params in self.model.parameters() if params.grad is not None]
+                if accumulation_steps > 1:
+                    # Normalise by the frames (or samples) of all accumulated batches.
+                    torch._foreach_div_(grads, accumulated_weight)
 
                 # # DEBUG: Check for NaNs and Infs and start pdb debugger if some are found.
                 # nan_or_inf = torch.isnan(loss)
@@ -668,19 +844,11 @@ class ModelHandlerPyTorch(ModelHandler):
                 #     if nan_or_inf:
                 #         pdb.set_trace()
 
-                if hparams.replace_inf_grads_by_zero:
-                    # Replace inf/-inf in gradients by 0.
-                    for params in self.model.parameters():
-                        # Check for positive infinity.
-                        indices = (params.grad == float("inf"))
-                        if indices.any():
-                            self.logger.warning("Replace inf by 0.0 in the gradient of " + params)
-                            params.grad[indices] = 0.0
-                        # Check for negative infinity.
-                        indices = (params.grad == -float("inf"))
-                        if indices.any():
-                            self.logger.warning("Replace -inf by 0.0 in the gradient of " + params)
-                        params.grad[indices] = 0.0
+                if hparams.replace_inf_grads_by_zero and len(grads) > 0:
+                    # Replace inf/-inf in gradients by 0, the updates are counted on the device and logged at checks.
+                    if num_inf_updates is None:
+                        num_inf_updates = grads[0].new_zeros(1, dtype=torch.float32)
+                    self._replace_inf_grads_by_zero(grads, num_inf_updates)
 
                 # Clip gradients.
                 if hparams.grad_clip_norm_type is not None:
@@ -691,17 +859,18 @@ class ModelHandlerPyTorch(ModelHandler):
                 # Change all model weights depending on their gradient.
                 self.optimiser.step()
 
-                # Update moving average.
+                # Update moving average with the parameters of the unwrapped model.
                 if self.ema:
-                    self.ema.update_params(model)
+                    self.ema.update_params(self.model)
 
                 # Run the scheduler_type if one exists and should be called after some iterations.
                 if self.scheduler:
                     if hparams.iterations_per_scheduler_step:
+                        current_update = current_batch_index // accumulation_steps
                         if hparams.use_saved_learning_rate:
-                            current_iteration = (total_epoch - 1) * len(dataloader) + current_batch_index + 1
+                            current_iteration = (total_epoch - 1) * num_updates + current_update + 1
                         else:
-                            current_iteration = (current_epoch - 1) * len(dataloader) + current_batch_index + 1
+                            current_iteration = (current_epoch - 1) * num_updates + current_update + 1
                         if current_iteration % hparams.iterations_per_scheduler_step == 0:
                             self._scheduler_step_fn(loss.detach(), current_iteration)
                             # self.logger.info(str(self.optimiser))
@@ -745,8 +914,29 @@ class ModelHandlerPyTorch(ModelHandler):
                 current_batch = None
                 # current_batch_index = None  # This is actually unnecessary.
 
-        loss_features /= len(dataloader)
-        total_loss /= len(dataloader)
+        num_batches = len(dataloader)
+        if num_batches > 0:
+            loss_features /= num_batches
+            total_loss /= num_batches
+        if self.is_distributed():
+            # Average the losses of all processes weighted by their number of samples, each one processed a
+            # different shard of the data, which can differ in size for validation. A process with an empty
+            # validation shard contributes zeros with a weight of zero, it gets the number of features from the others.
+            device = torch.device("cuda" if hparams.use_gpu else "cpu")
+            num_features = torch.tensor([0 if loss_features is None else loss_features.numel()], device=device)
+            dist.all_reduce(num_features, op=dist.ReduceOp.MAX)
+            if loss_features is None:
+                loss_sums = torch.zeros(int(num_features) + 2, device=device)
+            else:
+                loss_sums = torch.cat((total_loss.view(1), loss_features.view(-1))) * num_samples
+                loss_sums = torch.cat((loss_sums, loss_sums.new_tensor([num_samples])))
+            dist.all_reduce(loss_sums)
+            total_loss = loss_sums[0] / loss_sums[-1]
+            loss_features = loss_sums[1:-1] / loss_sums[-1]
+        self._log_inf_grads(num_inf_updates)
+        if num_padded_frames > 0:
+            self.logger.info("Padding efficiency: {:.1%} ({} of {} input frames are not padding)."
+                             .format(num_frames / num_padded_frames, num_frames, num_padded_frames))
         if not training:
             self.logger.info('Test set: Average loss: {:.4f}, error_features:\n{})\n'.format(total_loss, loss_features.view(1, -1)))
 
@@ -760,6 +950,101 @@ class ModelHandlerPyTorch(ModelHandler):
 
         return np_total_loss, np_loss_features
 
+    @staticmethod
+    def _replace_inf_grads_by_zero(grads, num_inf_updates):
+        """
+        Replace inf/-inf in the gradients by 0.0 (NaNs are kept) and increase num_inf_updates on the device if any
+        gradient is not finite, nothing is synchronised. The check is a single multi-tensor op. The replacement is a
+        single op on all gradients flattened into one buffer, which is copied back by a single multi-tensor copy.
+        All gradients have to be on the device of num_inf_updates.
+        """
+        found_inf = torch.zeros_like(num_inf_updates)
+        torch._amp_foreach_non_finite_check_and_unscale_(grads, found_inf, torch.ones_like(num_inf_updates))
+        num_inf_updates += found_inf
+
+        flat_grads = torch._utils._flatten_dense_tensors(grads)
+        torch.nan_to_num_(flat_grads, nan=float("nan"), posinf=0.0, neginf=0.0)
+        torch._foreach_copy_(grads, torch._utils._unflatten_dense_tensors(flat_grads, grads))
+
+    def _log_inf_grads(self, num_inf_updates):
+        """Log and reset the number of updates with non-finite gradients, this waits for the device."""
+        if num_inf_updates is not None:
+            num_updates = int(num_inf_updates.item())
+            if num_updates > 0:
+                self.logger.warning("Replaced inf/-inf values in the gradients of {} updates by 0.0."
+                                    .format(num_updates))
+                num_inf_updates.zero_()
+
+    @staticmethod
+    def _copy_to_buffers(obj, buffers=None, pin_memory=False):
+        """
+        Copy all tensors in the nested dictionaries, lists, and tuples of obj to CPU. Tensors are copied into the
+        tensors at the same position in buffers if they match in shape and dtype, otherwise new (pinned) tensors are
+        allocated. Other values are deep-copied.
+        """
+        if torch.is_tensor(obj):
+            if not torch.is_tensor(buffers) or buffers.shape != obj.shape or buffers.dtype != obj.dtype:
+                buffers = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=pin_memory)
+            return buffers.copy_(obj.detach(), non_blocking=pin_memory)
+        if isinstance(obj, dict):
+            buffers = buffers if isinstance(buffers, dict) else dict()
+            return type(obj)((key, ModelHandlerPyTorch._copy_to_buffers(value, buffers.get(key), pin_memory))
+                             for key, value in obj.items())
+        if type(obj) in (list, tuple):
+            buffers = buffers if type(buffers) is type(obj) and len(buffers) == len(obj) else [None] * len(obj)
+            return type(obj)(ModelHandlerPyTorch._copy_to_buffers(value, buffer, pin_memory)
+                             for value, buffer in zip(obj, buffers))
+        return copy.deepcopy(obj)
+
+    def _get_training_state(self, buffers=None, pin_memory=False):
+        """
+        Return a CPU copy of the states of model, optimiser, and EMA model, see _set_training_state. The tensors of
+        a previous state given as buffers are overwritten in-place, so that only the first copy allocates (pinned)
+        memory. The copies to pinned memory do not block, but are ordered before any later change of the states.
+        """
+        state = (self.model.state_dict(),
+                 self.optimiser.state_dict(),
+                 self.ema.model.state_dict() if self.ema else None)
+        return self._copy_to_buffers(state, buffers, pin_memory)
+
+    def _set_training_state(self, state):
+        """
+        Restore the states of model, optimiser, and EMA model returned by _get_training_state. The optimiser can keep
+        references to the CPU tensors of state, so state must not be used as buffers of _get_training_state anymore.
+        """
+        model_state, optimiser_state, ema_state = state
+        self.model.load_state_dict(model_state)
+        self.optimiser.load_state_dict(optimiser_state)
+        if ema_state is not None:
+            self.ema.model.load_state_dict(ema_state)  # Copies in-place, so the EMA shadow stays valid.
+
+    def _get_parallel_model(self, model, hparams, training):
+        """
+        Return the model wrapped in DistributedDataParallel (training only) or DataParallel when multiple devices
+        are used, otherwise the model itself. The wrapper is reused as long as the model does not change.
+        """
+        if self.is_distributed():
+            if not training:
+                return model  # Each process validates its shard, there are no gradients to synchronise.
+            wrapper_type = DistributedDataParallel
+        elif hparams.num_gpus > 1:
+            wrapper_type = DataParallel
+        else:
+            return model
+
+        if type(self._parallel_model) is not wrapper_type or self._parallel_model.module is not model:
+            if wrapper_type is DistributedDataParallel:
+                # Also broadcasts the parameters of rank 0 to all processes.
+                self._parallel_model = DistributedDataParallel(
+                    model, device_ids=[torch.cuda.current_device()] if hparams.use_gpu else None,
+                    dim=0 if hparams.batch_first else 1)
+            else:
+                self._parallel_model = DataParallel(model, dim=0 if hparams.batch_first else 1)
+            # Make the init_hidden method directly accessible.
+            self._parallel_model.init_hidden = self._parallel_model.module.init_hidden
+
+        return self._parallel_model
+
     def test(self, hparams, total_epoch, current_epoch, loss_function):
         if hparams.use_gpu:
             assert (hparams.num_gpus <= torch.cuda.device_count())  # Specified number of GPUs is incorrect.
@@ -775,10 +1060,18 @@ class ModelHandlerPyTorch(ModelHandler):
         if hparams.use_gpu:
             assert (hparams.num_gpus <= torch.cuda.device_count())  # Specified number of GPUs is incorrect.
 
+        for dataloader_sampler in (self.dataloader_train.sampler, self.dataloader_train.batch_sampler):
+            if isinstance(dataloader_sampler, (DistributedSampler, LengthBucketBatchSampler)):
+                dataloader_sampler.set_epoch(total_epoch)  # Shuffle differently in each epoch, also when resumed.
+        if self.is_distributed():
+            # Synchronise the parameters of all processes before the averaged model copies them.
+            self._get_parallel_model(self.model, hparams, training=True)
+
         if hparams.ema_decay and not self.ema:
-            average_model = ModelFactory.create(self.model_type, self.dim_in, self.dim_out, hparams)
-            average_model.load_state_dict(self.model.state_dict())
-            self.ema = ExponentialMovingAverage(average_model, hparams.ema_decay)
+            # Copy the model instead of creating and loading a new one, this also keeps it on the same device.
+            average_model = copy.deepcopy(self.model)
+            self.ema = ExponentialMovingAverage(average_model, hparams.ema_decay,
+                                                getattr(hparams, "ema_update_interval", 1))
 
         return self.process_dataloader(self.dataloader_train,
                                        loss_function,
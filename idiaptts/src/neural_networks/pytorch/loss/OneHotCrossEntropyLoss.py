@@ -15,9 +15,14 @@ class OneHotCrossEntropyLoss(torch.nn.CrossEntropyLoss):
 
     def forward(self, input, target):
 
-        # Convert one hot vector to index tensor.
-        # (B x C x T) -> (B x T)
-        _, targets = target.max(dim=1)
+        if target.is_floating_point():
+            # Convert one hot vector to index tensor.
+            # (B x C x T) -> (B x T)
+            _, targets = target.max(dim=1)
+        else:
+            # Target contains class indices already.
+            # (B x 1 x T) -> (B x T)
+            targets = target.squeeze(1).long()
 
         if self.shift is not None:
             input = input[..., :-self.shift]
@@ -14,6 +14,35 @@ import numpy as np
 from idiaptts.misc.utils import parse_int_set
 
 
+class SparseInputLinear(nn.Linear):
+    """
+    Linear layer for sparse inputs as created by QuestionLabelGen.preprocess_sparse_sample. Each input frame contains
+    num_continuous dense features followed by num_active indices and num_active values of the non-zero binary inputs.
+    The weights are the same as of an nn.Linear(num_binary + num_continuous, out_features) on the dense input, the
+    binary part is computed as a weighted embedding bag sum over the active columns only.
+    """
+
+    def __init__(self, num_binary, num_continuous, num_active, out_features, bias=True):
+        super().__init__(num_binary + num_continuous, out_features, bias)
+        self.num_binary = num_binary
+        self.num_continuous = num_continuous
+        self.num_active = num_active
+
+    def forward(self, input):
+        input_continuous = input[..., :self.num_continuous]
+        indices = input[..., self.num_continuous:self.num_continuous + self.num_active].long()
+        values = input[..., self.num_continuous + self.num_active:]
+
+        output = F.linear(input_continuous, self.weight[:, self.num_binary:], self.bias)
+        output_binary = F.embedding_bag(indices.reshape(-1, self.num_active), self.weight[:, :self.num_binary].t(),
+                                        per_sample_weights=values.reshape(-1, self.num_active), mode='sum')
+        return output + output_binary.view(output.shape)
+
+    def extra_repr(self):
+        return "num_binary={}, num_continuous={}, num_active={}, out_features={}, bias={}".format(
+            self.num_binary, self.num_continuous, self.num_active, self.out_features, self.bias is not None)
+
+
 class RNNDyn(nn.Module):
     IDENTIFIER = "RNNDYN"
 
@@ -93,6 +122,10 @@ class RNNDyn(nn.Module):
                                   RNNDyn-4_RELU_256-1_FC_10,
                                   RNNDyn-2_TANH_512-2_GRU_63-1_FC_2
                                   RNNDyn-1_LSTM_32-1_RELU_63
+                                  RNNDyn-2_SparseRELU_1024_373_32-3_BiGRU_512-1_FC_67
+                        The Sparse prefix makes the first layer a SparseInputLinear for sparse question labels with
+                        the given number of binary questions (373) and active slots (32), see
+                        QuestionLabelGen.preprocess_sparse_sample. It is only allowed in the first group.
         :param hidden_init:       Float, value used to initialize the hidden states in RNNs
         :param train_hidden_init: Boolean, True if the initial hidden state value can be trained along with the network
         :return:        Nothing
@@ -122,6 +155,13 @@ class RNNDyn(nn.Module):
             if 'Bi' == layer_type[:2]:
                 bidirectional = True
                 layer_type = layer_type[2:]
+            sparse_input = False
+            if 'Sparse' == layer_type[:6]:
+                if layer_idx > 0 or len(self.emb_groups) > 0 or layer_type[6:] not in self.nonlin_options:
+                    raise ValueError("Sparse input is only supported for a non-recurrent first layer without "
+                                     "embeddings, but got {}.".format(group))
+                sparse_input = True
+                layer_type = layer_type[6:]
 
             # First process embeddings.
             if layer_type == "EMB":
@@ -198,7 +238,13 @@ class RNNDyn(nn.Module):
                     # Add requested number of layers.
                     for i in range(layer_group.n_layers):
                         out_dim = group_out_dim
-                        layer_group.append(nn_layer(in_dim, out_dim))
+                        if sparse_input and i == 0:
+                            num_binary = int(group_attr[3])
+                            num_active = int(group_attr[4])
+                            layer_group.append(SparseInputLinear(num_binary, in_dim - 2 * num_active, num_active,
+                                                                 out_dim))
+                        else:
+                            layer_group.append(nn_layer(in_dim, out_dim))
                         in_dim = out_dim  # Next in_dim is the current out_dim.
 
                 layer_group.out_dim = out_dim
@@ -11,6 +11,7 @@ from operator import mul
 from functools import reduce
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 # Third-party imports.
 from wavenet_vocoder import WaveNet
@@ -27,6 +28,17 @@ class WaveNetWrapper(nn.Module):
         super().__init__()
 
         self.len_in_out_multiplier = hparams.len_in_out_multiplier
+        self.out_channels = hparams.out_channels
+
+        # Upsampling of frame rate conditioning features to the audio rate inside the model.
+        self.cond_upsampling = getattr(hparams, "cond_upsampling", "loader")
+        if self.cond_upsampling not in ["loader", "linear", "repeat"]:
+            raise ValueError("Unknown conditioning upsampling {}, use loader, linear, or repeat."
+                             .format(self.cond_upsampling))
+        if self.cond_upsampling != "loader":
+            self.cond_in_to_out_multiplier = int(hparams.frame_rate_output_Hz / (1000.0 / hparams.frame_size_ms))
+        else:
+            self.cond_in_to_out_multiplier = 1
 
         # Use the wavenet_vocoder builder to create the model.
         self.model = WaveNet(out_channels=hparams.out_channels,
@@ -48,9 +60,39 @@ class WaveNetWrapper(nn.Module):
                              use_speaker_embedding=hparams.use_speaker_embedding,
                              )
 
+    def upsample_conditioning(self, inputs, seq_lengths_inputs):
+        """
+        Upsample frame rate conditioning features (B x C x T) by self.cond_in_to_out_multiplier in time.
+        Linear interpolation gives the same result as idiaptts.misc.utils.sample_linearly on each unpadded sample,
+        padded frames stay zero.
+        """
+        multiplier = self.cond_in_to_out_multiplier
+        if inputs is None or multiplier == 1:
+            return inputs
+
+        if self.cond_upsampling == "repeat":
+            return inputs.repeat_interleave(multiplier, dim=2)
+
+        max_length = inputs.shape[2]
+        if (seq_lengths_inputs == max_length).all():
+            return F.interpolate(inputs, size=max_length * multiplier, mode="linear", align_corners=True)
+
+        output = inputs.new_zeros((*inputs.shape[:2], max_length * multiplier))
+        for batch_index, length in enumerate(seq_lengths_inputs.tolist()):
+            output[batch_index, :, :length * multiplier] = F.interpolate(inputs[batch_index:batch_index + 1, :, :length],
+                                                                         size=length * multiplier,
+                                                                         mode="linear",
+                                                                         align_corners=True)[0]
+        return output
+
     def forward(self, inputs, hidden, seq_lengths_inputs, max_length_inputs, target=None, seq_lengths_target=None):
 
+        inputs = self.upsample_conditioning(inputs, seq_lengths_inputs)
+
         if target is not None:  # During training and testing with teacher forcing.
+            if not target.is_floating_point():
+                # Convert class indices to one hot vectors on the device: (B x 1 x T) -> (B x C x T).
+                target = F.one_hot(target.squeeze(1).long(), self.out_channels).transpose(1, 2).float()
             output = self.model(target, c=inputs, g=None, softmax=False)
             # output = self.model(target, c=inputs[:, :, :target.shape[2]], g=None, softmax=False)
             # Output shape is B x C x T. Don't permute here because CrossEntropyLoss requires the same shape.
@@ -58,7 +100,7 @@ class WaveNetWrapper(nn.Module):
             with torch.no_grad():
                 self.model.make_generation_fast_()
                 assert(len(seq_lengths_inputs) == 1), "Batch synthesis is not supported yet."
-                num_frames_to_gen = seq_lengths_inputs[0] * self.len_in_out_multiplier
+                num_frames_to_gen = seq_lengths_inputs[0] * self.cond_in_to_out_multiplier * self.len_in_out_multiplier
                 output = self.model.incremental_forward(c=inputs, T=num_frames_to_gen, softmax=True, quantize=True)
                 # Output shape is B x C x T.
 
@@ -248,6 +248,16 @@ class TestWorldFeatLabelGen(unittest.TestCase):
         sample = generator[self.id_list[0]]
         self.assertEqual(20 + 3, sample.shape[1])
 
+    def test_getitem_range(self):
+        for add_deltas in [True, False]:
+            generator = WorldFeatLabelGen(self.dir_world_features, add_deltas=add_deltas, num_coded_sps=20)
+            generator.get_normalisation_params(self.dir_world_features)
+            sample = generator[self.id_list[0]]
+
+            self.assertEqual(len(sample), generator.get_length(self.id_list[0]))
+            numpy.testing.assert_array_equal(sample[10:60], generator.getitem_range(self.id_list[0], 10, 50))
+            numpy.testing.assert_array_equal(sample[-5:], generator.getitem_range(self.id_list[0], len(sample) - 5, 50))
+
     def test_pre_and_post_processing(self):
         generator = WorldFeatLabelGen(self.dir_world_features, add_deltas=True, num_coded_sps=20)
         generator.get_normalisation_params(self.dir_world_features)
@@ -492,6 +502,119 @@ class TestWorldFeatLabelGen(unittest.TestCase):
 
                 shutil.rmtree(out_dir)
 
+    def test_gen_data_packed(self):
+        out_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), type(self).__name__)
+        makedirs_safe(out_dir)
+
+        for add_deltas in [True, False]:
+            generator = WorldFeatLabelGen(out_dir, add_deltas=add_deltas, num_coded_sps=20)
+            generator.gen_data(dir_in=self.dir_wav, dir_out=out_dir, file_id_list="test_id_list",
+                               id_list=self.id_list, save_packed=True)
+            generator.get_normalisation_params(out_dir, "test_id_list")
+
+            packed_generator = WorldFeatLabelGen(out_dir, add_deltas=add_deltas, num_coded_sps=20, load_packed=True)
+            packed_generator.get_normalisation_params(out_dir, "test_id_list")
+            self.assertEqual(len(self.id_list), len(packed_generator.get_packed_store()))
+
+            for id_name in self.id_list:
+                numpy.testing.assert_array_equal(generator[id_name], packed_generator[id_name],
+                                                 err_msg="Packed sample of {} differs for add_deltas={}."
+                                                         .format(id_name, add_deltas))
+
+        shutil.rmtree(out_dir)
+
+    def test_gen_data_num_workers(self):
+        out_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), type(self).__name__)
+        makedirs_safe(out_dir)
+
+        for add_deltas in [True, False]:
+            generator = WorldFeatLabelGen(out_dir, add_deltas=add_deltas, num_coded_sps=20)
+            label_dict, *norm_params = generator.gen_data(dir_in=self.dir_wav, dir_out=out_dir,
+                                                          file_id_list="test_id_list", id_list=self.id_list,
+                                                          return_dict=True)
+            label_dict_parallel, *norm_params_parallel = generator.gen_data(dir_in=self.dir_wav, dir_out=out_dir,
+                                                                            file_id_list="test_id_list",
+                                                                            id_list=self.id_list,
+                                                                            return_dict=True, num_workers=2)
+
+            self.assertEqual(list(label_dict.keys()), list(label_dict_parallel.keys()))
+            for id_name in self.id_list:
+                numpy.testing.assert_array_equal(label_dict[id_name], label_dict_parallel[id_name])
+            for params, params_parallel in zip(norm_params, norm_params_parallel):
+                for param, param_parallel in zip(params, params_parallel):
+                    numpy.testing.assert_array_equal(param, param_parallel,
+                                                     err_msg="Normalisation parameters of parallel run differ for "
+                                                             "add_deltas={}.".format(add_deltas))
+
+        shutil.rmtree(out_dir)
+
+    def test_gen_data_incremental(self):
+        out_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), type(self).__name__)
+        out_dir_incremental = os.path.join(out_dir, "incremental")
+        makedirs_safe(out_dir_incremental)
+
+        for add_deltas in [True, False]:
+            generator = WorldFeatLabelGen(out_dir, add_deltas=add_deltas, num_coded_sps=20)
+            label_dict, *norm_params = generator.gen_data(dir_in=self.dir_wav, dir_out=out_dir,
+                                                          file_id_list="test_id_list", id_list=self.id_list,
+                                                          return_dict=True)
+
+            # Extract a subset first, then extend it to the full list.
+            generator = WorldFeatLabelGen(out_dir_incremental, add_deltas=add_deltas, num_coded_sps=20)
+            generator.gen_data(dir_in=self.dir_wav, dir_out=out_dir_incremental, file_id_list="test_id_list",
+                               id_list=self.id_list[:3], incremental=True)
+            label_dict_incremental, *norm_params_incremental = generator.gen_data(
+                dir_in=self.dir_wav, dir_out=out_dir_incremental, file_id_list="test_id_list", id_list=self.id_list,
+                return_dict=True, incremental=True)
+
+            for id_name in self.id_list:
+                numpy.testing.assert_array_equal(label_dict[id_name], label_dict_incremental[id_name])
+            for params, params_incremental in zip(norm_params, norm_params_incremental):
+                for param, param_incremental in zip(params, params_incremental):
+                    numpy.testing.assert_allclose(param, param_incremental, rtol=1e-3, atol=1e-6,
+                                                  err_msg="Normalisation parameters of incremental run differ for "
+                                                          "add_deltas={}.".format(add_deltas))
+
+        shutil.rmtree(out_dir)
+
+    def test_gen_data_incremental_partial(self):
+        out_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), type(self).__name__)
+        out_dir_incremental = os.path.join(out_dir, "incremental")
+        makedirs_safe(out_dir_incremental)
+
+        generator = WorldFeatLabelGen(out_dir, num_coded_sps=20, load_bap=False)
+        label_dict, *norm_params = generator.gen_data(dir_in=self.dir_wav, dir_out=out_dir,
+                                                      file_id_list="test_id_list", id_list=self.id_list,
+                                                      return_dict=True)
+
+        generator = WorldFeatLabelGen(out_dir_incremental, num_coded_sps=20, load_bap=False)
+        generator.gen_data(dir_in=self.dir_wav, dir_out=out_dir_incremental, file_id_list="test_id_list",
+                           id_list=self.id_list[:2], incremental=True)
+        # The statistics of the previous run are reused instead of being rebuilt from the saved features.
+        all_stats_ids = list()
+        load_incremental_normalisers = generator._load_incremental_normalisers
+
+        def _load_incremental_normalisers(*args):
+            normalisers, stats_ids = load_incremental_normalisers(*args)
+            all_stats_ids.append(stats_ids)
+            return normalisers, stats_ids
+        generator._load_incremental_normalisers = _load_incremental_normalisers
+        label_dict_incremental, *norm_params_incremental = generator.gen_data(
+            dir_in=self.dir_wav, dir_out=out_dir_incremental, file_id_list="test_id_list", id_list=self.id_list,
+            return_dict=True, incremental=True)
+
+        self.assertEqual([set(self.id_list[:2])], all_stats_ids)
+        for id_name in self.id_list:
+            numpy.testing.assert_array_equal(label_dict[id_name], label_dict_incremental[id_name])
+        for params, params_incremental in zip(norm_params, norm_params_incremental):
+            if params is None:
+                self.assertIsNone(params_incremental)
+                continue
+            for param, param_incremental in zip(params, params_incremental):
+                numpy.testing.assert_allclose(param, param_incremental, rtol=1e-3, atol=1e-6)
+
+        shutil.rmtree(out_dir)
+
     def test_extract_and_combine(self):
         """
         Extract features with two disjoint id lists and combine stats afterwards
@@ -114,6 +114,48 @@ class TestWaveNetVocoderTrainer(unittest.TestCase):
 
         shutil.rmtree(hparams.out_dir)
 
+    def test_train_index_targets(self):
+        hparams = self._get_hparams()
+        hparams.out_dir = os.path.join(hparams.out_dir, "test_train_index_targets")  # Add function name to path.
+        hparams.seed = 1
+        hparams.use_best_as_final_model = False
+        hparams.index_targets = True
+
+        trainer = WaveNetVocoderTrainer(self.dir_world_features, self.id_list, hparams)
+        inputs, targets = trainer.dataset_train[0]
+        self.assertEqual(numpy.uint8, targets.dtype)
+        self.assertEqual(1, targets.shape[1])
+
+        trainer.init(hparams)
+        _, all_loss_train, _ = trainer.train(hparams)
+
+        # Training loss decreases?
+        self.assertLess(all_loss_train[-1], all_loss_train[1 if hparams.start_with_test else 0],
+                        msg="Loss did not decrease over {} epochs".format(hparams.epochs))
+
+        shutil.rmtree(hparams.out_dir)
+
+    def test_train_cond_upsampling_in_model(self):
+        hparams = self._get_hparams()
+        hparams.out_dir = os.path.join(hparams.out_dir, "test_train_cond_upsampling_in_model")  # Add function name to path.
+        hparams.seed = 1
+        hparams.use_best_as_final_model = False
+        hparams.cond_upsampling = "linear"
+
+        trainer = WaveNetVocoderTrainer(self.dir_world_features, self.id_list, hparams)
+        inputs, targets = trainer.dataset_train[0]
+        in_to_out_multiplier = int(hparams.frame_rate_output_Hz / (1000.0 / hparams.frame_size_ms))
+        self.assertEqual(len(inputs) * in_to_out_multiplier, len(targets))
+
+        trainer.init(hparams)
+        _, all_loss_train, _ = trainer.train(hparams)
+
+        # Training loss decreases?
+        self.assertLess(all_loss_train[-1], all_loss_train[1 if hparams.start_with_test else 0],
+                        msg="Loss did not decrease over {} epochs".format(hparams.epochs))
+
+        shutil.rmtree(hparams.out_dir)
+
     @staticmethod
     def trimming_batch_collate_fn(batch, common_divisor=1, batch_first=False, use_cond=True, one_hot_target=True):
         """A function that trims the inputs so that auto-regressive synthesis is fast for the test case."""
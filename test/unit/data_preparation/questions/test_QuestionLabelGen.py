@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import os
+import shutil
+import numpy
+
+from idiaptts.src.data_preparation.questions.QuestionLabelGen import QuestionLabelGen
+
+
+class TestQuestionLabelGen(unittest.TestCase):
+
+    num_questions = 409
+    num_binary_questions = 373
+    id_name = "LJ001-0001"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir_questions = os.path.join("integration", "fixtures", "questions")
+        cls.dir_out = os.path.join(os.path.dirname(os.path.realpath(__file__)), cls.__name__)
+
+    def setUp(self):
+        os.makedirs(self.dir_out, exist_ok=True)
+        self.sample = QuestionLabelGen.load_sample(self.id_name, self.dir_questions, self.num_questions)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_out)
+
+    def test_pack_sample(self):
+        packed_questions, continuous_questions = QuestionLabelGen.pack_sample(self.sample, self.num_binary_questions)
+
+        self.assertEqual(numpy.uint8, packed_questions.dtype)
+        self.assertEqual((len(self.sample), 47), packed_questions.shape)
+        self.assertEqual((len(self.sample), self.num_questions - self.num_binary_questions), continuous_questions.shape)
+        numpy.testing.assert_array_equal(self.sample, QuestionLabelGen.unpack_sample(packed_questions,
+                                                                                     continuous_questions,
+                                                                                     self.num_binary_questions))
+        with self.assertRaises(ValueError):
+            QuestionLabelGen.pack_sample(self.sample, self.num_binary_questions + 1)  # Includes a continuous question.
+
+    def test_save_load_packed_sample(self):
+        QuestionLabelGen.save_packed_sample(self.sample,
+                                            os.path.join(self.dir_out, self.id_name + QuestionLabelGen.ext_question_packed),
+                                            self.num_binary_questions)
+
+        sample = QuestionLabelGen.load_sample(self.id_name, self.dir_out, self.num_questions, self.num_binary_questions)
+        numpy.testing.assert_array_equal(self.sample, sample)
+
+        label_gen = QuestionLabelGen(self.dir_out, self.num_questions, self.num_binary_questions)
+        self.assertEqual(len(self.sample), label_gen.get_length(self.id_name))
+
+    def test_preprocess_packed_sample(self):
+        label_gen = QuestionLabelGen(self.dir_out, self.num_questions, self.num_binary_questions)
+        norm_params = (self.sample.min(axis=0).astype(numpy.float64), self.sample.max(axis=0).astype(numpy.float64))
+        packed_questions, continuous_questions = QuestionLabelGen.pack_sample(self.sample, self.num_binary_questions)
+
+        expected = label_gen.preprocess_sample(self.sample, norm_params)
+        sample = label_gen.preprocess_packed_sample(packed_questions, continuous_questions, norm_params)
+
+        self.assertEqual(numpy.float32, sample.dtype)
+        numpy.testing.assert_array_equal(expected, sample)
+
+    def test_preprocess_sparse_sample(self):
+        num_active = 16
+        label_gen = QuestionLabelGen(self.dir_out, self.num_questions, self.num_binary_questions,
+                                     sparse_num_active=num_active)
+        norm_params = (self.sample.min(axis=0).astype(numpy.float64), self.sample.max(axis=0).astype(numpy.float64))
+        packed_questions, continuous_questions = QuestionLabelGen.pack_sample(self.sample, self.num_binary_questions)
+
+        dense = label_gen.preprocess_packed_sample(packed_questions, continuous_questions, norm_params)
+        sample = label_gen.preprocess_sparse_sample(packed_questions, continuous_questions, num_active, norm_params)
+
+        num_continuous = self.num_questions - self.num_binary_questions
+        self.assertEqual((len(self.sample), num_continuous + 2 * num_active), sample.shape)
+        numpy.testing.assert_array_equal(dense[:, self.num_binary_questions:], sample[:, :num_continuous])
+        binary_questions = numpy.zeros((len(self.sample), self.num_binary_questions), dtype=numpy.float32)
+        for frame, (indices, values) in enumerate(zip(sample[:, num_continuous:num_continuous + num_active],
+                                                      sample[:, num_continuous + num_active:])):
+            numpy.add.at(binary_questions[frame], indices.astype(int), values)
+        numpy.testing.assert_array_equal(dense[:, :self.num_binary_questions], binary_questions)
+
+        with self.assertRaises(ValueError):
+            label_gen.preprocess_sparse_sample(packed_questions, continuous_questions, 1, norm_params)
@@ -0,0 +1,138 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import os
+import random
+import shutil
+import numpy
+
+from idiaptts.src.data_preparation.questions.label_normalisation import HTSLabelNormalisation, QuestionSet
+
+
+class TestHTSLabelNormalisation(unittest.TestCase):
+
+    label = "x^x-pau+ae=l@x_x/A:0_0_0/B:x-x-x@x-x&x-x#x-x$x-x!x-x;x-x|x/C:1+1+2/D:0_0/E:x+x@x+x&x+x#x+x/F:content_2" \
+            "/G:0_0/H:x=x@1=2|0/I:5=4/J:14+9-2[2]"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.file_questions = os.path.join("integration", "fixtures", "questions-en-radio_dnn_400.hed")
+        cls.label_normaliser = HTSLabelNormalisation(cls.file_questions)
+        cls.dir_out = os.path.join(os.path.dirname(os.path.realpath(__file__)), cls.__name__)
+
+    def setUp(self):
+        os.makedirs(self.dir_out, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_out)
+
+    def _write_state_aligned_label(self, frames_per_state):
+        file_name = os.path.join(self.dir_out, "test.lab")
+        with open(file_name, "w") as f:
+            start_time = 0
+            for state_index, num_frames in enumerate(frames_per_state):
+                end_time = start_time + num_frames * 50000
+                f.write("{} {} {}[{}]\n".format(start_time, end_time, self.label, state_index % 5 + 2))
+                start_time = end_time
+        return file_name
+
+    def _pattern_matching_regex(self, label):
+        """Evaluate the questions with their regular expressions one by one."""
+        discrete_dict = self.label_normaliser.discrete_dict
+        binary_vector = numpy.zeros((1, len(discrete_dict)))
+        for index in range(len(discrete_dict)):
+            binary_vector[0, index] = any(regex.search(label) for regex in discrete_dict[str(index)])
+        return binary_vector
+
+    def test_pattern_matching_binary(self):
+        with open(self.file_questions) as f:
+            literals = [pattern.strip('*') for line in f if line.startswith("QS")
+                        for pattern in line.split('{')[1].split('}')[0].split(',')]
+        random.seed(1)
+        labels = [self.label]
+        for _ in range(500):
+            labels.append("".join(random.choice(literals) if random.random() < 0.7 else random.choice("x0-+/:_")
+                                  for _ in range(random.randint(1, 15))))
+
+        for label in labels:
+            numpy.testing.assert_array_equal(self._pattern_matching_regex(label),
+                                             self.label_normaliser.pattern_matching_binary(label),
+                                             err_msg="Question mismatch for label {}.".format(label))
+
+    def test_get_label_vector(self):
+        label_vector = self.label_normaliser.get_label_vector(self.label)
+
+        self.assertEqual((1, self.label_normaliser.dict_size), label_vector.shape)
+        numpy.testing.assert_array_equal(self._pattern_matching_regex(self.label),
+                                         label_vector[:, :len(self.label_normaliser.discrete_dict)])
+        self.assertIs(label_vector, self.label_normaliser.get_label_vector(self.label))  # Second call is memoised.
+
+    def test_load_labels_with_state_alignment(self):
+        frames_per_state = [2, 1, 3, 1, 4, 1, 1, 2, 5, 1]
+        file_name = self._write_state_aligned_label(frames_per_state)
+        out_file_name = os.path.join(self.dir_out, "test.questions")
+
+        labels = self.label_normaliser.load_labels_with_state_alignment(file_name)
+        num_open_files = len(os.listdir("/proc/self/fd"))
+        labels_memmap = self.label_normaliser.load_labels_with_state_alignment(file_name, out_file_name=out_file_name)
+        self.assertEqual(num_open_files, len(os.listdir("/proc/self/fd")))
+
+        self.assertEqual((sum(frames_per_state), self.label_normaliser.dimension), labels.shape)
+        self.assertEqual(numpy.float32, labels.dtype)
+        numpy.testing.assert_array_equal(labels, labels_memmap)
+        self.assertNotIsInstance(labels_memmap, numpy.memmap)
+        labels_memmap[:] = -1.0  # Returned labels are in-memory copies, changing them does not change the file.
+        labels_file = numpy.fromfile(out_file_name, dtype=numpy.float32).reshape(labels.shape)
+        numpy.testing.assert_array_equal(labels, labels_file)
+        # Fraction through the first state (forwards).
+        numpy.testing.assert_array_equal([0.5, 1.0], labels[:2, self.label_normaliser.dict_size])
+
+    def test_question_set_save_load(self):
+        file_question_set = os.path.join(self.dir_out, "questions." + QuestionSet.ext)
+        self.label_normaliser.question_set.save(file_question_set)
+
+        label_normaliser = HTSLabelNormalisation(file_question_set)
+        self.assertEqual(self.label_normaliser.dimension, label_normaliser.dimension)
+        numpy.testing.assert_array_equal(self.label_normaliser.get_label_vector(self.label),
+                                         label_normaliser.get_label_vector(self.label))
+
+    def test_perform_normalisation_num_workers(self):
+        dir_labels = os.path.join(self.dir_out, "labels")
+        os.makedirs(dir_labels)
+        id_list = ["utt{}".format(index) for index in range(4)]
+        for index, id_name in enumerate(id_list):
+            shutil.move(self._write_state_aligned_label(range(1, 5 * index + 6)),
+                        os.path.join(dir_labels, id_name + HTSLabelNormalisation.htk_label_extension))
+
+        dir_serial = os.path.join(self.dir_out, "serial")
+        dir_parallel = os.path.join(self.dir_out, "parallel")
+        os.makedirs(dir_serial)
+        os.makedirs(dir_parallel)
+        labels_serial, norm_params_serial = self.label_normaliser.perform_normalisation(
+            "file_id_list.txt", id_list, dir_labels, dir_serial, return_dict=True)
+        labels_parallel, norm_params_parallel = self.label_normaliser.perform_normalisation(
+            "file_id_list.txt", id_list, dir_labels, dir_parallel, return_dict=True, num_workers=2)
+
+        self.assertEqual(list(labels_serial.keys()), list(labels_parallel.keys()))
+        for id_name in id_list:
+            numpy.testing.assert_array_equal(labels_serial[id_name], labels_parallel[id_name])
+        for params_serial, params_parallel in zip(norm_params_serial, norm_params_parallel):
+            numpy.testing.assert_array_equal(params_serial, params_parallel)
+
+    def test_expand_state_labels(self):
+        file_name = self._write_state_aligned_label([2, 1, 3, 1, 4, 1, 1, 2, 5, 1])
+        for subphone_feats in ["full", "minimal_frame", "none"]:
+            label_normaliser = HTSLabelNormalisation(self.file_questions, subphone_feats=subphone_feats)
+
+            labels = label_normaliser.load_labels_with_state_alignment(file_name)
+            state_labels = label_normaliser.load_state_labels_with_state_alignment(file_name)
+
+            self.assertEqual((10, label_normaliser.dict_size + HTSLabelNormalisation.num_state_info),
+                             state_labels.shape)
+            numpy.testing.assert_array_equal(labels, HTSLabelNormalisation.expand_state_labels(state_labels,
+                                                                                             subphone_feats))
@@ -0,0 +1,76 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import os
+import shutil
+import numpy
+
+from idiaptts.src.data_preparation.CompiledDataset import CompiledDataset
+from idiaptts.src.data_preparation.PyTorchLabelGensDataset import PyTorchLabelGensDataset
+from idiaptts.src.data_preparation.questions.QuestionLabelGen import QuestionLabelGen
+
+
+class TestCompiledDataset(unittest.TestCase):
+
+    num_questions = 409
+    id_list = ["LJ001-000{}".format(index) for index in range(1, 6)]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir_questions = os.path.join("integration", "fixtures", "questions")
+        cls.dir_out = os.path.join(os.path.dirname(os.path.realpath(__file__)), cls.__name__)
+
+    def setUp(self):
+        os.makedirs(self.dir_out, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_out)
+
+    def _get_dataset(self, samples_max=1.0):
+        label_gen_in = QuestionLabelGen(self.dir_questions, self.num_questions)
+        label_gen_in.norm_params = (numpy.zeros(self.num_questions), numpy.full(self.num_questions, samples_max))
+        label_gen_out = QuestionLabelGen(self.dir_questions, self.num_questions)
+        label_gen_out.norm_params = (numpy.zeros(self.num_questions), numpy.full(self.num_questions, 2.0))
+        return PyTorchLabelGensDataset(self.id_list, label_gen_in, label_gen_out, None, match_lengths=True)
+
+    def test_compile(self):
+        dataset = self._get_dataset()
+        compiled_dataset = CompiledDataset(dataset, self.dir_out)
+
+        self.assertEqual(len(dataset), len(compiled_dataset))
+        self.assertEqual(dataset.get_dims(), compiled_dataset.get_dims())
+        for index in range(len(dataset)):
+            for expected, labels in zip(dataset[index], compiled_dataset[index]):
+                numpy.testing.assert_array_equal(expected, labels)
+        numpy.testing.assert_array_equal(dataset.get_lengths(), compiled_dataset.get_lengths())
+
+        dataset.id_list = list()
+        with self.assertRaises(ValueError):
+            CompiledDataset(dataset, os.path.join(self.dir_out, "empty"))
+
+    def test_fingerprint(self):
+        compiled_dataset = CompiledDataset(self._get_dataset(), self.dir_out)
+        path_meta = os.path.join(self.dir_out, CompiledDataset.file_name_meta)
+        mtime = os.stat(path_meta).st_mtime_ns
+
+        # Same settings reuse the compiled samples.
+        self.assertEqual(compiled_dataset.fingerprint, CompiledDataset(self._get_dataset(), self.dir_out).fingerprint)
+        self.assertEqual(mtime, os.stat(path_meta).st_mtime_ns)
+        CompiledDataset(self._get_dataset(), self.dir_out, allow_compile=False)
+
+        # Other processes of distributed training only open an up-to-date compilation.
+        with self.assertRaises(ValueError):
+            CompiledDataset(self._get_dataset(samples_max=2.0), self.dir_out, allow_compile=False)
+        self.assertEqual(mtime, os.stat(path_meta).st_mtime_ns)
+
+        # Changed normalisation parameters compile the samples again.
+        dataset = self._get_dataset(samples_max=2.0)
+        fingerprint = compiled_dataset.fingerprint
+        compiled_dataset = CompiledDataset(dataset, self.dir_out)
+        self.assertNotEqual(fingerprint, compiled_dataset.fingerprint)
+        numpy.testing.assert_array_equal(dataset[0][0], compiled_dataset[0][0])
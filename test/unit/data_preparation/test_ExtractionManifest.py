@@ -0,0 +1,62 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from idiaptts.src.data_preparation.ExtractionManifest import ExtractionManifest
+
+
+class TestExtractionManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_tmp = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.dir_tmp, "source.wav")
+        with open(self.source_path, "w") as f:
+            f.write("audio")
+        with open(os.path.join(self.dir_tmp, "output.cmp"), "w") as f:
+            f.write("features")
+        self.manifest_path = os.path.join(self.dir_tmp, "test." + ExtractionManifest.ext)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_tmp)
+
+    def test_up_to_date(self):
+        params = {"sp_type": "mcep", "num_coded_sps": 20}
+        manifest = ExtractionManifest(self.manifest_path, params)
+        self.assertFalse(manifest.is_up_to_date("source", self.source_path, self.dir_tmp))
+
+        manifest.set_entry("source", self.source_path, ["output.cmp"], dims=[60, 3, 1, 3])
+        manifest.stats_ids = ["source"]
+        manifest.save()
+
+        manifest = ExtractionManifest(self.manifest_path, params)
+        self.assertTrue(manifest.is_up_to_date("source", self.source_path, self.dir_tmp))
+        self.assertEqual([60, 3, 1, 3], manifest.get_entry("source")["dims"])
+        self.assertEqual(["source"], manifest.stats_ids)
+
+        # Changed source file.
+        with open(self.source_path, "a") as f:
+            f.write("more audio")
+        self.assertFalse(manifest.is_up_to_date("source", self.source_path, self.dir_tmp))
+
+    def test_missing_output(self):
+        manifest = ExtractionManifest(self.manifest_path, {})
+        manifest.set_entry("source", self.source_path, ["output.cmp", "missing.lf0"])
+        self.assertFalse(manifest.is_up_to_date("source", self.source_path, self.dir_tmp))
+
+    def test_changed_params(self):
+        manifest = ExtractionManifest(self.manifest_path, {"num_coded_sps": 20})
+        manifest.set_entry("source", self.source_path, ["output.cmp"])
+        manifest.stats_ids = ["source"]
+        manifest.save()
+
+        manifest = ExtractionManifest(self.manifest_path, {"num_coded_sps": 60})
+        self.assertEqual(0, len(manifest))
+        self.assertIsNone(manifest.stats_ids)
@@ -0,0 +1,91 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import os
+import shutil
+import numpy
+
+from idiaptts.src.data_preparation.FeatureCodec import FeatureCodec
+from idiaptts.src.data_preparation.questions.QuestionLabelGen import QuestionLabelGen
+
+
+class TestFeatureCodec(unittest.TestCase):
+
+    dim = 5
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir_out = os.path.join(os.path.dirname(os.path.realpath(__file__)), cls.__name__)
+
+    def setUp(self):
+        os.makedirs(self.dir_out, exist_ok=True)
+        random_state = numpy.random.RandomState(1)
+        self.feature = (random_state.randn(100, self.dim) * [1.0, 2.0, 0.1, 10.0, 0.0]
+                        + [5.0, 0.0, -1.0, 100.0, 3.0]).astype(numpy.float32)
+        self.file_path = os.path.join(self.dir_out, "test.feat")
+        self.feature.tofile(self.file_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_out)
+
+    def test_encode_decode(self):
+        norm_params = (self.feature.mean(axis=0), self.feature.std(axis=0))
+        for dtype, norm_params, tolerance in [("float16", None, 0.1), ("int16", None, 0.002),
+                                              ("int16", norm_params, 0.002)]:
+            for compression in FeatureCodec.compressions:
+                codec = FeatureCodec(dtype, compression, norm_params=norm_params)
+                feature, decoded = codec.encode_file(self.file_path, self.dim)
+
+                numpy.testing.assert_array_equal(self.feature, feature)
+                self.assertEqual(numpy.float32, decoded.dtype)
+                numpy.testing.assert_allclose(self.feature, decoded, rtol=1e-3, atol=tolerance,
+                                              err_msg="{} {}".format(dtype, compression))
+                self.assertLess(os.path.getsize(self.file_path + "." + FeatureCodec.ext),
+                                os.path.getsize(self.file_path))
+
+        with self.assertRaises(ValueError):
+            FeatureCodec("float16").encode(numpy.full((2, 1), 1e6))
+
+    def test_load_frames(self):
+        for compression in FeatureCodec.compressions:
+            FeatureCodec("int16", compression).encode_file(self.file_path, self.dim)
+            decoded = FeatureCodec.decode_file(self.file_path + "." + FeatureCodec.ext)
+            raw = FeatureCodec.load_frames(self.file_path, self.dim, 10, 20)
+            numpy.testing.assert_array_equal(self.feature[10:30].reshape(-1), raw)
+
+            os.rename(self.file_path, self.file_path + ".bak")
+            self.assertTrue(FeatureCodec.exists(self.file_path))
+            self.assertEqual(len(self.feature), FeatureCodec.get_num_frames(self.file_path, self.dim))
+            numpy.testing.assert_array_equal(decoded[10:30].reshape(-1),
+                                             FeatureCodec.load_frames(self.file_path, self.dim, 10, 20))
+            numpy.testing.assert_array_equal(decoded[90:].reshape(-1),
+                                             FeatureCodec.load_frames(self.file_path, self.dim, 90, 20))
+            os.rename(self.file_path + ".bak", self.file_path)
+
+        os.remove(self.file_path + "." + FeatureCodec.ext)
+        os.remove(self.file_path)
+        self.assertFalse(FeatureCodec.exists(self.file_path))
+        with self.assertRaises(FileNotFoundError):
+            FeatureCodec.load_frames(self.file_path, self.dim)
+
+    def test_question_labels(self):
+        num_questions = 409
+        id_name = "LJ001-0001"
+        sample = QuestionLabelGen.load_sample(id_name, os.path.join("integration", "fixtures", "questions"),
+                                              num_questions)
+        file_path = os.path.join(self.dir_out, id_name + QuestionLabelGen.ext_question)
+        FeatureCodec("float16", "zlib").save(sample, file_path)
+
+        label_gen = QuestionLabelGen(self.dir_out, num_questions)
+        self.assertEqual(len(sample), label_gen.get_length(id_name))
+        numpy.testing.assert_allclose(sample, QuestionLabelGen.load_sample(id_name, self.dir_out, num_questions),
+                                      rtol=1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import numpy
+import torch
+
+from idiaptts.src.data_preparation.LengthBucketBatchSampler import LengthBucketBatchSampler
+
+
+class TestLengthBucketBatchSampler(unittest.TestCase):
+
+    def test_frame_budget(self):
+        torch.manual_seed(42)
+        lengths = numpy.random.RandomState(42).randint(10, 500, size=200)
+        max_frames = 1000
+        sampler = LengthBucketBatchSampler(lengths, max_frames, num_buckets=5, shuffle=True)
+
+        for _ in range(2):  # Two epochs with different plans.
+            all_indices = list()
+            for batch in sampler:
+                self.assertGreater(len(batch), 0)
+                if len(batch) > 1:
+                    self.assertLessEqual(len(batch) * lengths[batch].max(), max_frames)
+                all_indices.extend(batch)
+            self.assertEqual(list(range(len(lengths))), sorted(all_indices), msg="Each sample has to be used once.")
+
+    def test_num_replicas(self):
+        lengths = numpy.random.RandomState(42).randint(10, 500, size=101)
+        samplers = [LengthBucketBatchSampler(lengths, 1000, num_buckets=5, shuffle=True, num_replicas=3, rank=rank)
+                    for rank in range(3)]
+
+        for _ in range(2):  # Two epochs with different plans.
+            all_batches = [list(sampler) for sampler in samplers]
+            self.assertEqual(1, len(set(len(batches) for batches in all_batches)))
+            all_indices = [index for batches in all_batches for batch in batches for index in batch]
+            self.assertEqual(list(range(len(lengths))), sorted(set(all_indices)), msg="Each sample has to be used.")
+
+    def test_set_epoch(self):
+        lengths = numpy.random.RandomState(42).randint(10, 500, size=101)
+        sampler = LengthBucketBatchSampler(lengths, 1000, num_buckets=5, shuffle=True, num_replicas=2, rank=0)
+        list(sampler)  # First epoch.
+        sampler.set_epoch(2)
+        resumed_sampler = LengthBucketBatchSampler(lengths, 1000, num_buckets=5, shuffle=True, num_replicas=2, rank=0)
+        resumed_sampler.set_epoch(2)
+
+        self.assertEqual(list(sampler), list(resumed_sampler))
+        resumed_sampler.set_epoch(3)
+        self.assertNotEqual(list(sampler), list(resumed_sampler))
+
+    def test_empty_replica(self):
+        lengths = numpy.full(3, 10)
+        samplers = [LengthBucketBatchSampler(lengths, 20, num_buckets=1, shuffle=False, num_replicas=3, rank=rank,
+                                             pad_replicas=False) for rank in range(3)]
+        self.assertEqual([[[0, 1]], [[2]], []], [list(sampler) for sampler in samplers])
+
+    def test_common_divisor(self):
+        lengths = numpy.arange(1, 50)
+        sampler = LengthBucketBatchSampler(lengths, 100, num_buckets=3, shuffle=False, common_divisor=2)
+        batches = list(sampler)
+        self.assertEqual(len(batches), len(sampler))
+        for batch in batches:
+            self.assertEqual(0, len(batch) % 2)
+        self.assertEqual(list(range(len(lengths))), sorted(set(index for batch in batches for index in batch)))
+
+    def test_bucket_tail(self):
+        lengths = numpy.full(7, 10)
+        sampler = LengthBucketBatchSampler(lengths, 50, num_buckets=1, shuffle=False, common_divisor=2)
+        self.assertEqual([[0, 1, 2, 3], [4, 5], [6, 6]], list(sampler))
+
+        sampler = LengthBucketBatchSampler(lengths, 50, num_buckets=1, shuffle=False, common_divisor=2,
+                                           drop_last=True)
+        self.assertEqual([[0, 1, 2, 3]], list(sampler))
+
+    def test_padding_efficiency(self):
+        torch.manual_seed(42)
+        lengths = numpy.array([10, 100] * 20)
+        # A single shuffled bucket mixes the lengths in its batches.
+        unbucketed = LengthBucketBatchSampler(lengths, 400, num_buckets=1, shuffle=True, max_batch_size=2)
+        bucketed = LengthBucketBatchSampler(lengths, 400, num_buckets=2, shuffle=True, max_batch_size=2)
+
+        efficiencies = list()
+        for sampler in (unbucketed, bucketed):
+            batches = list(sampler)
+            efficiencies.append(sum(lengths[batch].sum() for batch in batches)
+                                / sum(len(batch) * lengths[batch].max() for batch in batches))
+            self.assertAlmostEqual(efficiencies[-1], sampler.get_padding_efficiency())
+
+        self.assertLess(efficiencies[0], 1.0)
+        self.assertAlmostEqual(1.0, efficiencies[1])
@@ -0,0 +1,39 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import numpy
+
+from idiaptts.src.data_preparation.NormTransform import NormTransform
+
+
+class TestNormTransform(unittest.TestCase):
+
+    def test_min_max(self):
+        samples_min = numpy.array([0.0, 1.0, 2.0, -3.0])
+        samples_max = numpy.array([1.0, 1.0, 1.0, 5.0])  # Constant and min > max features are sanitised.
+        sample = numpy.array([[0.5, 1.0, 2.5, 1.0], [1.0, 2.0, 3.0, -3.0]], dtype=numpy.float32)
+
+        norm_transform = NormTransform.from_min_max(samples_min, samples_max)
+        normalised = norm_transform.apply(sample)
+
+        self.assertEqual(numpy.float32, normalised.dtype)
+        numpy.testing.assert_allclose([[0.5, 0.0, 0.5, 0.5], [1.0, 1.0, 1.0, 0.0]], normalised, atol=1e-7)
+        numpy.testing.assert_allclose(sample, norm_transform.invert(normalised), atol=1e-6)
+        numpy.testing.assert_array_equal([1.0, 1.0, 1.0, 5.0], samples_max)  # Parameters are not modified.
+
+    def test_apply_in_place(self):
+        mean = numpy.array([[1.0, -2.0]])
+        std_dev = numpy.array([[2.0, 0.5]])
+        sample = numpy.array([[3.0, -1.0], [1.0, -2.5]], dtype=numpy.float32)
+        expected = numpy.float32((sample - mean) / std_dev)
+
+        norm_transform = NormTransform.from_mean_std_dev(mean, std_dev)
+        normalised = norm_transform.apply(sample, out=sample)
+
+        self.assertIs(sample, normalised)
+        numpy.testing.assert_allclose(expected, normalised, rtol=1e-6)
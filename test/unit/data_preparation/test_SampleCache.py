@@ -0,0 +1,42 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import numpy
+
+from idiaptts.src.data_preparation.SampleCache import SampleCache
+
+
+class TestSampleCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = SampleCache(max_bytes=100)
+        cache.put("a", numpy.zeros(8))  # 64 bytes.
+        cache.put("b", (numpy.zeros(2), None))  # 16 bytes.
+        self.assertIsNotNone(cache.get("a"))  # "b" is now the least recently used entry.
+        cache.put("c", numpy.zeros(4))  # Does not fit, evicts "b" only.
+
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(64 + 32, cache.current_bytes)
+
+    def test_hit_miss_counters(self):
+        cache = SampleCache(max_bytes=1024)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", numpy.zeros(4))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_too_large_entry(self):
+        cache = SampleCache(max_bytes=10)
+        cache.put("a", numpy.zeros(100))
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.current_bytes)
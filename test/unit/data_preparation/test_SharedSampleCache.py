@@ -0,0 +1,98 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import gc
+import os
+import numpy
+from torch.utils.data import DataLoader, Dataset
+
+from idiaptts.src.data_preparation.SharedSampleCache import SharedSampleCache
+
+
+class CachedDataset(Dataset):
+    """Dataset which creates its samples on a cache miss."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, item):
+        if self.cache.get(item) is None:
+            self.cache.put(item, (numpy.full((3, 2), item, dtype=numpy.float32), None))
+        return os.getpid()
+
+
+class TestSharedSampleCache(unittest.TestCase):
+
+    def test_put_get(self):
+        cache = SharedSampleCache(max_bytes=100)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", numpy.arange(8.0))  # 64 bytes.
+        cache.put("b", (numpy.zeros(2), None))  # 16 bytes.
+        cache.put("b", (numpy.ones(2), None))  # Already cached, neither written nor counted again.
+
+        numpy.testing.assert_array_equal(numpy.arange(8.0), cache.get("a"))
+        labels_in, labels_out = cache.get("b")
+        numpy.testing.assert_array_equal(numpy.zeros(2), labels_in)
+        self.assertIsNone(labels_out)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(64 + 16, cache.current_bytes)
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+        # Returned arrays are copies.
+        cache.get("a")[0] = -1.0
+        self.assertEqual(0.0, cache.get("a")[0])
+
+        cache.put("c", numpy.zeros(4))  # Does not fit behind b, evicts a.
+        self.assertNotIn("a", cache)
+        self.assertIsNone(cache.get("a"))
+        self.assertIn("b", cache)
+        numpy.testing.assert_array_equal(numpy.zeros(4), cache.get("c"))
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+
+        cache.put("d", numpy.zeros(20))  # Larger than the whole budget.
+        self.assertNotIn("d", cache)
+
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.current_bytes)
+
+    def test_open_files(self):
+        cache = SharedSampleCache(max_bytes=1024 ** 2)
+        cache.get("a")
+        cache.put("a", numpy.zeros(2))
+        cache.get("a")
+        num_open_files = len(os.listdir("/proc/self/fd"))
+
+        for item in range(200):
+            cache.put(item, (numpy.full((3, 2), item, dtype=numpy.float32), numpy.zeros(4)))
+            numpy.testing.assert_array_equal(numpy.full((3, 2), item), cache.get(item)[0])
+        self.assertEqual(num_open_files, len(os.listdir("/proc/self/fd")))
+
+    def test_shared_by_workers(self):
+        cache = SharedSampleCache(max_bytes=1024)
+        dataset = CachedDataset(cache)
+        worker_pids = set(DataLoader(dataset, batch_size=1, num_workers=2, collate_fn=lambda batch: batch[0]))
+
+        self.assertNotIn(os.getpid(), worker_pids)
+        self.assertEqual(len(dataset), len(cache))
+        for item in range(len(dataset)):
+            numpy.testing.assert_array_equal(numpy.full((3, 2), item), cache.get(item)[0])
+        self.assertEqual(len(dataset) * 32, cache.current_bytes)  # 24 bytes per sample aligned to 16 bytes.
+
+        dir_cache = cache.dir_cache
+        del cache, dataset
+        gc.collect()
+        self.assertFalse(os.path.exists(dir_cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
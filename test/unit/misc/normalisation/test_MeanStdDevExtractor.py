@@ -0,0 +1,70 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import numpy
+
+from idiaptts.misc.normalisation.MeanStdDevExtractor import MeanStdDevExtractor
+from idiaptts.misc.normalisation.MeanCovarianceExtractor import MeanCovarianceExtractor
+from idiaptts.misc.normalisation.MinMaxExtractor import MinMaxExtractor
+
+
+class TestMeanStdDevExtractor(unittest.TestCase):
+
+    @staticmethod
+    def _get_samples():
+        return [numpy.random.rand(length, 4).astype(numpy.float32) for length in (10, 3, 25, 7)]
+
+    def test_merge(self):
+        samples = self._get_samples()
+
+        for extractor_class in (MeanStdDevExtractor, MeanCovarianceExtractor):
+            serial_extractor = extractor_class()
+            merged_extractor = extractor_class()
+            for sample in samples:
+                serial_extractor.add_sample(sample)
+                sample_extractor = extractor_class()
+                sample_extractor.add_sample(sample)
+                merged_extractor.merge(sample_extractor)
+
+            # Merging the extractors of single samples in order has to be exact.
+            self.assertEqual(serial_extractor.sum_length, merged_extractor.sum_length)
+            for serial_param, merged_param in zip(serial_extractor.get_params(), merged_extractor.get_params()):
+                numpy.testing.assert_array_equal(serial_param, merged_param,
+                                                 err_msg="Merge of {} is not exact.".format(extractor_class.__name__))
+
+    def test_remove_sample(self):
+        samples = self._get_samples()
+
+        for extractor_class in (MeanStdDevExtractor, MeanCovarianceExtractor):
+            extractor = extractor_class()
+            for sample in samples:
+                extractor.add_sample(sample)
+            extractor.remove_sample(samples[1])
+
+            expected_extractor = extractor_class()
+            for sample in samples[:1] + samples[2:]:
+                expected_extractor.add_sample(sample)
+
+            self.assertEqual(expected_extractor.sum_length, extractor.sum_length)
+            for expected_param, param in zip(expected_extractor.get_params(), extractor.get_params()):
+                numpy.testing.assert_allclose(expected_param, param, rtol=1e-4, atol=1e-6)
+
+    def test_merge_min_max(self):
+        samples = self._get_samples()
+
+        serial_extractor = MinMaxExtractor()
+        merged_extractor = MinMaxExtractor()
+        merged_extractor.merge(MinMaxExtractor())  # Merging an empty extractor has no effect.
+        for sample in samples:
+            serial_extractor.add_sample(sample)
+            sample_extractor = MinMaxExtractor()
+            sample_extractor.add_sample(sample)
+            merged_extractor.merge(sample_extractor)
+
+        for serial_param, merged_param in zip(serial_extractor.get_params(), merged_extractor.get_params()):
+            numpy.testing.assert_array_equal(serial_param, merged_param)
@@ -0,0 +1,46 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import numpy
+
+from idiaptts.misc.utils import interpolate_lin
+
+
+class TestUtils(unittest.TestCase):
+
+    def test_interpolate_lin(self):
+        lf0 = numpy.array([0, 0, 2, 0, 0, 5, 4, 0, 0, 0], dtype=numpy.float32)
+        ip_lf0, vuv = interpolate_lin(lf0)
+
+        # Leading gap with first, trailing gap with last value, interpolation reaches 5 one frame early.
+        expected = numpy.array([2, 2, 2, 3.5, 5, 5, 4, 4, 4, 4], dtype=numpy.float32)[:, None]
+        numpy.testing.assert_array_equal(expected, ip_lf0)
+        self.assertEqual(numpy.float32, ip_lf0.dtype)
+        numpy.testing.assert_array_equal((lf0 > 0)[:, None], vuv)
+
+    def test_interpolate_lin_gap_before_last_frame(self):
+        ip_lf0, _ = interpolate_lin(numpy.array([3, 0, 0, 6], dtype=numpy.float32))
+        numpy.testing.assert_array_equal(numpy.full((4, 1), 3, dtype=numpy.float32), ip_lf0)
+
+        ip_lf0, vuv = interpolate_lin(numpy.zeros(5))
+        numpy.testing.assert_array_equal(numpy.zeros((5, 1)), ip_lf0)
+        numpy.testing.assert_array_equal(numpy.zeros((5, 1)), vuv)
+
+    def test_interpolate_lin_batch(self):
+        lf0 = numpy.random.rand(3, 40).astype(numpy.float32) + 1.0
+        lf0[numpy.random.rand(3, 40) < 0.4] = 0.0
+
+        ip_lf0, vuv = interpolate_lin(lf0, axis=1)
+        self.assertEqual(lf0.shape, ip_lf0.shape)
+        for index in range(len(lf0)):
+            expected_lf0, expected_vuv = interpolate_lin(lf0[index])
+            numpy.testing.assert_array_equal(expected_lf0[:, 0], ip_lf0[index])
+            numpy.testing.assert_array_equal(expected_vuv[:, 0], vuv[index])
+
+        ip_lf0_t, _ = interpolate_lin(lf0.T, axis=0)
+        numpy.testing.assert_array_equal(ip_lf0, ip_lf0_t.T)
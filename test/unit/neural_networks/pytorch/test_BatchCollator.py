@@ -0,0 +1,61 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import numpy
+import torch
+
+from idiaptts.src.neural_networks.pytorch.BatchCollator import BatchCollator
+
+
+class TestBatchCollator(unittest.TestCase):
+
+    @staticmethod
+    def _get_batch():
+        # Longest input is not the longest target.
+        lengths = [(3, 4), (5, 2), (4, 6)]
+        return [(numpy.full((l_in, 2), i + 1, dtype=numpy.float32), numpy.full((l_out, 1), i + 1, dtype=numpy.float32))
+                for i, (l_in, l_out) in enumerate(lengths)]
+
+    def test_sort_pad_and_mask(self):
+        batch = self._get_batch()
+        for batch_first in [False, True]:
+            inputs, targets, seq_lengths_input, seq_lengths_target, mask, permutation =\
+                BatchCollator(batch_first=batch_first)(batch)
+
+            self.assertEqual((1, 2, 0), permutation)
+            self.assertEqual([5, 4, 3], seq_lengths_input.tolist())
+            self.assertEqual([2, 6, 4], seq_lengths_target.tolist())
+            if not batch_first:
+                inputs, targets, mask = inputs.transpose(0, 1), targets.transpose(0, 1), mask.transpose(0, 1)
+            self.assertEqual((3, 5, 2), tuple(inputs.shape))
+            self.assertEqual((3, 6, 1), tuple(targets.shape))
+            for batch_index, sample_index in enumerate(permutation):
+                length_in, length_out = len(batch[sample_index][0]), len(batch[sample_index][1])
+                self.assertTrue((inputs[batch_index, :length_in] == sample_index + 1).all())
+                self.assertTrue((inputs[batch_index, length_in:] == 0).all())
+                self.assertTrue((targets[batch_index, :length_out] == sample_index + 1).all())
+                self.assertTrue((targets[batch_index, length_out:] == 0).all())
+                self.assertEqual(length_out, int(mask[batch_index].sum()))
+
+    def test_no_mask_for_equal_lengths(self):
+        batch = [(numpy.ones((4, 2), dtype=numpy.float32), numpy.ones((4, 1), dtype=numpy.float32))] * 2
+        self.assertIsNone(BatchCollator()(batch)[4])
+        self.assertIsNone(BatchCollator()(batch[:1])[4])
+
+    def test_buffer_reuse(self):
+        batch = self._get_batch()
+        expected = BatchCollator()(batch)
+        collator = BatchCollator(num_buffers=2)
+        for _ in range(3):
+            output = collator(batch)
+            for expected_tensor, tensor in zip(expected[:5], output[:5]):
+                self.assertTrue(torch.equal(expected_tensor, tensor))
+        # Shorter batch after longer one has to be padded with zeros again.
+        output = collator(batch[:1] * 2)
+        self.assertEqual(3, output[0].shape[0])
+        self.assertIsNone(output[4])
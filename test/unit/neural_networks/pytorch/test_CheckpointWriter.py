@@ -0,0 +1,63 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import os
+import shutil
+import torch
+
+from idiaptts.src.neural_networks.pytorch.CheckpointWriter import CheckpointWriter
+
+
+class TestCheckpointWriter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir_out = os.path.join(os.path.dirname(os.path.realpath(__file__)), cls.__name__)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_out, ignore_errors=True)
+
+    def test_snapshot(self):
+        model = torch.nn.Linear(3, 2)
+        writer = CheckpointWriter()
+        file_path = os.path.join(self.dir_out, "test-e1")
+        writer.save({"": {"epoch": 1, "model_state_dict": model.state_dict()}}, file_path)
+        expected = model.weight.detach().clone()
+        with torch.no_grad():
+            model.weight.add_(1.0)  # Training continues while the checkpoint is written.
+        writer.wait()
+
+        self.assertTrue(torch.equal(expected, torch.load(file_path)["model_state_dict"]["weight"]))
+        self.assertEqual([os.path.basename(file_path)], os.listdir(self.dir_out))
+
+    def test_best_link(self):
+        writer = CheckpointWriter(asynchronous=False)
+        file_path = os.path.join(self.dir_out, "test-e2")
+        best_path = os.path.join(self.dir_out, "test-best")
+        writer.save({"": {"epoch": 2}, "_ema": {"epoch": 2}}, file_path, best_path, loss=1.0)
+
+        for suffix in ["", "_ema"]:
+            self.assertTrue(os.path.samefile(file_path + suffix, best_path + suffix))
+
+        # Best checkpoint is replaced and not changed through the link.
+        writer.save({"": {"epoch": 3}, "_ema": {"epoch": 3}}, file_path, loss=1.0)
+        self.assertEqual(2, torch.load(best_path)["epoch"])
+        self.assertEqual(3, torch.load(file_path)["epoch"])
+
+    def test_retention(self):
+        writer = CheckpointWriter(keep_last=2, keep_best=1)
+        losses = [3.0, 1.0, 2.0, 4.0, 5.0]
+        for epoch, loss in enumerate(losses):
+            writer.save({"": {"epoch": epoch}}, os.path.join(self.dir_out, "test-e{}".format(epoch)), loss=loss)
+        writer.wait()
+
+        self.assertEqual(["test-e1", "test-e3", "test-e4"], sorted(os.listdir(self.dir_out)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import copy
+import torch
+
+from idiaptts.src.neural_networks.pytorch.ExponentialMovingAverage import ExponentialMovingAverage
+
+
+class TestExponentialMovingAverage(unittest.TestCase):
+
+    @staticmethod
+    def _get_models():
+        torch.manual_seed(1)
+        model = torch.nn.Sequential(torch.nn.Linear(4, 3), torch.nn.ReLU(), torch.nn.Linear(3, 2))
+        return model, copy.deepcopy(model)
+
+    @staticmethod
+    def _step(model):
+        with torch.no_grad():
+            for param in model.parameters():
+                param.add_(torch.randn_like(param))
+
+    def test_update_params(self):
+        decay = 0.9
+        model, average_model = self._get_models()
+        expected = copy.deepcopy(average_model.state_dict())
+        ema = ExponentialMovingAverage(average_model, decay)
+
+        for _ in range(5):
+            self._step(model)
+            ema.update_params(model)
+            for name, param in model.named_parameters():
+                expected[name] = decay * expected[name] + (1.0 - decay) * param.data
+
+        for name, param in average_model.named_parameters():
+            self.assertTrue(torch.allclose(expected[name], param, atol=1e-6), msg=name)
+            self.assertEqual(ema.shadow[name].data_ptr(), param.data_ptr())
+
+    def test_update_interval(self):
+        decay = 0.9
+        update_interval = 3
+        model, average_model = self._get_models()
+        expected = copy.deepcopy(average_model.state_dict())
+        ema = ExponentialMovingAverage(average_model, decay, update_interval)
+
+        for step in range(1, 7):
+            self._step(model)
+            ema.update_params(model)
+            if step % update_interval == 0:
+                for name, param in model.named_parameters():
+                    expected[name] = decay ** update_interval * expected[name]\
+                                     + (1.0 - decay ** update_interval) * param.data
+            for name, param in average_model.named_parameters():
+                self.assertTrue(torch.allclose(expected[name], param, atol=1e-6), msg="{} {}".format(step, name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#
+# Copyright (c) 2019 Idiap Research Institute, http://www.idiap.ch/
+# Written by Bastian Schnell <bastian.schnell@idiap.ch>
+#
+
+
+import unittest
+
+import os
+import shutil
+import numpy
+import torch
+
+from idiaptts.src.data_preparation.questions.label_normalisation import HTSLabelNormalisation
+from idiaptts.src.data_preparation.questions.QuestionLabelGen import QuestionLabelGen
+from idiaptts.src.neural_networks.pytorch.BatchCollator import BatchCollator
+from idiaptts.src.neural_networks.pytorch.FrameExpansionCollator import FrameExpansionCollator
+
+
+class TestFrameExpansionCollator(unittest.TestCase):
+
+    label = "x^x-pau+ae=l@x_x/A:0_0_0/B:x-x-x@x-x&x-x#x-x$x-x!x-x;x-x|x/C:1+1+2/D:0_0/E:x+x@x+x&x+x#x+x/F:content_2" \
+            "/G:0_0/H:x=x@1=2|0/I:5=4/J:14+9-2[2]"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.file_questions = os.path.join("integration", "fixtures", "questions-en-radio_dnn_400.hed")
+        cls.dir_out = os.path.join(os.path.dirname(os.path.realpath(__file__)), cls.__name__)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_out, ignore_errors=True)
+
+    def _write_state_aligned_label(self, id_name, frames_per_state):
+        os.makedirs(self.dir_out, exist_ok=True)
+        file_name = os.path.join(self.dir_out, id_name + ".lab")
+        with open(file_name, "w") as f:
+            start_time = 0
+            for state_index, num_frames in enumerate(frames_per_state):
+                end_time = start_time + num_frames * 50000
+                f.write("{} {} {}[{}]\n".format(start_time, end_time, self.label, state_index % 5 + 2))
+                start_time = end_time
+        return file_name
+
+    @staticmethod
+    def _get_state_sample(state_frames, value):
+        """Create a state-level sample of one phone per five states with two questions."""
+        state_sample = numpy.zeros((len(state_frames), 2 + HTSLabelNormalisation.num_state_info), dtype=numpy.float32)
+        state_sample[:, :2] = value
+        for phone_start in range(0, len(state_frames), 5):
+            phone_frames = state_frames[phone_start:phone_start + 5]
+            for state_index, frame_number in enumerate(phone_frames):
+                state_sample[phone_start + state_index, 2:] = (frame_number, state_index + 1, sum(phone_frames),
+                                                               sum(phone_frames[:state_index]))
+        return state_sample
+
+    def test_expand(self):
+        state_sample = self._get_state_sample([2, 1, 1, 3, 1], 1)
+
+        frame_sample, = FrameExpansionCollator(subphone_feats="minimal_frame").expand([state_sample])
+
+        self.assertEqual((8, 4), frame_sample.shape)
+        numpy.testing.assert_array_equal(numpy.ones((8, 2)), frame_sample[:, :2])
+        numpy.testing.assert_allclose([0.5, 1, 1, 1, 1 / 3, 2 / 3, 1, 1], frame_sample[:, 2])  # Fraction through state.
+        numpy.testing.assert_array_equal([1, 1, 2, 3, 4, 4, 4, 5], frame_sample[:, 3])  # State index.
+
+    def test_call(self):
+        state_frames = [[1, 2, 1, 1, 1, 2, 2, 2, 2, 2], [3, 3, 3, 3, 3], [1, 1, 1, 1, 1]]
+        targets_lengths = [18, 14, 5]  # Longer, shorter, and equal to the number of frames.
+        batch = [(self._get_state_sample(frames, index), numpy.full((length, 1), index, dtype=numpy.float32))
+                 for index, (frames, length) in enumerate(zip(state_frames, targets_lengths))]
+        collator = FrameExpansionCollator(subphone_feats="full")
+
+        inputs, targets, seq_lengths_input, seq_lengths_target, mask, permutation = collator(batch)
+
+        frame_samples = collator.expand([sample[0] for sample in batch])
+        frame_batch = [(frame_samples[0], batch[0][1][1:17]),  # Target is trimmed at both ends.
+                       (frame_samples[1][:14], batch[1][1]),  # Input is trimmed at the end only.
+                       (frame_samples[2], batch[2][1])]
+        expected = BatchCollator()(frame_batch)
+        self.assertEqual((0, 1, 2), permutation)
+        self.assertEqual([16, 14, 5], seq_lengths_input.tolist())
+        for expected_tensor, tensor in zip(expected[:4], (inputs, targets, seq_lengths_input, seq_lengths_target)):
+            self.assertTrue(torch.equal(expected_tensor, tensor))
+
+    def test_equal_to_frame_level(self):
+        label_normaliser = HTSLabelNormalisation(self.file_questions)
+        frames_per_state = [[1, 2, 1, 1, 1, 2, 2, 3, 2, 2], [3, 1, 4, 1, 5]]
+        label_files = [self._write_state_aligned_label("utt{}".format(index), frames)
+                       for index, frames in enumerate(frames_per_state)]
+        frame_samples = [label_normaliser.load_labels_with_state_alignment(file_name) for file_name in label_files]
+        state_samples = [label_normaliser.load_state_labels_with_state_alignment(file_name)
+                         for file_name in label_files]
+        num_questions = label_normaliser.dimension
+        frame_gen = QuestionLabelGen(self.dir_out, num_questions)
+        state_gen = QuestionLabelGen(self.dir_out, num_questions, state_level=True)
+        all_frames = numpy.concatenate(frame_samples)
+        frame_gen.norm_params = state_gen.norm_params = (all_frames.min(axis=0), all_frames.max(axis=0))
+
+        expected = BatchCollator()([(frame_gen.preprocess_sample(sample), None) for sample in frame_samples])
+        collator = FrameExpansionCollator(norm_params=state_gen.get_frame_feature_norm_params())
+        batch = collator([(state_gen.preprocess_state_sample(sample), None) for sample in state_samples])
+
+        self.assertEqual(torch.float32, batch[0].dtype)
+        self.assertTrue(torch.equal(expected[0], batch[0]))  # Bit-identical to the frame-level inputs.
+        self.assertTrue(torch.equal(expected[2], batch[2]))
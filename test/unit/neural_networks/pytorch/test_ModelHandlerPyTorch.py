@@ -8,6 +8,7 @@ import unittest
 
 import os
 import shutil
+import copy
 import filecmp
 import torch
 import logging
@@ -22,6 +23,63 @@ from idiaptts.misc.utils import makedirs_safe
 from idiaptts.src.neural_networks.pytorch.utils import equal_checkpoint
 
 
+class LinearModel(torch.nn.Module):
+    """Minimal model with the interface expected by ModelHandlerPyTorch.process_dataloader."""
+
+    def __init__(self, dim_in, dim_out):
+        super().__init__()
+        self.linear = torch.nn.Linear(dim_in, dim_out)
+
+    def init_hidden(self, batch_size):
+        return None
+
+    def forward(self, inputs, hidden, seq_lengths_input, max_length_inputs, target=None, seq_lengths_target=None):
+        return self.linear(inputs), None
+
+
+def fit_linear_model(hparams, dataset, num_epochs=2):
+    """Train a LinearModel on the dataset and return the model handler and all losses."""
+    torch.manual_seed(42)
+    model_handler = ModelHandlerPyTorch()
+    model_handler.model = LinearModel(3, 2)
+    model_handler.set_dataset(hparams, dataset, dataset)
+    model_handler.optimiser = torch.optim.SGD(model_handler.model.parameters(), lr=0.1)
+    loss_function = torch.nn.MSELoss(reduction="none")
+
+    losses = [model_handler.train(hparams, epoch, epoch, loss_function) for epoch in range(1, num_epochs + 1)]
+    losses.append(model_handler.test(hparams, num_epochs, num_epochs, loss_function)[0])
+    return model_handler, losses
+
+
+def train_linear_model(out_dir, distributed_backend, batch_size):
+    """Train a LinearModel for two epochs and save its parameters and losses in out_dir."""
+    hparams = ModelTrainer.create_hparams()
+    hparams.distributed_backend = distributed_backend
+    hparams.batch_size_train = batch_size
+    hparams.batch_size_val = batch_size
+    hparams.dataset_num_workers_cpu = 0
+    hparams.shuffle_train_set = False
+    if distributed_backend is not None:
+        ModelHandlerPyTorch.init_distributed(hparams)
+
+    random_state = numpy.random.RandomState(42)
+    dataset = [(random_state.randn(5, 3).astype(numpy.float32), random_state.randn(5, 2).astype(numpy.float32))
+               for _ in range(8)]
+    model_handler, losses = fit_linear_model(hparams, dataset)
+
+    # Validation shards of different size are not padded, so the loss equals the one of a single process.
+    hparams.batch_size_val = 1
+    model_handler.set_dataset(hparams, dataset, dataset[:7])
+    loss_val = model_handler.test(hparams, 2, 2, torch.nn.MSELoss(reduction="none"))[0]
+    # With a single validation sample the second process has an empty shard.
+    model_handler.set_dataset(hparams, dataset, dataset[:1])
+    loss_val_one = model_handler.test(hparams, 2, 2, torch.nn.MSELoss(reduction="none"))[0]
+
+    name = "rank{}".format(torch.distributed.get_rank()) if distributed_backend is not None else "single"
+    torch.save({"state_dict": model_handler.model.state_dict(), "loss": [float(loss) for loss in losses],
+                "loss_val": float(loss_val), "loss_val_one": float(loss_val_one)}, os.path.join(out_dir, name + ".pt"))
+
+
 class TestModelHandlerPyTorch(unittest.TestCase):
 
     out_dir = None
@@ -59,3 +117,148 @@ class TestModelHandlerPyTorch(unittest.TestCase):
         self.assertTrue(equal_checkpoint(model_path, model_copy_path), "Loaded and saved models are not the same.")
 
         shutil.rmtree(hparams.out_dir)
+
+    def test_distributed_gloo(self):
+        out_dir = os.path.join(self.out_dir, "test_distributed_gloo")
+        makedirs_safe(out_dir)
+
+        # Two processes with two samples per batch are equal to one process with four samples per batch.
+        ModelHandlerPyTorch.spawn_distributed(train_linear_model, 2, args=(out_dir, "gloo", 2))
+        train_linear_model(out_dir, None, 4)
+
+        single = torch.load(os.path.join(out_dir, "single.pt"))
+        for rank in range(2):
+            distributed = torch.load(os.path.join(out_dir, "rank{}.pt".format(rank)))
+            numpy.testing.assert_allclose(single["loss"], distributed["loss"], rtol=1e-5)
+            numpy.testing.assert_allclose(single["loss_val"], distributed["loss_val"], rtol=1e-5)
+            numpy.testing.assert_allclose(single["loss_val_one"], distributed["loss_val_one"], rtol=1e-5)
+            for name, param in single["state_dict"].items():
+                numpy.testing.assert_allclose(param.numpy(), distributed["state_dict"][name].numpy(), atol=1e-6)
+
+        shutil.rmtree(out_dir)
+
+    def test_accumulation_steps(self):
+        random_state = numpy.random.RandomState(42)
+        dataset = [(random_state.randn(length, 3).astype(numpy.float32),
+                    random_state.randn(length, 2).astype(numpy.float32)) for length in [3, 7, 5, 2, 6, 4, 8, 1]]
+
+        for loss_per_sample in [False, True]:
+            hparams = ModelTrainer.create_hparams()
+            hparams.dataset_num_workers_cpu = 0
+            hparams.shuffle_train_set = False
+            hparams.loss_per_sample = loss_per_sample
+            hparams.batch_size_train = 4
+            model_handler, _ = fit_linear_model(hparams, dataset)
+
+            # Two accumulated batches of two samples are one update with a batch of four samples.
+            hparams.batch_size_train = 2
+            hparams.accumulation_steps = 2
+            model_handler_accumulated, _ = fit_linear_model(hparams, dataset)
+
+            for param, param_accumulated in zip(model_handler.model.parameters(),
+                                                model_handler_accumulated.model.parameters()):
+                numpy.testing.assert_allclose(param.detach().numpy(), param_accumulated.detach().numpy(), atol=1e-6,
+                                              err_msg="loss_per_sample={}".format(loss_per_sample))
+
+    def test_nan_check_interval(self):
+        random_state = numpy.random.RandomState(42)
+        dataset = [(random_state.randn(5, 3).astype(numpy.float32), random_state.randn(5, 2).astype(numpy.float32))
+                   for _ in range(8)]
+        dataset[5][0][1, 1] = numpy.nan  # Third batch of two samples.
+
+        hparams = ModelTrainer.create_hparams()
+        hparams.dataset_num_workers_cpu = 0
+        hparams.shuffle_train_set = False
+        hparams.batch_size_train = 2
+        hparams.nan_check_interval = 4
+        torch.manual_seed(42)
+        model_handler = ModelHandlerPyTorch()
+        model_handler.model = LinearModel(3, 2)
+        initial_state_dict = {name: param.clone() for name, param in model_handler.model.state_dict().items()}
+        model_handler.set_dataset(hparams, dataset, dataset)
+        model_handler.optimiser = torch.optim.SGD(model_handler.model.parameters(), lr=0.1)
+
+        loss = model_handler.train(hparams, 1, 1, torch.nn.MSELoss(reduction="none"))
+
+        # The NaN is found after the fourth batch, all updates since the start of the epoch are rolled back.
+        self.assertTrue(numpy.isnan(loss))
+        for name, param in model_handler.model.state_dict().items():
+            numpy.testing.assert_array_equal(initial_state_dict[name].numpy(), param.numpy())
+
+    def test_resume_scheduler_with_accumulation_steps(self):
+        random_state = numpy.random.RandomState(42)
+        dataset = [(random_state.randn(5, 3).astype(numpy.float32), random_state.randn(5, 2).astype(numpy.float32))
+                   for _ in range(10)]
+        loss_function = torch.nn.MSELoss(reduction="none")
+
+        for scheduler_type, scheduler_args in [("Noam", {"wormup_steps": 4}), ("Exponential", {"gamma": 0.9})]:
+            hparams = ModelTrainer.create_hparams()
+            hparams.dataset_num_workers_cpu = 0
+            hparams.shuffle_train_set = False
+            hparams.batch_size_train = 2
+            hparams.accumulation_steps = 2  # Three updates of five batches per epoch.
+            hparams.optimiser_args = {"lr": 0.1}
+            hparams.scheduler_type = scheduler_type
+            hparams.scheduler_args = scheduler_args
+
+            torch.manual_seed(42)
+            model_handler = ModelHandlerPyTorch()
+            model_handler.model = LinearModel(3, 2)
+            model_handler.set_dataset(hparams, dataset, dataset)
+            model_handler.set_optimiser(hparams)
+            model_handler.set_scheduler(hparams, 0)
+            model_handler.train(hparams, 1, 1, loss_function)
+            model_state = copy.deepcopy(model_handler.model.state_dict())
+            optimiser_state = copy.deepcopy(model_handler.optimiser.state_dict())
+            expected_lr = model_handler.optimiser.param_groups[0]["lr"]
+            model_handler.train(hparams, 2, 2, loss_function)
+
+            # Resume after the first epoch.
+            resumed_handler = ModelHandlerPyTorch()
+            resumed_handler.model = LinearModel(3, 2)
+            resumed_handler.model.load_state_dict(model_state)
+            resumed_handler.set_dataset(hparams, dataset, dataset)
+            resumed_handler.set_optimiser(hparams)
+            resumed_handler.optimiser.load_state_dict(optimiser_state)
+            resumed_handler.set_scheduler(hparams, 1)
+            self.assertAlmostEqual(expected_lr, resumed_handler.optimiser.param_groups[0]["lr"], msg=scheduler_type)
+            resumed_handler.train(hparams, 2, 1, loss_function)
+
+            self.assertAlmostEqual(model_handler.optimiser.param_groups[0]["lr"],
+                                   resumed_handler.optimiser.param_groups[0]["lr"], msg=scheduler_type)
+            for param, resumed_param in zip(model_handler.model.parameters(), resumed_handler.model.parameters()):
+                numpy.testing.assert_allclose(param.detach().numpy(), resumed_param.detach().numpy(), atol=1e-6,
+                                              err_msg=scheduler_type)
+
+    def test_replace_inf_grads_by_zero(self):
+        grads = [torch.tensor([1.0, float("inf")]), torch.tensor([[-float("inf"), float("nan")], [2.0, 3.0]])]
+        num_inf_updates = torch.zeros(1)
+
+        ModelHandlerPyTorch._replace_inf_grads_by_zero(grads, num_inf_updates)
+        ModelHandlerPyTorch._replace_inf_grads_by_zero([torch.ones(3)], num_inf_updates)  # Finite gradients.
+
+        numpy.testing.assert_array_equal([1.0, 0.0], grads[0].numpy())
+        numpy.testing.assert_array_equal([[0.0, numpy.nan], [2.0, 3.0]], grads[1].numpy())
+        self.assertEqual(1, int(num_inf_updates))
+
+    def test_training_state_buffers(self):
+        model_handler = ModelHandlerPyTorch()
+        model_handler.model = LinearModel(3, 2)
+        model_handler.optimiser = torch.optim.Adam(model_handler.model.parameters(), lr=0.1)
+        model_handler.model(torch.ones(1, 3), None, None, None)[0].sum().backward()
+        model_handler.optimiser.step()
+
+        state = model_handler._get_training_state()
+        weight_buffer = state[0]["linear.weight"]
+        exp_avg_buffer = state[1]["state"][0]["exp_avg"]
+        with torch.no_grad():
+            model_handler.model.linear.weight.add_(1.0)
+        model_handler.optimiser.step()
+        state = model_handler._get_training_state(state)
+
+        # The copies are written into the buffers of the previous state.
+        self.assertIs(weight_buffer, state[0]["linear.weight"])
+        self.assertIs(exp_avg_buffer, state[1]["state"][0]["exp_avg"])
+        self.assertTrue(torch.equal(model_handler.model.linear.weight, weight_buffer))
+        self.assertTrue(torch.equal(model_handler.optimiser.state_dict()["state"][0]["exp_avg"], exp_avg_buffer))
+        self.assertIsNot(model_handler.model.linear.weight, weight_buffer)
@@ -97,6 +97,54 @@ class TestRNNDyn(unittest.TestCase):
         self.assertEqual(torch.Size([32 * 4, 32 * 2 + emb_dim]), model[4].weight_ih_l0_reverse.shape)
         pass
 
+    def test_sparse_input(self):
+        hparams = ModelTrainer.create_hparams()
+        num_binary = 20
+        num_continuous = 5
+        num_active = 4
+        out_dim = 12
+        hparams.variable_sequence_length_train = True
+        hparams.model_type = "RNNDYN-2_SparseRELU_32_{}_{}-1_BiGRU_16-1_FC_{}".format(num_binary, num_active,
+                                                                                     out_dim)
+        model = ModelFactory.create(hparams.model_type, (num_continuous + 2 * num_active,), out_dim, hparams)
+        hparams.model_type = "RNNDYN-2_RELU_32-1_BiGRU_16-1_FC_{}".format(out_dim)
+        dense_model = ModelFactory.create(hparams.model_type, (num_binary + num_continuous,), out_dim, hparams)
+        dense_model.load_state_dict(model.state_dict())
+        model.eval()
+        dense_model.eval()
+
+        self.assertEqual(torch.Size([32, num_binary + num_continuous]), model[0].weight.shape)
+        self.assertEqual(torch.Size([32, 32]), model[1].weight.shape)
+
+        # Random dense input with at most num_active non-zero binary inputs per frame, the last frames are padding.
+        seq_length = torch.tensor((10, 7), dtype=torch.long)
+        batch_size = 2
+        torch.manual_seed(1)
+        dense_input = torch.zeros([seq_length[0], batch_size, num_binary + num_continuous])
+        sparse_input = torch.zeros([seq_length[0], batch_size, num_continuous + 2 * num_active])
+        for frame in range(seq_length[0]):
+            for batch_idx in range(batch_size):
+                if frame >= seq_length[batch_idx]:
+                    continue
+                indices = torch.randperm(num_binary)[:torch.randint(num_active + 1, (1,)).item()]
+                continuous = torch.rand(num_continuous)
+                dense_input[frame, batch_idx, indices] = 1.0
+                dense_input[frame, batch_idx, num_binary:] = continuous
+                sparse_input[frame, batch_idx, :num_continuous] = continuous
+                sparse_input[frame, batch_idx, num_continuous:num_continuous + len(indices)] = indices.float()
+                sparse_input[frame, batch_idx, num_continuous + num_active:
+                                               num_continuous + num_active + len(indices)] = 1.0
+
+        model.init_hidden(batch_size)
+        dense_model.init_hidden(batch_size)
+        output = model(sparse_input, None, seq_length, seq_length[0])[0]
+        expected = dense_model(dense_input, None, seq_length, seq_length[0])[0]
+        numpy.testing.assert_allclose(expected.detach().numpy(), output.detach().numpy(), rtol=1e-5, atol=1e-6)
+
+        with self.assertRaises(ValueError):
+            hparams.model_type = "RNNDYN-1_RELU_32-1_SparseRELU_32_{}_{}".format(num_binary, num_active)
+            ModelFactory.create(hparams.model_type, (num_continuous + 2 * num_active,), out_dim, hparams)
+
     # def test_compare_to_recursive_matrix(self):
     #     """
     #     Compare the element-wise computed gradient matrix with the recursively generate matrix for alphas in